@@ -0,0 +1,263 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import subprocess
+import statistics
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+# --- TESTE DE CARGA CONCORRENTE (com relatório de SLO) ---
+# Simula N supervisores a navegar ao mesmo tempo, com a mistura de rotas e
+# períodos/pesquisas variados, e reporta por rota p50/p95/p99, throughput e
+# taxa de erros, mais a saturação do thread pool e o RSS de cada worker
+# (lidos do /metrics da app durante o teste).
+#
+# Tudo local (PostgREST local + app com 2 workers), níveis de 5, 10 e 20 utilizadores:
+#     python -m benchmarks.carga --arrancar --workers 2 --utilizadores 5 10 20
+# Contra uma app já a correr:
+#     python -m benchmarks.carga --url http://127.0.0.1:8000 --utilizadores 10
+#
+# O SLO por defeito é p95 < 2 s em todas as rotas; o relatório indica o
+# maior nível de concorrência que ainda o cumpre.
+
+# Proporções de cada rota (supervisores abrem muito mais o xadrez que a exportação)
+MISTURA_ROTAS = {
+    "/": 0.40,
+    "/incentivo": 0.22,
+    "/caixas": 0.22,
+    "/pagamento/exportar": 0.16,
+}
+PROB_PESQUISA = 0.25          # fração dos pedidos ao xadrez com pesquisa por nome
+PROB_PERIODO_CORRENTE = 0.70  # a maioria olha para o período atual (bate na cache)
+
+
+class Cenario:
+    """Gera os URLs dos pedidos (rota, datas e pesquisa) com semente."""
+
+    def __init__(self, inicio_dados: datetime.date, dias: int, semente: int):
+        from .dados_sinteticos import PRIMEIROS_NOMES, APELIDOS
+
+        self.rng = random.Random(semente)
+        self.inicio_dados = inicio_dados
+        self.dias = dias
+        self.termos = [n.lower() for n in PRIMEIROS_NOMES + APELIDOS]
+        self.rotas = list(MISTURA_ROTAS)
+        self.pesos = list(MISTURA_ROTAS.values())
+        # "Período atual": últimos 30 dias dos dados
+        self.corrente = (
+            inicio_dados + datetime.timedelta(days=max(0, dias - 30)),
+            inicio_dados + datetime.timedelta(days=dias - 1),
+        )
+
+    def _periodo(self) -> Tuple[datetime.date, datetime.date]:
+        if self.rng.random() < PROB_PERIODO_CORRENTE:
+            return self.corrente
+        duracao = self.rng.choice([7, 14, 15, 30, 31])
+        inicio = self.inicio_dados + datetime.timedelta(days=self.rng.randrange(max(1, self.dias - duracao)))
+        return inicio, inicio + datetime.timedelta(days=duracao - 1)
+
+    def proximo(self) -> Tuple[str, str]:
+        rota = self.rng.choices(self.rotas, self.pesos)[0]
+        inicio, fim = self._periodo()
+        params = {"data_inicio": inicio.isoformat(), "data_fim": fim.isoformat()}
+        if rota == "/" and self.rng.random() < PROB_PESQUISA:
+            params["search_query"] = self.rng.choice(self.termos)
+        if rota == "/" and self.rng.random() < 0.5:
+            params["view_mode"] = "resumo_detalhado"
+        return rota, rota + "?" + "&".join(f"{k}={v}" for k, v in params.items())
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+_RE_GAUGE = re.compile(r'^(processo_rss_bytes|threadpool_ocupadas|threadpool_limite|threadpool_em_espera)\{pid="(\d+)"\} (\S+)$', re.M)
+
+
+async def _amostrar_workers(cliente: httpx.AsyncClient, workers: Dict[str, Dict[str, float]], parar: asyncio.Event):
+    """
+    Lê o /metrics periodicamente. Cada leitura cai num worker qualquer; guarda
+    por pid o RSS máximo e a ocupação máxima do thread pool.
+    """
+    while not parar.is_set():
+        try:
+            texto = (await cliente.get("/metrics", timeout=5)).text
+            for nome, pid, valor in _RE_GAUGE.findall(texto):
+                w = workers.setdefault(pid, {})
+                w[nome] = max(w.get(nome, 0), float(valor))
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(parar.wait(), timeout=0.25)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _utilizador(
+    cliente: httpx.AsyncClient, cenario: Cenario, fim: float, pausa_ms: float, registos: List[Dict[str, Any]]
+):
+    while time.perf_counter() < fim:
+        rota, url = cenario.proximo()
+        inicio = time.perf_counter()
+        try:
+            resposta = await cliente.get(url)
+            status, tamanho = resposta.status_code, len(resposta.content)
+        except httpx.HTTPError as e:
+            status, tamanho = f"erro:{type(e).__name__}", 0
+        registos.append({"rota": rota, "status": status, "segundos": time.perf_counter() - inicio, "bytes": tamanho})
+        if pausa_ms:
+            await asyncio.sleep(cenario.rng.expovariate(1000 / pausa_ms))
+
+
+async def executar_nivel(
+    url: str, utilizadores: int, duracao: float, pausa_ms: float, cenario: Cenario, timeout: float
+) -> Dict[str, Any]:
+    registos: List[Dict[str, Any]] = []
+    workers: Dict[str, Dict[str, float]] = {}
+    limites = httpx.Limits(max_connections=utilizadores + 2, max_keepalive_connections=utilizadores + 2)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limites) as cliente:
+        parar = asyncio.Event()
+        amostrador = asyncio.create_task(_amostrar_workers(cliente, workers, parar))
+        inicio = time.perf_counter()
+        fim = inicio + duracao
+        await asyncio.gather(*(_utilizador(cliente, cenario, fim, pausa_ms, registos) for _ in range(utilizadores)))
+        decorrido = time.perf_counter() - inicio
+        parar.set()
+        await amostrador
+
+    rotas = {}
+    for rota in MISTURA_ROTAS:
+        do_tipo = [r for r in registos if r["rota"] == rota]
+        if not do_tipo:
+            continue
+        tempos = [r["segundos"] for r in do_tipo]
+        erros = sum(1 for r in do_tipo if not (isinstance(r["status"], int) and r["status"] < 400))
+        rotas[rota] = {
+            "pedidos": len(do_tipo),
+            "p50_s": round(_percentil(tempos, 50), 4),
+            "p95_s": round(_percentil(tempos, 95), 4),
+            "p99_s": round(_percentil(tempos, 99), 4),
+            "media_s": round(statistics.mean(tempos), 4),
+            "throughput_rps": round(len(do_tipo) / decorrido, 3),
+            "taxa_erros": round(erros / len(do_tipo), 4),
+        }
+    return {
+        "utilizadores": utilizadores,
+        "duracao_s": round(decorrido, 2),
+        "pedidos": len(registos),
+        "throughput_rps": round(len(registos) / decorrido, 3),
+        "rotas": rotas,
+        "workers": workers,
+    }
+
+
+def imprimir_nivel(resultado: Dict[str, Any], slo_p95: float) -> bool:
+    print(f"\n=== {resultado['utilizadores']} utilizadores: {resultado['pedidos']} pedidos em "
+          f"{resultado['duracao_s']} s ({resultado['throughput_rps']} req/s) ===")
+    print(f"{'rota':22s} {'pedidos':>8s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'req/s':>8s} {'erros':>7s}")
+    cumpre = True
+    for rota, r in resultado["rotas"].items():
+        falha = r["p95_s"] > slo_p95 or r["taxa_erros"] > 0
+        cumpre = cumpre and not falha
+        print(f"{rota:22s} {r['pedidos']:8d} {r['p50_s']:7.2f}s {r['p95_s']:7.2f}s {r['p99_s']:7.2f}s "
+              f"{r['throughput_rps']:8.2f} {r['taxa_erros']:6.1%}{'  <-- SLO' if falha else ''}")
+    for pid, w in sorted(resultado["workers"].items()):
+        print(f"  worker {pid}: RSS máx {w.get('processo_rss_bytes', 0) / 1024 / 1024:.0f} MB, "
+              f"thread pool máx {w.get('threadpool_ocupadas', 0):.0f}/{w.get('threadpool_limite', 0):.0f}, "
+              f"em espera máx {w.get('threadpool_em_espera', 0):.0f}")
+    return cumpre
+
+
+# --- Arranque local (PostgREST local + app) ---
+def _esperar(url: str, caminho: str, limite_s: float = 120):
+    fim = time.time() + limite_s
+    while time.time() < fim:
+        try:
+            if httpx.get(url + caminho, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url}{caminho} não ficou disponível em {limite_s} s")
+
+
+def arrancar_local(args) -> List[subprocess.Popen]:
+    raiz = Path(__file__).resolve().parent.parent
+    url_postgrest = f"http://127.0.0.1:{args.porta_postgrest}"
+    postgrest = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.postgrest_local",
+        "--viagens", str(args.viagens), "--semente", str(args.semente),
+        "--latencia-ms", str(args.latencia_ms), "--jitter-ms", str(args.jitter_ms),
+        "--porta", str(args.porta_postgrest),
+    ], cwd=raiz)
+    _esperar(url_postgrest, "/__estado")
+
+    env = {**os.environ, "SUPABASE_URL": url_postgrest, "SUPABASE_KEY": "local"}
+    porta_app = args.url.rsplit(":", 1)[-1].rstrip("/")
+    app = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app", "--port", porta_app,
+        "--workers", str(args.workers), "--log-level", "warning",
+    ], cwd=raiz, env=env)
+    _esperar(args.url, "/health/ready")
+    return [app, postgrest]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Teste de carga concorrente com relatório de SLO")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--utilizadores", type=int, nargs="+", default=[5, 10, 20])
+    parser.add_argument("--duracao", type=float, default=30, help="segundos por nível")
+    parser.add_argument("--pausa-ms", type=float, default=500, help="tempo médio entre pedidos de cada utilizador")
+    parser.add_argument("--slo-p95", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--inicio-dados", type=datetime.date.fromisoformat, default=datetime.date(2025, 9, 26))
+    parser.add_argument("--dias", type=int, default=60)
+    parser.add_argument("--saida", type=Path, help="grava o relatório em JSON")
+    # Arranque local
+    parser.add_argument("--arrancar", action="store_true", help="arranca o PostgREST local e a app")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--viagens", type=int, default=20_000)
+    parser.add_argument("--latencia-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--porta-postgrest", type=int, default=54321)
+    args = parser.parse_args(argv)
+
+    processos = arrancar_local(args) if args.arrancar else []
+    try:
+        cenario = Cenario(args.inicio_dados, args.dias, args.semente)
+        niveis, maior_ok = [], None
+        for n in args.utilizadores:
+            resultado = asyncio.run(executar_nivel(args.url, n, args.duracao, args.pausa_ms, cenario, args.timeout))
+            resultado["cumpre_slo"] = imprimir_nivel(resultado, args.slo_p95)
+            niveis.append(resultado)
+            if resultado["cumpre_slo"]:
+                maior_ok = n
+    finally:
+        for p in processos:
+            p.terminate()
+            p.wait()
+
+    print(f"\nSLO p95 < {args.slo_p95} s: "
+          + (f"cumprido até {maior_ok} utilizadores em simultâneo" if maior_ok else "não cumprido em nenhum nível"))
+    if args.saida:
+        args.saida.write_text(json.dumps({"slo_p95_s": args.slo_p95, "niveis": niveis}, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
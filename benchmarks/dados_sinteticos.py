@@ -0,0 +1,250 @@
+import datetime
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+
+# --- GERADOR DE DADOS SINTÉTICOS (com semente) ---
+# Gera as tabelas do Supabase (Distribuição, Cadastro, Caixas,
+# Resultados_Indicadores, Metas) com os mesmos nomes de colunas, tal como a
+# API as devolve (nomes com acentos e maiúsculas/minúsculas misturadas, COD
+# como texto, viagens duplicadas...). Serve para os benchmarks e para o
+# PostgREST local, sem precisar do projeto Supabase de produção.
+#
+# Uso:
+#     tabelas = gerar_tabelas(100_000, semente=42)
+#     entradas = preparar_entradas(tabelas)   # DataFrames como as rotas os recebem
+
+PRIMEIROS_NOMES = [
+    "João", "José", "Antônio", "Francisco", "Carlos", "Paulo", "Pedro", "Lucas", "Luiz", "Marcos",
+    "Luís", "Gabriel", "Rafael", "Daniel", "Marcelo", "Bruno", "Eduardo", "Felipe", "Raimundo", "Rodrigo",
+    "Sebastião", "André", "Fábio", "Márcio", "Júlio", "César", "Vinícius", "Thiago", "Leandro", "Ângelo",
+]
+APELIDOS = [
+    "Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves", "Pereira", "Lima", "Gomes",
+    "Costa", "Ribeiro", "Martins", "Carvalho", "Araújo", "Melo", "Barbosa", "Rocha", "Dias", "Nascimento",
+    "Andrade", "Moreira", "Nunes", "Marques", "Machado", "Mendes", "Freitas", "Cardoso", "Ramos", "Gonçalves",
+    "Conceição", "Assunção", "Brandão", "Falcão", "Simões", "Guimarães", "Magalhães", "Loureiro", "Sá", "Brito",
+]
+
+METAS_PADRAO = {
+    "dev_pdv_meta_perc": 4.0, "dev_pdv_premio": 100.0,
+    "rating_meta_perc": 90.0, "rating_premio": 80.0,
+    "refugo_meta_perc": 1.5, "refugo_premio": 50.0,
+    "meta_cx_dias_n1": 365, "meta_cx_valor_n1": 0.10,
+    "meta_cx_dias_n2": 730, "meta_cx_valor_n2": 0.15,
+    "meta_cx_dias_n3": 1825, "meta_cx_valor_n3": 0.20,
+    "meta_cx_dias_n4": 9999, "meta_cx_valor_n4": 0.25,
+}
+
+
+def _gerar_nomes(rng: np.random.Generator, n: int) -> np.ndarray:
+    primeiros = rng.choice(PRIMEIROS_NOMES, n)
+    meio = rng.choice(APELIDOS, n)
+    ultimos = rng.choice(APELIDOS, n)
+    nomes = np.char.add(np.char.add(np.char.add(primeiros, " "), np.char.add(meio, " ")), ultimos)
+    return nomes.astype(object)
+
+
+def _variar_escrita(rng: np.random.Generator, nomes: np.ndarray, taxa: float) -> np.ndarray:
+    """
+    Simula a digitação inconsistente da origem: parte dos nomes vem em
+    maiúsculas e parte com espaços a mais (o limpar_texto trata disto).
+    """
+    nomes = nomes.copy()
+    sorteio = rng.random(len(nomes))
+    maiusculas = sorteio < taxa / 2
+    espacos = (sorteio >= taxa / 2) & (sorteio < taxa)
+    nomes[maiusculas] = [n.upper() for n in nomes[maiusculas]]
+    nomes[espacos] = [f" {n} " for n in nomes[espacos]]
+    return nomes
+
+
+def _cpfs(rng: np.random.Generator, n: int) -> List[str]:
+    d = rng.integers(0, 1000, size=(n, 4))
+    d[:, 3] %= 100
+    return [f"{a:03d}.{b:03d}.{c:03d}-{e:02d}" for a, b, c, e in d]
+
+
+def _periodos_pagamento(inicio: datetime.date, fim: datetime.date) -> List[tuple]:
+    """Períodos de pagamento (dia 26 a dia 25) que cobrem [inicio, fim]."""
+    if inicio.day >= 26:
+        atual = inicio.replace(day=26)
+    else:
+        mes_anterior = inicio.replace(day=1) - datetime.timedelta(days=1)
+        atual = mes_anterior.replace(day=26)
+    periodos = []
+    while atual <= fim:
+        proximo = (atual.replace(day=1) + datetime.timedelta(days=32)).replace(day=26)
+        periodos.append((atual, proximo - datetime.timedelta(days=1)))
+        atual = proximo
+    return periodos
+
+
+def gerar_tabelas(
+    n_viagens: int = 10_000,
+    semente: int = 42,
+    data_inicio: datetime.date = datetime.date(2025, 9, 26),
+    dias: int = 60,
+    n_motoristas: Optional[int] = None,
+    estabilidade_equipa: float = 0.85,
+    taxa_ajudante_2: float = 0.75,
+    taxa_ajudante_3: float = 0.08,
+    taxa_motorista_2: float = 0.03,
+    taxa_duplicados: float = 0.03,
+    taxa_sem_caixas: float = 0.05,
+    taxa_escrita_variada: float = 0.10,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Gera as tabelas do Supabase. Cada motorista tem uma equipa fixa de
+    ajudantes; em cada posição, com probabilidade 1 - estabilidade_equipa,
+    entra um ajudante visitante. Por defeito há ~1 viagem por motorista/dia.
+    """
+    rng = np.random.default_rng(semente)
+    if n_motoristas is None:
+        n_motoristas = max(5, round(n_viagens / dias))
+    n_ajudantes = max(6, round(n_motoristas * 2.3))
+
+    # --- Colaboradores ---
+    cod_motoristas = np.arange(1000, 1000 + n_motoristas)
+    cod_ajudantes = np.arange(50000, 50000 + n_ajudantes)
+    nome_motoristas = _gerar_nomes(rng, n_motoristas)
+    nome_ajudantes = _gerar_nomes(rng, n_ajudantes)
+
+    # Equipa fixa: 3 ajudantes por motorista (posições 1, 2 e 3)
+    equipa = rng.integers(0, n_ajudantes, size=(n_motoristas, 3))
+
+    # --- Distribuição ---
+    i_motorista = rng.integers(0, n_motoristas, n_viagens)
+    datas = np.datetime64(data_inicio) + rng.integers(0, dias, n_viagens).astype("timedelta64[D]")
+    mapas = np.arange(100000, 100000 + n_viagens)
+
+    distribuicao = {
+        "MAPA": mapas.astype(str).astype(object),
+        "DATA": np.datetime_as_string(datas, unit="D").astype(object),
+        "COD": cod_motoristas[i_motorista].astype(str).astype(object),
+        "MOTORISTA": _variar_escrita(rng, nome_motoristas[i_motorista], taxa_escrita_variada),
+    }
+
+    # Segundo motorista (raro)
+    tem_m2 = rng.random(n_viagens) < taxa_motorista_2
+    i_m2 = rng.integers(0, n_motoristas, n_viagens)
+    distribuicao["MOTORISTA_2"] = np.where(tem_m2, nome_motoristas[i_m2], None)
+    distribuicao["COD_2"] = np.where(tem_m2, cod_motoristas[i_m2].astype(object), None)
+
+    presenca = [np.ones(n_viagens, dtype=bool), rng.random(n_viagens) < taxa_ajudante_2, rng.random(n_viagens) < taxa_ajudante_3]
+    for posicao in range(3):
+        visitante = rng.random(n_viagens) >= estabilidade_equipa
+        i_aj = np.where(visitante, rng.integers(0, n_ajudantes, n_viagens), equipa[i_motorista, posicao])
+        nomes = _variar_escrita(rng, nome_ajudantes[i_aj], taxa_escrita_variada)
+        distribuicao[f"AJUDANTE_{posicao + 1}"] = np.where(presenca[posicao], nomes, None)
+        distribuicao[f"CODJ_{posicao + 1}"] = np.where(presenca[posicao], cod_ajudantes[i_aj].astype(object), None)
+
+    # Linhas em bruto (não importadas pela app): sem marca de normalização
+    distribuicao["versao_normalizacao"] = np.full(n_viagens, None, dtype=object)
+    df_distribuicao = pd.DataFrame(distribuicao)
+    # Linhas duplicadas (o mesmo MAPA importado duas vezes)
+    duplicados = df_distribuicao[rng.random(n_viagens) < taxa_duplicados]
+    df_distribuicao = pd.concat([df_distribuicao, duplicados], ignore_index=True)
+    df_distribuicao = df_distribuicao.sort_values("DATA", kind="stable").reset_index(drop=True)
+
+    # --- Caixas (uma linha por MAPA; alguns mapas sem registo) ---
+    com_caixas = rng.random(n_viagens) >= taxa_sem_caixas
+    df_caixas = pd.DataFrame({
+        "data": distribuicao["DATA"][com_caixas],
+        "mapa": distribuicao["MAPA"][com_caixas],
+        "caixas": rng.integers(40, 1200, n_viagens)[com_caixas],
+    })
+
+    # --- Cadastro (linhas de motoristas e de ajudantes) ---
+    hoje = np.datetime64(datetime.date.today())
+    admissao_m = hoje - rng.integers(30, 4000, n_motoristas).astype("timedelta64[D]")
+    admissao_j = hoje - rng.integers(30, 3000, n_ajudantes).astype("timedelta64[D]")
+    vazio_m = [None] * n_motoristas
+    vazio_j = [None] * n_ajudantes
+    df_cadastro = pd.concat([
+        pd.DataFrame({
+            "Codigo_M": cod_motoristas, "Nome_M": nome_motoristas, "CPF_M": _cpfs(rng, n_motoristas),
+            "Data_M": np.datetime_as_string(admissao_m, unit="D"),
+            "Codigo_J": vazio_m, "Nome_J": vazio_m, "CPF_J": vazio_m, "Data_J": vazio_m,
+        }),
+        pd.DataFrame({
+            "Codigo_M": vazio_j, "Nome_M": vazio_j, "CPF_M": vazio_j, "Data_M": vazio_j,
+            "Codigo_J": cod_ajudantes, "Nome_J": nome_ajudantes, "CPF_J": _cpfs(rng, n_ajudantes),
+            "Data_J": np.datetime_as_string(admissao_j, unit="D"),
+        }),
+    ], ignore_index=True)
+
+    # --- Resultados_Indicadores (um por motorista e período de pagamento) ---
+    fim = data_inicio + datetime.timedelta(days=dias - 1)
+    linhas_indicadores = []
+    for per_inicio, per_fim in _periodos_pagamento(data_inicio, fim):
+        linhas_indicadores.append(pd.DataFrame({
+            "Codigo_M": cod_motoristas,
+            "dev_pdv": rng.gamma(2.0, 0.02, n_motoristas).round(4),
+            "Rating_tx": rng.beta(18, 2, n_motoristas).round(4),
+            "refugo": rng.gamma(1.5, 0.008, n_motoristas).round(4),
+            "data_inicio_periodo": per_inicio.isoformat(),
+            "data_fim_periodo": per_fim.isoformat(),
+        }))
+    df_indicadores = pd.concat(linhas_indicadores, ignore_index=True)
+
+    # --- Metas ---
+    # Uma versão sem vigente_desde (vale desde sempre), como as linhas anteriores às versões
+    df_metas = pd.DataFrame([
+        {"tipo_colaborador": "MOTORISTA", "vigente_desde": None, **METAS_PADRAO},
+        {"tipo_colaborador": "AJUDANTE", "vigente_desde": None, **METAS_PADRAO, "dev_pdv_premio": 50.0, "rating_premio": 40.0, "refugo_premio": 25.0},
+    ])
+
+    return {
+        "Distribuição": df_distribuicao,
+        "Cadastro": df_cadastro,
+        "Caixas": df_caixas,
+        "Resultados_Indicadores": df_indicadores,
+        "Metas": df_metas,
+    }
+
+
+def para_registos(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Linhas como o PostgREST as devolve em JSON (NaN -> None)."""
+    return df.astype(object).where(pd.notna(df), None).to_dict("records")
+
+
+def preparar_entradas(
+    tabelas: Dict[str, pd.DataFrame],
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Aplica às tabelas as mesmas transformações da camada de dados
+    (core/database.py e routers/metas.py) e devolve as entradas das funções
+    de cálculo, como em _get_dados_completos do pagamento.
+    """
+    from core.database import _limpar_viagens, _preparar_cadastro, _preparar_caixas
+    from routers.metas import _formatar_metas
+
+    df_viagens = tabelas["Distribuição"]
+    df_caixas = tabelas["Caixas"]
+    if data_inicio:
+        df_viagens = df_viagens[df_viagens["DATA"] >= data_inicio]
+        df_caixas = df_caixas[df_caixas["data"] >= data_inicio]
+    if data_fim:
+        df_viagens = df_viagens[df_viagens["DATA"] <= data_fim]
+        df_caixas = df_caixas[df_caixas["data"] <= data_fim]
+
+    df_viagens_bruto, _ = _limpar_viagens(df_viagens.copy())
+    df_indicadores = tabelas["Resultados_Indicadores"]
+    periodo = df_indicadores[["data_inicio_periodo", "data_fim_periodo"]].iloc[0]
+    df_indicadores = df_indicadores[
+        (df_indicadores["data_inicio_periodo"] == periodo["data_inicio_periodo"])
+        & (df_indicadores["data_fim_periodo"] == periodo["data_fim_periodo"])
+    ]
+    metas = tabelas["Metas"].set_index("tipo_colaborador")
+
+    return {
+        "df_viagens_bruto": df_viagens_bruto,
+        "df_viagens_dedup": df_viagens_bruto.drop_duplicates(subset=["MAPA"]),
+        "df_cadastro": _preparar_cadastro(tabelas["Cadastro"].copy()),
+        "df_indicadores": df_indicadores.reset_index(drop=True),
+        "df_caixas": _preparar_caixas(df_caixas.copy()),
+        "metas": _formatar_metas(metas.loc["MOTORISTA"].to_dict(), metas.loc["AJUDANTE"].to_dict()),
+    }
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tracemalloc
+import warnings
+from pathlib import Path
+from typing import Any, Dict
+
+# --- JSON vs CSV NA LEITURA DA DISTRIBUIÇÃO ---
+# Compara os dois formatos de get_dados_apurados (SUPABASE_FORMATO_DISTRIBUICAO)
+# contra o PostgREST local (benchmarks/postgrest_local.py): tempo, pico de
+# memória Python (tracemalloc) e pico de RSS do processo (inclui a memória do
+# pyarrow, que o tracemalloc não vê). Cada medição corre num processo novo.
+# "CPU app" é o tempo de CPU do processo cliente: exclui o servidor, que na
+# mesma máquina também gasta CPU a serializar (o local gera CSV em Python).
+# Confirma também que os dois formatos dão o mesmo DataFrame.
+#
+#     python -m benchmarks.formato_rede --viagens 100000
+#     python -m benchmarks.formato_rede --url http://127.0.0.1:54321   # PostgREST já a correr
+
+RAIZ = Path(__file__).resolve().parent.parent
+PERIODO = ("2000-01-01", "2100-12-31")  # período inteiro
+
+
+def _cliente(url: str):
+    from supabase import create_client, ClientOptions
+    from core.saida import criar_cliente_http
+    return create_client(url, "local", options=ClientOptions(httpx_client=criar_cliente_http()))
+
+
+def _rss_pico_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def medir(url: str, formato: str, rastrear: bool) -> Dict[str, Any]:
+    """
+    Corre no processo filho: uma leitura (só o fetch, sem limpeza) com o
+    formato dado. Com rastrear=True mede o pico do tracemalloc (que abranda
+    o código Python); senão mede tempo e RSS.
+    """
+    from core import database
+
+    supabase = _cliente(url)
+    buscar = database._buscar_distribuicao_csv if formato == "csv" else database._buscar_distribuicao_json
+    if formato == "csv":
+        database._obter_tipos_distribuicao(supabase)  # amostra de tipos: uma vez por processo, fora da medição
+
+    if rastrear:
+        tracemalloc.start()
+        buscar(supabase, *PERIODO)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"pico_python_mb": round(pico / 1024 / 1024, 1)}
+
+    rss_antes = _rss_pico_mb()
+    inicio = time.perf_counter()
+    cpu_inicio = time.process_time()
+    df = buscar(supabase, *PERIODO)
+    return {
+        "formato": formato,
+        "linhas": len(df),
+        "tempo_s": round(time.perf_counter() - inicio, 3),
+        "cpu_s": round(time.process_time() - cpu_inicio, 3),
+        "rss_acrescimo_mb": round(_rss_pico_mb() - rss_antes, 1),
+        "df_mb": round(df.memory_usage(deep=True).sum() / 1024 / 1024, 1),
+    }
+
+
+def _medir_em_processo(url: str, formato: str, rastrear: bool) -> Dict[str, Any]:
+    comando = [sys.executable, "-m", "benchmarks.formato_rede", "--url", url, "--medir", formato]
+    if rastrear:
+        comando.append("--tracemalloc")
+    saida = subprocess.run(
+        comando, cwd=RAIZ, capture_output=True, text=True, check=True,
+        env={**os.environ, "SUPABASE_COPIAS": "0"},
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def comparar_resultados(url: str):
+    """Os dois formatos, depois de _limpar_viagens, têm de dar o mesmo DataFrame."""
+    import pandas as pd
+    from core import database
+
+    supabase = _cliente(url)
+    df_json, _ = database._limpar_viagens(database._buscar_distribuicao_json(supabase, *PERIODO))
+    df_csv, _ = database._limpar_viagens(database._buscar_distribuicao_csv(supabase, *PERIODO))
+    pd.testing.assert_frame_equal(df_json.reset_index(drop=True), df_csv.reset_index(drop=True))
+    print(f"Resultados iguais ({len(df_csv)} linhas, tipos: {dict(df_csv.dtypes.astype(str))})")
+
+
+def _esperar(url: str, limite_s: float = 300):
+    import httpx
+    fim = time.time() + limite_s
+    while time.time() < fim:
+        try:
+            if httpx.get(url + "/__estado", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"PostgREST local não arrancou em {limite_s} s")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Leitura da Distribuição em JSON vs CSV")
+    parser.add_argument("--viagens", type=int, default=100_000)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--url", help="PostgREST já em execução (senão arranca um local)")
+    parser.add_argument("--porta", type=int, default=54377)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--medir", choices=["json", "csv"], help=argparse.SUPPRESS)
+    parser.add_argument("--tracemalloc", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    warnings.simplefilter("ignore")
+
+    if args.medir:
+        print(json.dumps(medir(args.url, args.medir, args.tracemalloc)))
+        return 0
+
+    processo = None
+    url = args.url
+    if url is None:
+        url = f"http://127.0.0.1:{args.porta}"
+        processo = subprocess.Popen([
+            sys.executable, "-m", "benchmarks.postgrest_local", "--viagens", str(args.viagens),
+            "--semente", str(args.semente), "--porta", str(args.porta),
+        ], cwd=RAIZ, stdout=subprocess.DEVNULL)
+    try:
+        _esperar(url)
+        comparar_resultados(url)
+        print(f"\n{'formato':8s} {'linhas':>8s} {'tempo':>9s} {'CPU app':>9s} {'pico Python':>12s} {'RSS +':>9s} {'DataFrame':>10s}")
+        for _ in range(args.repeticoes):
+            for formato in ("json", "csv"):
+                r = _medir_em_processo(url, formato, rastrear=False)
+                r.update(_medir_em_processo(url, formato, rastrear=True))
+                print(f"{r['formato']:8s} {r['linhas']:8d} {r['tempo_s']:8.2f}s {r['cpu_s']:8.2f}s {r['pico_python_mb']:10.1f}MB "
+                      f"{r['rss_acrescimo_mb']:7.1f}MB {r['df_mb']:8.1f}MB", flush=True)
+    finally:
+        if processo is not None:
+            processo.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
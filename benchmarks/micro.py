@@ -0,0 +1,177 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+import warnings
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+# --- MICRO-BENCHMARKS DO NÚCLEO DE CÁLCULO ---
+# Mede tempo e pico de memória das funções de cálculo com dados sintéticos
+# (benchmarks/dados_sinteticos.py) e compara com um baseline guardado.
+#
+# Correr a partir da raiz do projeto:
+#     python -m benchmarks.micro                      # compara com o baseline
+#     python -m benchmarks.micro --viagens 1000 1000000
+#     python -m benchmarks.micro --guardar-baseline   # atualiza o baseline
+#
+# Sai com código 1 se alguma função ficar mais lenta que o baseline para lá
+# da tolerância (ex: 0.25 = 25%) e de um mínimo absoluto (--minimo-ms, para
+# as funções de poucos milissegundos não darem falsos alarmes).
+
+BASELINE_PADRAO = Path(__file__).with_name("baseline_micro.json")
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000]
+
+
+def _casos(entradas: Dict[str, Any]) -> List[Tuple[str, Callable, Callable[[], tuple]]]:
+    """
+    Casos a medir: (nome, função, argumentos). Os argumentos são gerados de
+    novo em cada execução (algumas funções alteram os DataFrames recebidos),
+    fora do tempo medido.
+    """
+    from core.analysis import gerar_dashboard_e_mapas
+    from core.database import _limpar_viagens
+    from routers.incentivo import processar_incentivos_sincrono
+    from routers.caixas import processar_caixas_sincrono
+    from routers.pagamento import _merge_resultados
+
+    e = entradas
+    args_incentivo = lambda: (e["df_viagens_dedup"].copy(), e["df_cadastro"].copy(), e["df_indicadores"].copy(), e["metas"])
+    args_caixas = lambda: (e["df_viagens_bruto"].copy(), e["df_cadastro"].copy(), e["df_caixas"].copy(), e["metas"])
+    resultados_merge = (*processar_incentivos_sincrono(*args_incentivo()), *processar_caixas_sincrono(*args_caixas()))
+
+    return [
+        ("limpar_viagens", _limpar_viagens, lambda: (e["distribuicao_original"].copy(),)),
+        ("gerar_dashboard_e_mapas", gerar_dashboard_e_mapas, lambda: (e["df_viagens_dedup"].copy(),)),
+        ("processar_incentivos_sincrono", processar_incentivos_sincrono, args_incentivo),
+        ("processar_caixas_sincrono", processar_caixas_sincrono, args_caixas),
+        ("_merge_resultados", _merge_resultados, lambda: resultados_merge),
+    ]
+
+
+def _medir(funcao: Callable, argumentos: Callable[[], tuple], repeticoes: int) -> Dict[str, float]:
+    # Aquecimento (imports tardios, caches do pandas), fora da medição
+    if repeticoes > 1:
+        funcao(*argumentos())
+
+    tempos = []
+    for _ in range(repeticoes):
+        args = argumentos()
+        inicio = time.perf_counter()
+        funcao(*args)
+        tempos.append(time.perf_counter() - inicio)
+
+    # Pico de memória numa execução à parte (o tracemalloc abranda o código)
+    args = argumentos()
+    tracemalloc.start()
+    try:
+        funcao(*args)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "tempo_s": round(statistics.median(tempos), 6),
+        "tempo_min_s": round(min(tempos), 6),
+        "pico_mb": round(pico / 1024 / 1024, 3),
+    }
+
+
+def executar(tamanhos: List[int], semente: int, repeticoes: int, filtro: str = None) -> Dict[str, Any]:
+    from .dados_sinteticos import gerar_tabelas, preparar_entradas
+
+    resultados = {}
+    for n in tamanhos:
+        tabelas = gerar_tabelas(n, semente=semente)
+        entradas = preparar_entradas(tabelas)
+        entradas["distribuicao_original"] = tabelas["Distribuição"]
+        for nome, funcao, argumentos in _casos(entradas):
+            if filtro and filtro not in nome:
+                continue
+            # Casos muito lentos (ex: 1M viagens) correm uma só vez
+            reps = repeticoes if n <= 100_000 else 1
+            chave = f"{nome}@{n}"
+            resultados[chave] = _medir(funcao, argumentos, reps)
+            print(f"  {chave:45s} {resultados[chave]['tempo_s'] * 1000:10.1f} ms {resultados[chave]['pico_mb']:9.1f} MB", flush=True)
+
+    return {
+        "ambiente": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "maquina": platform.machine(),
+            "semente": semente,
+        },
+        "resultados": resultados,
+    }
+
+
+def comparar(atual: Dict[str, Any], baseline: Dict[str, Any], tolerancia: float, minimo_ms: float = 5) -> List[str]:
+    """Imprime a comparação e devolve a lista de regressões."""
+    regressoes = []
+    print(f"\n{'caso':45s} {'baseline':>10s} {'atual':>10s} {'razão':>7s} {'pico MB':>16s}")
+    for chave, medida in atual["resultados"].items():
+        base = baseline["resultados"].get(chave)
+        if base is None:
+            print(f"{chave:45s} {'-':>10s} {medida['tempo_s'] * 1000:9.1f}ms {'novo':>7s}")
+            continue
+        razao = medida["tempo_s"] / base["tempo_s"] if base["tempo_s"] else 1.0
+        marca = ""
+        diferenca_ms = (medida["tempo_s"] - base["tempo_s"]) * 1000
+        if razao > 1 + tolerancia and diferenca_ms > minimo_ms:
+            marca = "  <-- REGRESSÃO"
+            regressoes.append(chave)
+        print(
+            f"{chave:45s} {base['tempo_s'] * 1000:9.1f}ms {medida['tempo_s'] * 1000:9.1f}ms {razao:6.2f}x "
+            f"{base['pico_mb']:7.1f} -> {medida['pico_mb']:6.1f}{marca}"
+        )
+    return regressoes
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks do núcleo de cálculo")
+    parser.add_argument("--viagens", type=int, nargs="+", default=TAMANHOS_PADRAO)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--filtro", help="só os casos cujo nome contém este texto")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PADRAO)
+    parser.add_argument("--guardar-baseline", action="store_true")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    parser.add_argument("--minimo-ms", type=float, default=5)
+    parser.add_argument("--saida", type=Path, help="grava também o resultado em JSON")
+    args = parser.parse_args(argv)
+
+    # Os avisos do pandas (FutureWarning) só poluem a saída
+    warnings.simplefilter("ignore")
+
+    print(f"Micro-benchmarks ({args.repeticoes} repetições, semente {args.semente})")
+    atual = executar(args.viagens, args.semente, args.repeticoes, args.filtro)
+
+    if args.saida:
+        args.saida.write_text(json.dumps(atual, indent=2, ensure_ascii=False))
+
+    if args.guardar_baseline:
+        args.baseline.write_text(json.dumps(atual, indent=2, ensure_ascii=False) + "\n")
+        print(f"\nBaseline guardado em {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"\nSem baseline em {args.baseline} (usar --guardar-baseline)")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    regressoes = comparar(atual, baseline, args.tolerancia, args.minimo_ms)
+    if regressoes:
+        print(f"\n{len(regressoes)} regressão(ões) acima de {args.tolerancia:.0%}: {', '.join(regressoes)}")
+        return 1
+    print("\nSem regressões.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import sys
+import math
+import time
+import argparse
+import tempfile
+import warnings
+import pandas as pd
+from typing import Any, Callable, Dict, List
+
+# --- MOTOR PANDAS vs DUCKDB (MOTOR_CALCULO) ---
+# Confirma que as equipas (xadrez) e as caixas calculadas em SQL
+# (core/motor_sql.py) são iguais às do pandas, a partir de um DataFrame e de
+# cópias Parquet mensais, e mede os tempos com dados sintéticos de um ano.
+# O tempo DuckDB/Parquet inclui abrir a ligação e ler os ficheiros (sem os
+# gravar, que na app só acontece quando o mês muda).
+#
+#     python -m benchmarks.motor_sql
+#     python -m benchmarks.motor_sql --viagens 1000000 --pandas-ate 100000
+
+TAMANHOS_PADRAO = [10_000, 100_000, 1_000_000]
+
+
+def _iguais(a: Any, b: Any, caminho: str = "") -> List[str]:
+    """Diferenças entre dois resultados (NaN == NaN; tipos numpy == Python)."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        if list(a) != list(b):
+            return [f"{caminho}: chaves {list(a)} != {list(b)}"]
+        return [d for k in a for d in _iguais(a[k], b[k], f"{caminho}.{k}")]
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        if len(a) != len(b):
+            return [f"{caminho}: {len(a)} != {len(b)} elementos"]
+        return [d for i, (x, y) in enumerate(zip(a, b)) for d in _iguais(x, y, f"{caminho}[{i}]")]
+    vazio_a = a is None or (isinstance(a, float) and math.isnan(a))
+    vazio_b = b is None or (isinstance(b, float) and math.isnan(b))
+    if vazio_a or vazio_b:
+        return [] if vazio_a and vazio_b else [f"{caminho}: {a!r} != {b!r}"]
+    return [] if a == b else [f"{caminho}: {a!r} != {b!r}"]
+
+
+def _cronometrar(funcao: Callable, repeticoes: int):
+    tempos, resultado = [], None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos), resultado
+
+
+def _gravar_meses(df: pd.DataFrame, pasta: str) -> List[str]:
+    """Uma cópia Parquet por mês, como snapshots_viagens."""
+    from core.motor_sql import escrever_parquet
+
+    ficheiros = []
+    for mes, grupo in df.groupby(df["DATA"].str[:7], sort=True):
+        caminho = f"{pasta}/distribuicao_{mes}_{len(grupo)}.parquet"
+        escrever_parquet(grupo, caminho, int(mes.replace("-", "")) * 10**8)
+        ficheiros.append(caminho)
+    return ficheiros
+
+
+def executar(n_viagens: int, dias: int, semente: int, repeticoes: int, pandas_ate: int) -> Dict[str, Any]:
+    from benchmarks.dados_sinteticos import gerar_tabelas, preparar_entradas
+    from core.analysis import gerar_dashboard_e_mapas
+    from core.motor_sql import abrir_viagens, equipas_duckdb
+    from routers.caixas import processar_caixas_sincrono, processar_caixas_duckdb
+
+    tabelas = gerar_tabelas(n_viagens, semente=semente, dias=dias)
+    e = preparar_entradas(tabelas)
+    df = e["df_viagens_bruto"].reset_index(drop=True)
+    data_inicio, data_fim = df["DATA"].min(), df["DATA"].max()
+
+    def duckdb_equipas(fonte):
+        con = abrir_viagens(fonte, data_inicio, data_fim)
+        try:
+            return equipas_duckdb(con)
+        finally:
+            con.close()
+
+    def duckdb_caixas(fonte):
+        con = abrir_viagens(fonte, data_inicio, data_fim)
+        try:
+            return processar_caixas_duckdb(con, e["df_cadastro"], e["df_caixas"], e["metas"])
+        finally:
+            con.close()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        ficheiros = _gravar_meses(df, pasta)
+        medicoes = {
+            "equipas duckdb/df": lambda: duckdb_equipas(df),
+            "equipas duckdb/parquet": lambda: duckdb_equipas(ficheiros),
+            "caixas duckdb/df": lambda: duckdb_caixas(df),
+            "caixas duckdb/parquet": lambda: duckdb_caixas(ficheiros),
+        }
+        if n_viagens <= pandas_ate:
+            medicoes["equipas pandas"] = lambda: gerar_dashboard_e_mapas(df.drop_duplicates(subset=["MAPA"]))["dashboard_data"]
+            medicoes["caixas pandas"] = lambda: processar_caixas_sincrono(df, e["df_cadastro"], e["df_caixas"], e["metas"])
+        resultados = {nome: _cronometrar(funcao, repeticoes) for nome, funcao in medicoes.items()}
+
+    diferencas = []
+    for calculo in ("equipas", "caixas"):
+        referencia = resultados.get(f"{calculo} pandas", resultados[f"{calculo} duckdb/df"])[1]
+        for fonte in ("duckdb/df", "duckdb/parquet"):
+            diferencas += [f"{calculo} {fonte}{d}" for d in _iguais(referencia, resultados[f"{calculo} {fonte}"][1])]
+    return {
+        "viagens": len(df),
+        "tempos": {nome: tempo for nome, (tempo, _) in resultados.items()},
+        "diferencas": diferencas,
+        "comparado_com_pandas": n_viagens <= pandas_ate,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Equipas e caixas: pandas vs DuckDB")
+    parser.add_argument("--viagens", type=int, nargs="+", default=TAMANHOS_PADRAO)
+    parser.add_argument("--dias", type=int, default=365)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--pandas-ate", type=int, default=100_000, help="só corre o pandas até este tamanho (é O(n) em Python)")
+    args = parser.parse_args(argv)
+    warnings.simplefilter("ignore")
+
+    falhou = False
+    for n in args.viagens:
+        r = executar(n, args.dias, args.semente, args.repeticoes, args.pandas_ate)
+        estado = "iguais" if not r["diferencas"] else f"{len(r['diferencas'])} DIFERENÇAS"
+        base = "pandas" if r["comparado_com_pandas"] else "duckdb/df"
+        print(f"\n{r['viagens']} linhas ({args.dias} dias) — resultados {estado} (referência: {base})")
+        for nome, tempo in r["tempos"].items():
+            print(f"  {nome:24s} {tempo * 1000:10.1f} ms")
+        for d in r["diferencas"][:10]:
+            print(f"  {d}")
+        falhou = falhou or bool(r["diferencas"])
+    return 1 if falhou else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+import os
+import csv
+import io
+import json
+import random
+import datetime
+import sqlite3
+import asyncio
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+
+# --- POSTGREST LOCAL (para testes de carga offline) ---
+# Implementa o subconjunto do PostgREST que a app usa, sobre SQLite, com os
+# dados do gerador sintético:
+#   GET/HEAD /rest/v1/<tabela>?select=...&col=op.valor&order=...&offset=&limit=
+#     - filtros: eq, neq, gt, gte, lt, lte, like, ilike, is, in, not.<op>
+#     - Prefer: count=exact -> Content-Range: 0-999/12345
+#     - Accept: text/csv -> resposta em CSV
+#   PATCH (update), POST (insert/upsert com on_conflict), DELETE
+#   Cada escrita incrementa a versão da tabela em versoes_dados, como o
+#   trigger descrito em core/versoes.py.
+# Cada pedido espera --latencia-ms (+ jitter) e nunca devolve mais de
+# --max-linhas linhas (como o db-max-rows do Supabase).
+#
+# Uso (a partir da raiz do projeto):
+#     python -m benchmarks.postgrest_local --viagens 100000 --latencia-ms 40
+#     SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=local uvicorn main:app
+
+PREFIXO = "/rest/v1/"
+TABELA_VERSOES = "versoes_dados"
+PARAMS_RESERVADOS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+OPERADORES = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+class ErroPostgrest(Exception):
+    def __init__(self, status: int, codigo: str, mensagem: str):
+        super().__init__(mensagem)
+        self.status = status
+        self.codigo = codigo
+        self.mensagem = mensagem
+
+
+def _q(identificador: str) -> str:
+    return '"' + identificador.replace('"', '""') + '"'
+
+
+def _tirar_aspas(valor: str) -> str:
+    if len(valor) >= 2 and valor[0] == valor[-1] == '"':
+        return valor[1:-1]
+    return valor
+
+
+def _tipo_coluna(valores: List[Any]) -> str:
+    presentes = [v for v in valores if v is not None]
+    if presentes and all(isinstance(v, bool) or isinstance(v, int) for v in presentes):
+        return "INTEGER"
+    if presentes and all(isinstance(v, (int, float)) for v in presentes):
+        return "REAL"
+    return "TEXT"
+
+
+class BaseLocal:
+    """Tabelas em SQLite (em memória ou em ficheiro), acesso serializado."""
+
+    def __init__(self, caminho: str = ":memory:"):
+        self.con = sqlite3.connect(caminho, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._colunas: Dict[str, List[str]] = {}
+        self._carregar_esquema()
+
+    def _carregar_esquema(self):
+        for (tabela,) in self.con.execute("SELECT name FROM sqlite_master WHERE type='table'"):
+            self._colunas[tabela] = [c[1] for c in self.con.execute(f"PRAGMA table_info({_q(tabela)})")]
+
+    def carregar(self, tabela: str, registos: List[Dict[str, Any]]):
+        colunas = list(registos[0].keys()) if registos else []
+        definicao = ", ".join(f"{_q(c)} {_tipo_coluna([r.get(c) for r in registos])}" for c in colunas)
+        with self._lock:
+            self.con.execute(f"DROP TABLE IF EXISTS {_q(tabela)}")
+            self.con.execute(f"CREATE TABLE {_q(tabela)} ({definicao})")
+            marcadores = ", ".join("?" for _ in colunas)
+            self.con.executemany(
+                f"INSERT INTO {_q(tabela)} VALUES ({marcadores})",
+                [tuple(r.get(c) for c in colunas) for r in registos],
+            )
+            self.con.commit()
+            self._colunas[tabela] = colunas
+
+    def criar_versoes(self):
+        """Tabela versoes_dados com uma linha (versão 0) por tabela carregada."""
+        tabelas = [t for t in self._colunas if t != TABELA_VERSOES]
+        self.carregar(TABELA_VERSOES, [{"tabela": t, "versao": 0, "alterado_em": ""} for t in tabelas])
+
+    def _marcar_versao(self, tabela: str):
+        # Chamado com o lock, antes do commit da escrita (trigger FOR EACH STATEMENT)
+        if TABELA_VERSOES not in self._colunas or tabela == TABELA_VERSOES:
+            return
+        agora = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        cursor = self.con.execute(
+            f"UPDATE {_q(TABELA_VERSOES)} SET versao = versao + 1, alterado_em = ? WHERE tabela = ?", (agora, tabela)
+        )
+        if cursor.rowcount == 0:
+            self.con.execute(f"INSERT INTO {_q(TABELA_VERSOES)} VALUES (?, 1, ?)", (tabela, agora))
+
+    # --- Tradução do pedido PostgREST para SQL ---
+    def _coluna(self, tabela: str, coluna: str) -> str:
+        coluna = _tirar_aspas(coluna.strip())
+        if coluna not in self._colunas[tabela]:
+            raise ErroPostgrest(400, "42703", f"column {tabela}.{coluna} does not exist")
+        return _q(coluna)
+
+    def _verificar_tabela(self, tabela: str):
+        if tabela not in self._colunas:
+            raise ErroPostgrest(404, "42P01", f'relation "public.{tabela}" does not exist')
+
+    def _condicao(self, tabela: str, coluna: str, expressao: str) -> Tuple[str, List[Any]]:
+        negar = expressao.startswith("not.")
+        if negar:
+            expressao = expressao[4:]
+        operador, _, valor = expressao.partition(".")
+        col = self._coluna(tabela, coluna)
+
+        if operador in OPERADORES:
+            sql, args = f"{col} {OPERADORES[operador]} ?", [_tirar_aspas(valor)]
+        elif operador in ("like", "ilike"):
+            padrao = _tirar_aspas(valor).replace("*", "%")
+            sql, args = (f"{col} LIKE ?" if operador == "ilike" else f"{col} GLOB ?"), [
+                padrao if operador == "ilike" else padrao.replace("%", "*")
+            ]
+        elif operador == "is":
+            literal = {"null": "NULL", "true": "1", "false": "0"}.get(valor.lower())
+            if literal is None:
+                raise ErroPostgrest(400, "PGRST100", f"valor inválido para is: {valor}")
+            sql, args = (f"{col} IS NULL" if literal == "NULL" else f"{col} = {literal}"), []
+        elif operador == "in":
+            itens = next(csv.reader([valor.strip("()")], skipinitialspace=True), [])
+            sql, args = f"{col} IN ({', '.join('?' for _ in itens) or 'NULL'})", itens
+        else:
+            raise ErroPostgrest(400, "PGRST100", f"operador não suportado: {operador}")
+
+        return (f"NOT ({sql})" if negar else sql), args
+
+    def _where(self, tabela: str, params: List[Tuple[str, str]]) -> Tuple[str, List[Any]]:
+        partes, args = [], []
+        for chave, valor in params:
+            if chave in PARAMS_RESERVADOS:
+                continue
+            sql, a = self._condicao(tabela, chave, valor)
+            partes.append(sql)
+            args.extend(a)
+        return (" WHERE " + " AND ".join(partes)) if partes else "", args
+
+    def _order(self, tabela: str, order: Optional[str]) -> str:
+        if not order:
+            return " ORDER BY rowid"
+        termos = []
+        for termo in order.split(","):
+            coluna, *modificadores = termo.split(".")
+            sql = self._coluna(tabela, coluna)
+            if "desc" in modificadores:
+                sql += " DESC"
+            if "nullsfirst" in modificadores:
+                sql += " NULLS FIRST"
+            elif "nullslast" in modificadores:
+                sql += " NULLS LAST"
+            termos.append(sql)
+        return " ORDER BY " + ", ".join(termos)
+
+    def selecionar(
+        self, tabela: str, params: List[Tuple[str, str]], contar: bool, max_linhas: int
+    ) -> Tuple[List[Dict[str, Any]], int, Optional[int]]:
+        """Retorna (linhas, offset, total ou None)."""
+        self._verificar_tabela(tabela)
+        p = dict(params)
+        select = p.get("select", "*")
+        colunas = "*" if select.strip() == "*" else ", ".join(self._coluna(tabela, c) for c in select.split(","))
+        where, args = self._where(tabela, params)
+        offset = int(p.get("offset", 0))
+        limite = min(int(p.get("limit", max_linhas)), max_linhas)
+
+        with self._lock:
+            linhas = self.con.execute(
+                f"SELECT {colunas} FROM {_q(tabela)}{where}{self._order(tabela, p.get('order'))} LIMIT ? OFFSET ?",
+                args + [limite, offset],
+            ).fetchall()
+            total = None
+            if contar:
+                total = self.con.execute(f"SELECT COUNT(*) FROM {_q(tabela)}{where}", args).fetchone()[0]
+        return [dict(l) for l in linhas], offset, total
+
+    def atualizar(self, tabela: str, params: List[Tuple[str, str]], dados: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self._verificar_tabela(tabela)
+        sets = ", ".join(f"{self._coluna(tabela, c)} = ?" for c in dados)
+        where, args = self._where(tabela, params)
+        with self._lock:
+            rowids = [r[0] for r in self.con.execute(f"SELECT rowid FROM {_q(tabela)}{where}", args)]
+            if rowids and dados:
+                marcadores = ", ".join("?" for _ in rowids)
+                self.con.execute(
+                    f"UPDATE {_q(tabela)} SET {sets} WHERE rowid IN ({marcadores})", list(dados.values()) + rowids
+                )
+            self._marcar_versao(tabela)
+            self.con.commit()
+            return self._por_rowid(tabela, rowids)
+
+    def inserir(self, tabela: str, registos: List[Dict[str, Any]], conflito: Optional[List[str]]) -> List[Dict[str, Any]]:
+        """INSERT, ou upsert (merge-duplicates) pelas colunas de on_conflict."""
+        self._verificar_tabela(tabela)
+        rowids = []
+        with self._lock:
+            for registo in registos:
+                colunas = [self._coluna(tabela, c) for c in registo]
+                if conflito:
+                    where = " AND ".join(f"{self._coluna(tabela, c)} IS ?" for c in conflito)
+                    existentes = [r[0] for r in self.con.execute(
+                        f"SELECT rowid FROM {_q(tabela)} WHERE {where}", [registo.get(c) for c in conflito]
+                    )]
+                    if existentes:
+                        sets = ", ".join(f"{c} = ?" for c in colunas)
+                        marcadores = ", ".join("?" for _ in existentes)
+                        self.con.execute(
+                            f"UPDATE {_q(tabela)} SET {sets} WHERE rowid IN ({marcadores})",
+                            list(registo.values()) + existentes,
+                        )
+                        rowids.extend(existentes)
+                        continue
+                cursor = self.con.execute(
+                    f"INSERT INTO {_q(tabela)} ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})",
+                    list(registo.values()),
+                )
+                rowids.append(cursor.lastrowid)
+            self._marcar_versao(tabela)
+            self.con.commit()
+            return self._por_rowid(tabela, rowids)
+
+    def apagar(self, tabela: str, params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        self._verificar_tabela(tabela)
+        where, args = self._where(tabela, params)
+        with self._lock:
+            linhas = [dict(l) for l in self.con.execute(f"SELECT * FROM {_q(tabela)}{where}", args)]
+            self.con.execute(f"DELETE FROM {_q(tabela)}{where}", args)
+            self._marcar_versao(tabela)
+            self.con.commit()
+        return linhas
+
+    def _por_rowid(self, tabela: str, rowids: List[int]) -> List[Dict[str, Any]]:
+        if not rowids:
+            return []
+        marcadores = ", ".join("?" for _ in rowids)
+        return [dict(l) for l in self.con.execute(f"SELECT * FROM {_q(tabela)} WHERE rowid IN ({marcadores})", rowids)]
+
+
+def criar_app(base: BaseLocal, latencia_ms: float = 0, jitter_ms: float = 0, max_linhas: int = 1000) -> FastAPI:
+    app = FastAPI()
+    estado = {"pedidos": 0, "linhas_servidas": 0, "por_tabela": {}}
+
+    def _resposta_linhas(request: Request, linhas: List[Dict[str, Any]], status: int = 200, headers=None) -> Response:
+        if "application/vnd.pgrst.object+json" in request.headers.get("accept", ""):
+            if len(linhas) != 1:
+                return _erro(ErroPostgrest(406, "PGRST116", f"JSON object requested, {len(linhas)} rows returned"))
+            return JSONResponse(linhas[0], status_code=status, headers=headers)
+        if "text/csv" in request.headers.get("accept", ""):
+            saida = io.StringIO()
+            if linhas:
+                escritor = csv.DictWriter(saida, fieldnames=list(linhas[0].keys()), lineterminator="\n")
+                escritor.writeheader()
+                escritor.writerows(linhas)
+            return Response(saida.getvalue(), status_code=status, media_type="text/csv; charset=utf-8", headers=headers)
+        return Response(json.dumps(linhas, ensure_ascii=False), status_code=status,
+                        media_type="application/json; charset=utf-8", headers=headers)
+
+    def _erro(e: ErroPostgrest) -> JSONResponse:
+        return JSONResponse({"code": e.codigo, "message": e.mensagem, "details": None, "hint": None}, status_code=e.status)
+
+    @app.get("/__estado")
+    async def ver_estado():
+        return estado
+
+    @app.api_route(PREFIXO + "{tabela}", methods=["GET", "HEAD", "POST", "PATCH", "DELETE"])
+    async def tabela(tabela: str, request: Request):
+        if latencia_ms or jitter_ms:
+            await asyncio.sleep((latencia_ms + random.uniform(0, jitter_ms)) / 1000)
+
+        estado["pedidos"] += 1
+        estado["por_tabela"][tabela] = estado["por_tabela"].get(tabela, 0) + 1
+        params = list(request.query_params.multi_items())
+        prefer = request.headers.get("prefer", "")
+        devolver = "return=representation" in prefer
+
+        try:
+            if request.method in ("GET", "HEAD"):
+                contar = "count=" in prefer
+                linhas, offset, total = await run_in_threadpool(base.selecionar, tabela, params, contar, max_linhas)
+                estado["linhas_servidas"] += len(linhas)
+                intervalo = f"{offset}-{offset + len(linhas) - 1}" if linhas else "*"
+                headers = {"Content-Range": f"{intervalo}/{total if total is not None else '*'}"}
+                if request.method == "HEAD":
+                    return Response(status_code=200, headers=headers)
+                return _resposta_linhas(request, linhas, headers=headers)
+
+            corpo = await request.json() if request.method in ("POST", "PATCH") else None
+            if request.method == "PATCH":
+                linhas = await run_in_threadpool(base.atualizar, tabela, params, corpo)
+            elif request.method == "POST":
+                registos = corpo if isinstance(corpo, list) else [corpo]
+                conflito = None
+                if "resolution=merge-duplicates" in prefer:
+                    on_conflict = dict(params).get("on_conflict")
+                    conflito = on_conflict.split(",") if on_conflict else None
+                linhas = await run_in_threadpool(base.inserir, tabela, registos, conflito)
+            else:
+                linhas = await run_in_threadpool(base.apagar, tabela, params)
+
+            status = 201 if request.method == "POST" else 200
+            if not devolver:
+                return Response(status_code=204 if request.method != "POST" else 201)
+            return _resposta_linhas(request, linhas, status=status)
+
+        except ErroPostgrest as e:
+            return _erro(e)
+
+    return app
+
+
+def carregar_sinteticos(base: BaseLocal, n_viagens: int, semente: int):
+    from .dados_sinteticos import gerar_tabelas, para_registos
+
+    for tabela, df in gerar_tabelas(n_viagens, semente=semente).items():
+        base.carregar(tabela, para_registos(df))
+        print(f"  {tabela}: {len(df)} linhas")
+    base.criar_versoes()
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="PostgREST local com dados sintéticos")
+    parser.add_argument("--viagens", type=int, default=int(os.environ.get("LOCAL_VIAGENS", 20_000)))
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--sqlite", default=":memory:", help="ficheiro SQLite (reutilizado se já tiver dados)")
+    parser.add_argument("--recriar", action="store_true", help="gera os dados mesmo que o ficheiro já exista")
+    parser.add_argument("--latencia-ms", type=float, default=float(os.environ.get("LOCAL_LATENCIA_MS", 0)))
+    parser.add_argument("--jitter-ms", type=float, default=float(os.environ.get("LOCAL_JITTER_MS", 0)))
+    parser.add_argument("--max-linhas", type=int, default=int(os.environ.get("LOCAL_MAX_LINHAS", 1000)))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=54321)
+    args = parser.parse_args(argv)
+
+    base = BaseLocal(args.sqlite)
+    if args.recriar or "Distribuição" not in base._colunas:
+        print(f"A gerar {args.viagens} viagens (semente {args.semente})...")
+        carregar_sinteticos(base, args.viagens, args.semente)
+    elif TABELA_VERSOES not in base._colunas:
+        base.criar_versoes()  # ficheiro criado antes de haver versoes_dados
+
+    print(f"PostgREST local em http://{args.host}:{args.porta} "
+          f"(latência {args.latencia_ms}+{args.jitter_ms} ms, máx. {args.max_linhas} linhas)")
+    app = criar_app(base, args.latencia_ms, args.jitter_ms, args.max_linhas)
+    uvicorn.run(app, host=args.host, port=args.porta, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
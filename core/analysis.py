@@ -1,6 +1,7 @@
 import pandas as pd
 import unicodedata
 from typing import Dict, Any # <-- Garantir que o Any está aqui da última correção
+from .metricas import medir
 
 # --- FUNÇÃO DE LIMPEZA DE TEXTO ---
 def limpar_texto(text):
@@ -75,13 +76,18 @@ def _classificar_e_atribuir_viagens(
     viagens_fixas = []
     viagens_visitantes = []
     
-    for _, viagem in viagens_com_motorista.iterrows():
+    # Colunas como listas em vez de iterrows (um Series por linha era o custo dominante)
+    for cod_ajudante, nome_ajudante, num_viagens in zip(
+        viagens_com_motorista['AJUDANTE_COD'].tolist(),
+        viagens_com_motorista['AJUDANTE_NOME'].tolist(),
+        viagens_com_motorista['VIAGENS'].tolist(),
+    ):
         viagem_data = {
-            'cod_ajudante': int(viagem['AJUDANTE_COD']),
-            'nome_ajudante': viagem['AJUDANTE_NOME'],
+            'cod_ajudante': int(cod_ajudante),
+            'nome_ajudante': nome_ajudante,
             # --- ALTERAÇÃO AQUI (REVERSÃO) ---
             # A contagem 'VIAGENS' agora estará correta (será 1)
-            'num_viagens': viagem['VIAGENS']
+            'num_viagens': num_viagens
             # --- FIM DA ALTERAÇÃO ---
         }
         is_primary_fixed = mapas["motorista_fixo_map"].get(viagem_data['cod_ajudante']) == info_linha['COD']
@@ -116,15 +122,23 @@ def _classificar_e_atribuir_viagens(
         if visitante['num_viagens'] > limite_minimo_visitante:
             info_linha['VISITANTES'].append(f"{visitante['nome_ajudante'].strip()} ({visitante['num_viagens']}x)")
 
-def gerar_dashboard_e_mapas(df: pd.DataFrame) -> dict:
-    regras = {
-        "RATIO_SIGNIFICANCIA_FIXO": 0.40,
-        "MIN_VIAGENS_PARA_ATIVAR_REGRA_ESTRITA": 10,
-        "MIN_VIAGENS_MOTORISTA_REGRA_ESTRITA": 15,
-        "LIMITE_VISITANTE_ESTRITO": 2,
-        "LIMITE_VISITANTE_PADRAO": 1,
-    }
-    df_melted = _preparar_dataframe_ajudantes(df)
+REGRAS_EQUIPAS = {
+    "RATIO_SIGNIFICANCIA_FIXO": 0.40,
+    "MIN_VIAGENS_PARA_ATIVAR_REGRA_ESTRITA": 10,
+    "MIN_VIAGENS_MOTORISTA_REGRA_ESTRITA": 15,
+    "LIMITE_VISITANTE_ESTRITO": 2,
+    "LIMITE_VISITANTE_PADRAO": 1,
+}
+
+@medir("analise_equipas")
+def gerar_dashboard_e_mapas(df: pd.DataFrame, df_melted: pd.DataFrame = None) -> dict:
+    """
+    df_melted: ajudantes já em formato longo (ex: ArmazemViagens.ajudantes);
+    se não vier, é calculado a partir de df.
+    """
+    regras = REGRAS_EQUIPAS
+    if df_melted is None:
+        df_melted = _preparar_dataframe_ajudantes(df)
     if df_melted.empty:
         return {
             "dashboard_data": [], 
@@ -139,13 +153,39 @@ def gerar_dashboard_e_mapas(df: pd.DataFrame) -> dict:
     contagem_viagens_ajudantes = df_melted.groupby(['MOTORISTA_COD', 'AJUDANTE_COD']).size().reset_index(name='VIAGENS')
     # --- FIM DA ALTERAÇÃO ---
 
-    contagem_viagens_ajudantes['AJUDANTE_NOME'] = contagem_viagens_ajudantes['AJUDANTE_COD'].map(mapas["nome_ajudante_map"])
-    
-    dashboard_data = []
     colunas_motorista_base = ['COD', 'MOTORISTA', 'MOTORISTA_2', 'COD_2']
     colunas_existentes = [col for col in colunas_motorista_base if col in df.columns]
     motoristas_no_periodo = df[colunas_existentes].drop_duplicates(subset=['COD'])
+    max_pos = df_melted['POSICAO'].nunique() if not df_melted.empty else 3
+
+    dashboard_final = _montar_dashboard(motoristas_no_periodo, contagem_viagens_ajudantes, mapas, max_pos, regras)
+    
+    return {
+        "dashboard_data": dashboard_final,
+        "mapas": mapas,
+        "df_melted": df_melted
+    }
+
+def _montar_dashboard(
+    motoristas_no_periodo: pd.DataFrame,
+    contagem_viagens_ajudantes: pd.DataFrame,
+    mapas: Dict[str, Any],
+    max_pos: int,
+    regras: Dict[str, Any]
+) -> list:
+    """
+    Monta uma linha por motorista (equipa fixa e visitantes) a partir das
+    contagens já agregadas. Partilhado pelo cálculo em pandas e em DuckDB
+    (core/motor_sql.py), que só diferem na forma de obter as agregações.
+    """
+    contagem_viagens_ajudantes = contagem_viagens_ajudantes.copy()
+    contagem_viagens_ajudantes['AJUDANTE_NOME'] = contagem_viagens_ajudantes['AJUDANTE_COD'].map(mapas["nome_ajudante_map"])
+    viagens_por_motorista = {
+        cod: grupo for cod, grupo in contagem_viagens_ajudantes.groupby('MOTORISTA_COD', sort=False)
+    }
+    vazio = contagem_viagens_ajudantes.iloc[0:0]
     
+    dashboard_data = []
     for _, motorista_row in motoristas_no_periodo.iterrows():
         cod_motorista = int(motorista_row['COD'])
         total_viagens = mapas["contagem_viagens_motorista"].get(cod_motorista, 0)
@@ -159,12 +199,11 @@ def gerar_dashboard_e_mapas(df: pd.DataFrame) -> dict:
             'VISITANTES': []
         }
         
-        max_pos = df_melted['POSICAO'].nunique() if not df_melted.empty else 3
         for i in range(1, max_pos + 1):
             info_linha[f'AJUDANTE_{i}'] = ''
             info_linha[f'CODJ_{i}'] = ''
         
-        viagens_com_motorista = contagem_viagens_ajudantes[contagem_viagens_ajudantes['MOTORISTA_COD'] == cod_motorista]
+        viagens_com_motorista = viagens_por_motorista.get(cod_motorista, vazio)
         
         _classificar_e_atribuir_viagens(
             info_linha, viagens_com_motorista, mapas, total_viagens, regras
@@ -176,10 +215,4 @@ def gerar_dashboard_e_mapas(df: pd.DataFrame) -> dict:
             if value is None:
                 linha[key] = ''
     
-    dashboard_final = sorted(dashboard_data, key=lambda x: x.get('MOTORISTA') or '')
-    
-    return {
-        "dashboard_data": dashboard_final,
-        "mapas": mapas,
-        "df_melted": df_melted
-    }
\ No newline at end of file
+    return sorted(dashboard_data, key=lambda x: x.get('MOTORISTA') or '')
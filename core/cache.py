@@ -0,0 +1,201 @@
+import os
+import time
+import asyncio
+import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from .perfil import perfil_ativo
+
+# --- CACHE DE RESULTADOS CALCULADOS (em memória, por processo) ---
+# Guarda o resultado já calculado de cada rota por período, para que a troca
+# entre sub-abas (motoristas/ajudantes) não volte a buscar tudo ao Supabase.
+#
+# Funciona em "stale-while-revalidate":
+#   - idade < ttl_fresco  -> serve o resultado guardado
+#   - idade < ttl_maximo  -> serve o resultado guardado e recalcula em segundo plano
+#   - idade >= ttl_maximo -> recalcula e espera pelo resultado
+# Os TTLs de cada rota podem ser configurados por variável de ambiente, ex:
+#   CACHE_TTL_PAGAMENTO="120,1800"   (fresco, máximo) em segundos
+# Entradas "permanentes" (períodos fechados, com as metas da sua versão na
+# chave) não expiram nem são recalculadas por idade; com uma versão dos dados
+# diferente são recalculadas antes de responder (uma correção num período
+# fechado nunca é servida com o resultado antigo), e podem sair por falta de
+# espaço. Sem versão dos dados (None) nenhuma entrada fica permanente.
+
+# Todas as caches criadas, para poderem ser invalidadas de uma vez (ex: ao salvar metas)
+_CACHES = []
+
+def invalidar_todas():
+    for cache in _CACHES:
+        cache.invalidar()
+
+
+def _ler_ttls(nome: str, ttl_fresco: float, ttl_maximo: float) -> Tuple[float, float]:
+    valor = os.environ.get(f"CACHE_TTL_{nome.upper()}")
+    if not valor:
+        return ttl_fresco, ttl_maximo
+    try:
+        fresco, maximo = (float(v) for v in valor.split(","))
+        return fresco, max(fresco, maximo)
+    except ValueError:
+        print(f"Valor inválido em CACHE_TTL_{nome.upper()}: '{valor}' (esperado 'fresco,maximo')")
+        return ttl_fresco, ttl_maximo
+
+
+class CacheResultados:
+    def __init__(self, nome: str, ttl_fresco: float = 120, ttl_maximo: float = 1800, max_entradas: int = 64):
+        self.nome = nome
+        self.ttl_fresco, self.ttl_maximo = _ler_ttls(nome, ttl_fresco, ttl_maximo)
+        self.max_entradas = max_entradas
+        # chave -> (guardado_em, versao_dados, valor)
+        self._entradas: Dict[Hashable, Tuple[float, Optional[str], Any]] = {}
+        self._permanentes = set()  # chaves que não expiram por idade
+        self._em_calculo: Dict[Hashable, asyncio.Future] = {}
+        self._tarefas = set()  # referências às atualizações em segundo plano
+        _CACHES.append(self)
+
+    def obter(self, chave: Hashable) -> Optional[Any]:
+        """
+        Retorna o valor guardado para a chave (mesmo que antigo), ou None se
+        não existir/passou do ttl_maximo.
+        """
+        entrada = self._entradas.get(chave)
+        if entrada is None:
+            return None
+        guardado_em, versao, valor = entrada
+        if chave not in self._permanentes and time.time() - guardado_em > self.ttl_maximo:
+            self._entradas.pop(chave, None)
+            return None
+        return self._com_metadados(guardado_em, versao, valor)
+
+    def obter_da_versao(self, prefixo: Tuple, versao: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Resultado guardado cuja chave começa por prefixo (ex: (data_inicio,
+        data_fim), sem a versão das metas) e que foi calculado com esta versão
+        dos dados, ou None. Não vai ao Supabase: serve os fragmentos que levam
+        no URL a versão da página.
+        """
+        if not versao or perfil_ativo.get():
+            return None
+        agora = time.time()
+        encontradas = [
+            (guardado_em, chave, valor)
+            for chave, (guardado_em, versao_guardada, valor) in list(self._entradas.items())
+            if isinstance(chave, tuple) and chave[:len(prefixo)] == prefixo and versao_guardada == versao
+            and (chave in self._permanentes or agora - guardado_em <= self.ttl_maximo)
+        ]
+        if not encontradas:
+            return None
+        guardado_em, _, valor = max(encontradas, key=lambda e: e[0])
+        return self._com_metadados(guardado_em, versao, valor)
+
+    def guardar(
+        self, chave: Hashable, valor: Any, versao: Optional[str] = None,
+        guardado_em: float = None, permanente: bool = False
+    ):
+        if chave not in self._entradas and len(self._entradas) >= self.max_entradas:
+            # Remove a entrada mais antiga
+            mais_antiga = min(self._entradas, key=lambda k: self._entradas[k][0])
+            self._entradas.pop(mais_antiga, None)
+            self._permanentes.discard(mais_antiga)
+        self._entradas[chave] = (guardado_em or time.time(), versao, valor)
+        if permanente:
+            self._permanentes.add(chave)
+        else:
+            self._permanentes.discard(chave)
+
+    def invalidar(self, chave: Hashable = None):
+        if chave is None:
+            self._entradas.clear()
+            self._permanentes.clear()
+        else:
+            self._entradas.pop(chave, None)
+            self._permanentes.discard(chave)
+
+    @staticmethod
+    def _com_metadados(guardado_em: float, versao: Optional[str], valor: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            **valor,
+            "dados_de": datetime.datetime.fromtimestamp(guardado_em).strftime("%d/%m/%Y %H:%M:%S"),
+            "versao_dados": versao,
+        }
+
+    async def _calcular(
+        self,
+        chave: Hashable,
+        calcular: Callable[[], Awaitable[Dict[str, Any]]],
+        versao: Optional[str],
+        permanente: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Executa o cálculo, colapsando pedidos simultâneos para a mesma chave
+        num só. Resultados com 'error_message' não são guardados.
+        """
+        em_calculo = self._em_calculo.get(chave)
+        if em_calculo is not None:
+            return await asyncio.shield(em_calculo)
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._em_calculo[chave] = futuro
+        try:
+            inicio = time.time()
+            valor = await calcular()
+            if not valor.get("error_message"):
+                self.guardar(chave, valor, versao, guardado_em=inicio, permanente=permanente)
+            valor = self._com_metadados(inicio, versao, valor)
+            futuro.set_result(valor)
+            return valor
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            # Evita o aviso "exception was never retrieved" quando ninguém espera
+            futuro.exception()
+            raise
+        finally:
+            self._em_calculo.pop(chave, None)
+
+    def _atualizar_em_segundo_plano(self, chave, calcular, versao, permanente=False):
+        if chave in self._em_calculo:
+            return  # já há uma atualização a decorrer para esta chave
+
+        async def _atualizar():
+            try:
+                await self._calcular(chave, calcular, versao, permanente)
+            except Exception as e:
+                print(f"Erro ao atualizar a cache '{self.nome}' em segundo plano: {e}")
+
+        tarefa = asyncio.create_task(_atualizar())
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+
+    async def obter_ou_calcular(
+        self,
+        chave: Hashable,
+        calcular: Callable[[], Awaitable[Dict[str, Any]]],
+        versao: Optional[str] = None,
+        permanente: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Retorna o resultado (com 'dados_de' e 'versao_dados'), servindo o que
+        está em cache sempre que possível. Um resultado calculado com outra
+        versão dos dados conta como antigo: é servido, mas é recalculado.
+        Com permanente=True (período fechado) e uma versão dos dados, o
+        resultado não envelhece; com outra versão é recalculado já.
+        """
+        permanente = permanente and versao is not None
+        entrada = self._entradas.get(chave)
+        if entrada is not None and not perfil_ativo.get():
+            guardado_em, versao_guardada, valor = entrada
+            desatualizado = versao is not None and versao_guardada != versao
+            idade = time.time() - guardado_em
+            if chave in self._permanentes:
+                idade = self.ttl_maximo if desatualizado else 0.0
+            if idade < self.ttl_maximo:
+                if idade >= self.ttl_fresco or desatualizado:
+                    self._atualizar_em_segundo_plano(chave, calcular, versao, permanente)
+                return self._com_metadados(guardado_em, versao_guardada, valor)
+            self.invalidar(chave)
+
+        return await self._calcular(chave, calcular, versao, permanente)
@@ -0,0 +1,277 @@
+import os
+import time
+import uuid
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from contextlib import closing, contextmanager
+from typing import Dict, List, Optional, Tuple
+import pandas as pd
+
+from .metricas import span
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow é opcional; sem ele a cache partilhada fica desligada
+    pa = None
+
+try:
+    import fcntl
+except ImportError:  # fora de POSIX não há bloqueio entre processos (cada worker lê sozinho)
+    fcntl = None
+
+# --- CACHE PARTILHADA ENTRE WORKERS (Arrow IPC em disco + manifesto SQLite) ---
+# Com vários workers do uvicorn, cada um guardava a sua cópia do Cadastro, das
+# metas e das viagens de cada período, e cada um aquecia sozinho. Aqui um
+# DataFrame é escrito uma vez num ficheiro Arrow IPC (sem compressão) e os
+# outros workers abrem-no com memory-map: as colunas numéricas (inteiros sem
+# nulos, decimais) são lidas diretamente das páginas do ficheiro, partilhadas
+# pelo sistema entre processos; o texto é convertido uma vez por processo.
+# O manifesto (SQLite em modo WAL, na mesma pasta) diz, para cada chave, o
+# ficheiro atual, a versão e até quando vale: uma escrita de um worker fica
+# visível aos outros na leitura seguinte, e invalidar apaga a linha (um
+# ficheiro substituído é apagado logo; quem já o tinha mapeado continua a lê-lo).
+# Para que workers a arrancar ao mesmo tempo não vão todos ao Supabase pelo
+# mesmo período, quem vai buscar segura um lock de ficheiro (flock) da chave:
+# os outros esperam e depois leem o que ele partilhou.
+# O manifesto guarda também a geração das alterações feitas pela app (ver
+# core/versoes.py), para que todos os workers a vejam; esta parte só precisa
+# do sqlite3 e funciona mesmo com a cache partilhada desligada.
+#   CACHE_PARTILHADA=1            liga a cache partilhada (precisa do pyarrow)
+#   CACHE_PARTILHADA_DIR          pasta dos ficheiros (por defeito, a temporária do sistema)
+
+CACHE_PARTILHADA = os.environ.get("CACHE_PARTILHADA", "0") == "1"
+PASTA_PARTILHADA = os.environ.get("CACHE_PARTILHADA_DIR") or os.path.join(tempfile.gettempdir(), "cache_partilhada")
+_MANIFESTO = os.path.join(PASTA_PARTILHADA, "manifesto.sqlite")
+
+# Frames já abertos neste processo: chave -> (ficheiro, DataFrame)
+MAX_ABERTOS = 16
+_abertos: Dict[str, Tuple[str, pd.DataFrame]] = {}
+_lock_abertos = threading.Lock()
+_preparada = {"ok": False}
+
+
+def partilha_ativa() -> bool:
+    return CACHE_PARTILHADA and pa is not None
+
+
+def _ligar() -> sqlite3.Connection:
+    if not _preparada["ok"]:
+        os.makedirs(PASTA_PARTILHADA, exist_ok=True)
+    con = sqlite3.connect(_MANIFESTO, timeout=10, isolation_level=None)
+    if not _preparada["ok"]:
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS entradas ("
+            " chave TEXT PRIMARY KEY, ficheiro TEXT NOT NULL, versao TEXT,"
+            " guardado_em REAL NOT NULL, expira_em REAL NOT NULL, linhas INTEGER, bytes INTEGER)"
+        )
+        con.execute("CREATE TABLE IF NOT EXISTS geracao (id INTEGER PRIMARY KEY CHECK (id = 0), valor INTEGER NOT NULL)")
+        _preparada["ok"] = True
+    return con
+
+
+def _padrao(prefixo: str) -> str:
+    """Padrão LIKE para as chaves que começam pelo prefixo."""
+    return prefixo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _apagar_ficheiro(ficheiro: str):
+    try:
+        os.remove(os.path.join(PASTA_PARTILHADA, ficheiro))
+    except OSError:
+        pass
+
+
+def _limpar_expiradas(con: sqlite3.Connection):
+    agora = time.time()
+    expiradas = [f for (f,) in con.execute("SELECT ficheiro FROM entradas WHERE expira_em < ?", (agora,))]
+    if expiradas:
+        con.execute("DELETE FROM entradas WHERE expira_em < ?", (agora,))
+        for ficheiro in expiradas:
+            _apagar_ficheiro(ficheiro)
+
+
+def guardar_frame(chave: str, df: pd.DataFrame, ttl: float, versao: Optional[str] = None) -> bool:
+    """
+    Escreve o DataFrame para os outros workers (substitui a entrada anterior
+    da chave). Retorna False se a cache estiver desligada ou o DataFrame não
+    for convertível para Arrow (ex: coluna com tipos misturados).
+    """
+    if not partilha_ativa():
+        return False
+    try:
+        with span("partilhar_frame") as s:
+            s.linhas = len(df)
+            tabela = pa.Table.from_pandas(df, preserve_index=False)
+            if df.columns.is_unique:
+                # NaN fica como valor (não como nulo): a coluna float é lida sem cópia
+                for i, campo in enumerate(tabela.schema):
+                    if pa.types.is_floating(campo.type) and df[campo.name].dtype.kind == "f":
+                        tabela = tabela.set_column(i, campo, pa.array(df[campo.name].to_numpy()))
+            os.makedirs(PASTA_PARTILHADA, exist_ok=True)
+            prefixo = hashlib.sha1(chave.encode("utf-8")).hexdigest()[:16]
+            ficheiro = f"{prefixo}_{uuid.uuid4().hex[:8]}.arrow"
+            caminho = os.path.join(PASTA_PARTILHADA, ficheiro)
+            temporario = caminho + ".parcial"
+            with pa.OSFile(temporario, "wb") as destino:
+                with pa.ipc.new_file(destino, tabela.schema) as escritor:
+                    escritor.write_table(tabela)
+            os.replace(temporario, caminho)
+
+            agora = time.time()
+            with closing(_ligar()) as con:
+                con.execute("BEGIN IMMEDIATE")
+                anterior = con.execute("SELECT ficheiro FROM entradas WHERE chave = ?", (chave,)).fetchone()
+                con.execute(
+                    "INSERT OR REPLACE INTO entradas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (chave, ficheiro, versao, agora, agora + ttl, len(df), os.path.getsize(caminho)),
+                )
+                _limpar_expiradas(con)
+                con.execute("COMMIT")
+            if anterior is not None:
+                _apagar_ficheiro(anterior[0])
+        return True
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        print(f"DataFrame '{chave}' não convertível para Arrow ({e}); não fica partilhado")
+        return False
+    except (OSError, sqlite3.Error) as e:
+        print(f"Erro ao escrever na cache partilhada '{chave}': {e}")
+        return False
+
+
+def tabela_para_pandas(tabela, **opcoes) -> pd.DataFrame:
+    """
+    tabela.to_pandas(**opcoes), mas as colunas que eram object com
+    números/booleanos e None (ex: Codigo_M do Cadastro), que voltariam como
+    float64, ficam como estavam (objetos Python e None). Usada também no
+    pool de processos (core/processos.py).
+    """
+    df = tabela.to_pandas(**opcoes)
+    for coluna in (tabela.schema.pandas_metadata or {}).get("columns", []):
+        nome = coluna.get("field_name")
+        if coluna.get("numpy_type") == "object" and nome in df.columns:
+            tipo = tabela.schema.field(nome).type
+            if not (pa.types.is_string(tipo) or pa.types.is_large_string(tipo) or pa.types.is_null(tipo)):
+                df[nome] = pd.Series(tabela.column(nome).to_pylist(), index=df.index, dtype=object)
+    return df
+
+
+def _abrir(chave: str, ficheiro: str) -> pd.DataFrame:
+    with _lock_abertos:
+        aberto = _abertos.get(chave)
+        if aberto is not None and aberto[0] == ficheiro:
+            return aberto[1]
+    with span("abrir_frame_partilhado") as s:
+        fonte = pa.memory_map(os.path.join(PASTA_PARTILHADA, ficheiro), "r")
+        tabela = pa.ipc.open_file(fonte).read_all()
+        # split_blocks: cada coluna numérica fica sobre o buffer mapeado (sem consolidar)
+        df = tabela_para_pandas(tabela, split_blocks=True)
+        s.linhas = len(df)
+    with _lock_abertos:
+        _abertos.pop(chave, None)
+        if len(_abertos) >= MAX_ABERTOS:
+            _abertos.pop(next(iter(_abertos)))  # o aberto há mais tempo
+        _abertos[chave] = (ficheiro, df)
+    return df
+
+
+def ler_frame(chave: str, versao: Optional[str] = None) -> Optional[Tuple[pd.DataFrame, float]]:
+    """
+    (DataFrame, guardado_em) da chave, se existir, não tiver expirado e (se
+    dada) tiver a mesma versão; senão None. O DataFrame é partilhado entre
+    os pedidos deste processo: quem o recebe não o pode alterar.
+    """
+    if not partilha_ativa():
+        return None
+    try:
+        with closing(_ligar()) as con:
+            linha = con.execute(
+                "SELECT ficheiro, versao, guardado_em FROM entradas WHERE chave = ? AND expira_em >= ?",
+                (chave, time.time()),
+            ).fetchone()
+        if linha is None or (versao is not None and linha[1] != versao):
+            return None
+        return _abrir(chave, linha[0]), linha[2]
+    except (OSError, sqlite3.Error, pa.ArrowInvalid) as e:
+        print(f"Erro ao ler da cache partilhada '{chave}': {e}")
+        return None
+
+
+@contextmanager
+def bloqueio(chave: str):
+    """
+    Lock exclusivo entre processos para a chave (ex: enquanto um worker
+    busca um período ao Supabase). Sem cache partilhada, não bloqueia.
+    """
+    if not partilha_ativa() or fcntl is None:
+        yield
+        return
+    os.makedirs(PASTA_PARTILHADA, exist_ok=True)
+    nome = hashlib.sha1(chave.encode("utf-8")).hexdigest()[:16] + ".lock"
+    with open(os.path.join(PASTA_PARTILHADA, nome), "a+") as ficheiro:
+        with span("esperar_bloqueio_partilhado"):
+            fcntl.flock(ficheiro.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(ficheiro.fileno(), fcntl.LOCK_UN)
+
+
+def listar_chaves(prefixo: str) -> List[Tuple[str, float]]:
+    """(chave, guardado_em) das entradas válidas que começam pelo prefixo."""
+    if not partilha_ativa():
+        return []
+    try:
+        with closing(_ligar()) as con:
+            return con.execute(
+                "SELECT chave, guardado_em FROM entradas WHERE chave LIKE ? ESCAPE '\\' AND expira_em >= ?",
+                (_padrao(prefixo), time.time()),
+            ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao ler o manifesto da cache partilhada: {e}")
+        return []
+
+
+def invalidar_partilhada(prefixo: str = ""):
+    """Apaga as entradas cujas chaves começam pelo prefixo (todas, por defeito)."""
+    if not partilha_ativa():
+        return
+    try:
+        with closing(_ligar()) as con:
+            con.execute("BEGIN IMMEDIATE")
+            padrao = _padrao(prefixo)
+            ficheiros = [f for (f,) in con.execute("SELECT ficheiro FROM entradas WHERE chave LIKE ? ESCAPE '\\'", (padrao,))]
+            con.execute("DELETE FROM entradas WHERE chave LIKE ? ESCAPE '\\'", (padrao,))
+            con.execute("COMMIT")
+        for ficheiro in ficheiros:
+            _apagar_ficheiro(ficheiro)
+    except sqlite3.Error as e:
+        print(f"Erro ao invalidar a cache partilhada '{prefixo}': {e}")
+
+
+# --- GERAÇÃO PARTILHADA (alterações feitas pela app) ---
+def avancar_geracao() -> Optional[int]:
+    """Incrementa a geração vista por todos os workers; None se o manifesto não estiver acessível."""
+    try:
+        with closing(_ligar()) as con:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute("INSERT INTO geracao VALUES (0, 1) ON CONFLICT (id) DO UPDATE SET valor = valor + 1")
+            (valor,) = con.execute("SELECT valor FROM geracao WHERE id = 0").fetchone()
+            con.execute("COMMIT")
+        return valor
+    except (OSError, sqlite3.Error) as e:
+        print(f"Erro ao avançar a geração partilhada: {e}")
+        return None
+
+
+def ler_geracao() -> Optional[int]:
+    """Geração atual (0 se nunca avançou); None se o manifesto não estiver acessível."""
+    try:
+        with closing(_ligar()) as con:
+            linha = con.execute("SELECT valor FROM geracao WHERE id = 0").fetchone()
+        return linha[0] if linha else 0
+    except (OSError, sqlite3.Error) as e:
+        print(f"Erro ao ler a geração partilhada: {e}")
+        return None
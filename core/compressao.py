@@ -0,0 +1,105 @@
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele usa-se só gzip
+    brotli = None
+
+# --- COMPRESSÃO DAS RESPOSTAS (brotli/gzip) ---
+# O HTML cheio de tabelas comprime muito bem. Ao contrário do GZipMiddleware
+# do Starlette, cada bloco é comprimido com flush, para não atrasar o streaming
+# da página (o cabeçalho continua a chegar ao browser logo no início).
+
+TIPOS_COMPRIMIVEIS = ("text/", "application/json", "application/javascript")
+TAMANHO_MINIMO = 1024
+
+
+class _Compressor:
+    def __init__(self, codificacao: str):
+        self.codificacao = codificacao
+        if codificacao == "br":
+            self._c = brotli.Compressor(quality=5)
+        else:
+            self._c = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = formato gzip
+
+    def comprimir(self, dados: bytes, final: bool) -> bytes:
+        if self.codificacao == "br":
+            saida = self._c.process(dados)
+            return saida + (self._c.finish() if final else self._c.flush())
+        saida = self._c.compress(dados)
+        return saida + self._c.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _escolher_codificacao(accept_encoding: str) -> Optional[str]:
+    aceites = {parte.split(";")[0].strip().lower() for parte in accept_encoding.split(",")}
+    if brotli is not None and "br" in aceites:
+        return "br"
+    if "gzip" in aceites:
+        return "gzip"
+    return None
+
+
+class CompressaoMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        cabecalhos_pedido = dict(scope.get("headers") or [])
+        codificacao = _escolher_codificacao(cabecalhos_pedido.get(b"accept-encoding", b"").decode("latin-1"))
+        if codificacao is None:
+            await self.app(scope, receive, send)
+            return
+
+        estado = {"inicio": None, "compressor": None}
+
+        async def send_comprimido(message):
+            if message["type"] == "http.response.start":
+                # Só decide quando chegar o primeiro bloco do corpo
+                estado["inicio"] = message
+                return
+
+            if message["type"] != "http.response.body" or estado["inicio"] is None:
+                await send(message)
+                return
+
+            inicio = estado["inicio"]
+            corpo = message.get("body", b"")
+            mais = message.get("more_body", False)
+
+            if estado["compressor"] is None and inicio is not None:
+                cabecalhos = {k.lower(): v for k, v in inicio["headers"]}
+                tipo = cabecalhos.get(b"content-type", b"").decode("latin-1")
+                comprimivel = (
+                    inicio["status"] not in (204, 304)
+                    and b"content-encoding" not in cabecalhos
+                    and tipo.startswith(TIPOS_COMPRIMIVEIS)
+                    and (mais or len(corpo) >= TAMANHO_MINIMO)
+                )
+                if not comprimivel:
+                    estado["inicio"] = None
+                    await send(inicio)
+                    await send(message)
+                    return
+
+                estado["compressor"] = _Compressor(codificacao)
+                novos = [(k, v) for k, v in inicio["headers"] if k.lower() not in (b"content-length", b"etag")]
+                novos.append((b"content-encoding", codificacao.encode("latin-1")))
+                novos.append((b"vary", b"Accept-Encoding"))
+                if b"etag" in cabecalhos:
+                    # A representação comprimida não é byte-a-byte igual: ETag fraco
+                    etag = cabecalhos[b"etag"]
+                    novos.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+                await send({**inicio, "headers": novos})
+
+            await send({
+                "type": "http.response.body",
+                "body": estado["compressor"].comprimir(corpo, final=not mais),
+                "more_body": mais,
+            })
+
+        await self.app(scope, receive, send_comprimido)
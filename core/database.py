@@ -1,12 +1,58 @@
+import io
+import csv
 import os
+import time
+import threading
+import numpy as np
 import pandas as pd
 from supabase import Client
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 from .analysis import limpar_texto # Importa da mesma pasta 'core'
+from .metricas import span
+from .saida import SupabaseOcupado
+from .resiliencia import ler_com_repeticao
+from .cache_partilhada import guardar_frame, ler_frame
+from .versoes import versao_vista
 
 NOME_DA_TABELA = "Distribuição"
 NOME_COLUNA_DATA = "DATA"
 
+# Viagens importadas pela app (core/importacao.py) já vêm normalizadas
+# (texto com limpar_texto, códigos inteiros, DATA em ISO) e marcadas com a
+# versão da normalização; na leitura, só as linhas sem a marca atual passam
+# pela limpeza. Mudar a normalização obriga a subir VERSAO_NORMALIZACAO (as
+# linhas com a marca antiga voltam a ser limpas na leitura).
+#   ALTER TABLE public."Distribuição" ADD COLUMN versao_normalizacao smallint;
+COLUNA_NORMALIZACAO = "versao_normalizacao"
+VERSAO_NORMALIZACAO = 1
+
+# Formato das páginas da Distribuição:
+#   "csv"  -> cada página vem em text/csv e é lida pelo pyarrow para colunas
+#             tipadas; o DataFrame é montado uma só vez no fim (sem a lista
+#             de dicts do JSON). As colunas numéricas leem-se como float64 (um
+#             valor decimal numa coluna de inteiros não falha) e no fim as que
+#             só têm inteiros, sem nulos, passam a int64, como no JSON. Se uma
+#             página não couber nos tipos da amostra, a leitura repete-se em
+#             JSON e os tipos voltam a ser amostrados na leitura seguinte.
+#   "json" -> comportamento antigo (lista de dicts -> DataFrame); é o usado
+#             quando o pyarrow não está instalado
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+FORMATO_DISTRIBUICAO = os.environ.get("SUPABASE_FORMATO_DISTRIBUICAO", "csv" if pa is not None else "json")
+
+# Tipos das colunas da Distribuição (o CSV não os traz), amostrados uma vez por processo
+_tipos_distribuicao: Dict[str, Optional[Dict[str, str]]] = {"tipos": None}
+
+# O Cadastro muda raramente: fica em memória durante CACHE_TTL_CADASTRO segundos
+# (e, com CACHE_PARTILHADA=1, na cache partilhada entre workers), enquanto a
+# versão da tabela vista por este processo não mudar (core/versoes.py)
+TTL_CADASTRO = float(os.environ.get("CACHE_TTL_CADASTRO", 300))
+_cache_cadastro = {"guardado_em": 0.0, "df": None, "versao": None}
+_lock_cadastro = threading.Lock()
+
 # --- FUNÇÃO 1 (Existente) ---
 def get_dados_apurados(
     supabase: Client, 
@@ -22,83 +68,264 @@ def get_dados_apurados(
     error_message = None
     
     try:
-        dados_completos = []
-        page_size = 1000
-        page = 0
-        while True:
-            # Assumindo que a tabela 'Distribuição' está no schema 'public'
-            query = (
-                supabase.table(NOME_DA_TABELA)
-                .select("*")
-                .gte(NOME_COLUNA_DATA, data_inicio_str)
-                .lte(NOME_COLUNA_DATA, data_fim_str)
-                .range(page * page_size, (page + 1) * page_size - 1)
-            )
-            response = query.execute() 
-            
-            if not response.data: break
-            dados_completos.extend(response.data)
-            page += 1
-            if len(response.data) < page_size: break
-        
-        if not dados_completos:
+        if FORMATO_DISTRIBUICAO == "csv":
+            try:
+                df = _buscar_distribuicao_csv(supabase, data_inicio_str, data_fim_str)
+            except pa.ArrowInvalid as e:
+                print(f"Página CSV da Distribuição fora dos tipos da amostra ({e}); a ler em JSON")
+                _tipos_distribuicao["tipos"] = None
+                df = _buscar_distribuicao_json(supabase, data_inicio_str, data_fim_str)
+        else:
+            df = _buscar_distribuicao_json(supabase, data_inicio_str, data_fim_str)
+
+        if df is None:
             return None, "Nenhum dado encontrado para o período selecionado."
-        
-        df = pd.DataFrame(dados_completos)
 
+    except SupabaseOcupado:
+        raise
     except Exception as e:
         print(f"Erro ao buscar dados do Supabase (Distribuição): {e}")
         if "permission denied" in str(e):
              return None, "Erro de permissão. Execute 'GRANT ALL ON TABLE public.\"Distribuição\" TO service_role;' no Supabase."
         return None, "Erro ao conectar à tabela 'Distribuição'."
 
-    # Limpeza de Texto
-    for col in df.select_dtypes(include=['object']):
-        df[col] = df[col].apply(limpar_texto)
-    
-    if 'COD' in df.columns:
-        df['COD'] = pd.to_numeric(df['COD'], errors='coerce')
-        df.dropna(subset=['COD'], inplace=True)
-        df['COD'] = df['COD'].astype(int)
-    else:
-         return None, "A coluna 'COD' principal não foi encontrada."
+    df, error_message = _limpar_viagens(df)
+    if error_message:
+        return None, error_message
 
     # Filtro de Pesquisa
     if search_str:
-        search_clean = limpar_texto(search_str)
-        colunas_busca = ['MOTORISTA', 'MOTORISTA_2', 'AJUDANTE_1', 'AJUDANTE_2', 'AJUDANTE_3']
-        colunas_existentes_busca = [col for col in colunas_busca if col in df.columns]
+        return filtrar_pesquisa(df, search_str)
+
+    return df, None
+
+def filtrar_pesquisa(df: pd.DataFrame, search_str: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """
+    Viagens em que o termo aparece no nome de um motorista ou ajudante.
+    Retorna o DataFrame filtrado ou (None, error_message) se não sobrar nada.
+    """
+    search_clean = limpar_texto(search_str)
+    colunas_busca = ['MOTORISTA', 'MOTORISTA_2', 'AJUDANTE_1', 'AJUDANTE_2', 'AJUDANTE_3']
+    colunas_existentes_busca = [col for col in colunas_busca if col in df.columns]
+    with span("filtro_pesquisa") as s:
+        s.linhas = len(df)
         mask = pd.Series(False, index=df.index)
         for col in colunas_existentes_busca:
             mask = mask | df[col].str.contains(search_clean, na=False)
         df = df[mask]
-        if df.empty:
-            return None, f"Nenhum dado encontrado para o termo de busca: '{search_str}'"
+    if df.empty:
+        return None, f"Nenhum dado encontrado para o termo de busca: '{search_str}'"
+    return df, None
+
+def _query_distribuicao(supabase: Client, data_inicio_str: str, data_fim_str: str):
+    # Assumindo que a tabela 'Distribuição' está no schema 'public'
+    return (
+        supabase.table(NOME_DA_TABELA)
+        .select("*")
+        .gte(NOME_COLUNA_DATA, data_inicio_str)
+        .lte(NOME_COLUNA_DATA, data_fim_str)
+    )
+
+def _ler_paginas(criar_query, nome_span: str, page_size: int = 1000) -> list:
+    """
+    Todas as linhas de uma consulta, página a página (criar_query() devolve
+    a query sem .range). Um só pedido fica limitado ao máximo de linhas por
+    resposta do Supabase.
+    """
+    dados_completos = []
+    page = 0
+    while True:
+        query = criar_query().range(page * page_size, (page + 1) * page_size - 1).retry(False)
+        with span(nome_span) as s:
+            response = ler_com_repeticao(query.execute, nome_span)
+            s.linhas = len(response.data or [])
+
+        if not response.data: break
+        dados_completos.extend(response.data)
+        page += 1
+        if len(response.data) < page_size: break
+    return dados_completos
+
+def _buscar_distribuicao_json(supabase: Client, data_inicio_str: str, data_fim_str: str) -> Optional[pd.DataFrame]:
+    dados_completos = _ler_paginas(
+        lambda: _query_distribuicao(supabase, data_inicio_str, data_fim_str), "supabase_distribuicao"
+    )
+    return pd.DataFrame(dados_completos) if dados_completos else None
+
+def _buscar_distribuicao_csv(supabase: Client, data_inicio_str: str, data_fim_str: str) -> Optional[pd.DataFrame]:
+    """
+    Igual a _buscar_distribuicao_json, mas cada página vem em CSV e fica
+    como tabela Arrow; no fim junta-se tudo e converte-se para pandas de uma vez.
+    """
+    tipos = _obter_tipos_distribuicao(supabase)
+    paginas = []
+    page_size = 1000
+    page = 0
+    while True:
+        query = (
+            _query_distribuicao(supabase, data_inicio_str, data_fim_str)
+            .range(page * page_size, (page + 1) * page_size - 1)
+            .csv()
+            .retry(False) # as repetições ficam a cargo de ler_com_repeticao
+        )
+        with span("supabase_distribuicao") as s:
+            response = ler_com_repeticao(query.execute, "supabase_distribuicao")
+            pagina = _ler_pagina_csv(response.data, tipos)
+            s.linhas = 0 if pagina is None else pagina.num_rows
+
+        if pagina is None or pagina.num_rows == 0: break
+        paginas.append(pagina)
+        page += 1
+        if pagina.num_rows < page_size: break
+
+    if not paginas:
+        return None
+    # Strings -> object com None nos nulos, números com nulos -> float64,
+    # tal como o pd.DataFrame(lista de dicts)
+    return _restaurar_inteiros(pa.concat_tables(paginas).to_pandas(), tipos)
+
+def _obter_tipos_distribuicao(supabase: Client) -> Dict[str, str]:
+    """
+    Tipo de cada coluna ("texto", "numero", "booleano"), pelo primeiro valor
+    não nulo de uma amostra em JSON. Colunas sem valores na amostra (ou que
+    apareçam depois) ficam como texto.
+    """
+    if _tipos_distribuicao["tipos"] is None:
+        query = supabase.table(NOME_DA_TABELA).select("*").limit(1000).retry(False)
+        with span("supabase_distribuicao_tipos") as s:
+            response = ler_com_repeticao(query.execute, "supabase_distribuicao_tipos")
+            s.linhas = len(response.data or [])
+        tipos = {}
+        for linha in response.data or []:
+            for coluna, valor in linha.items():
+                if coluna in tipos or valor is None:
+                    continue
+                if isinstance(valor, bool):
+                    tipos[coluna] = "booleano"
+                elif isinstance(valor, (int, float)):
+                    tipos[coluna] = "numero"
+                else:
+                    tipos[coluna] = "texto"
+        _tipos_distribuicao["tipos"] = tipos
+    return _tipos_distribuicao["tipos"]
+
+# Os números leem-se sempre como float64: a amostra não distingue uma coluna
+# de inteiros de uma numeric cujos valores amostrados eram todos inteiros
+_TIPOS_ARROW = {"numero": "float64", "booleano": "bool", "texto": "string"}
+
+def _restaurar_inteiros(df: pd.DataFrame, tipos: Dict[str, str]) -> pd.DataFrame:
+    """Colunas numéricas sem nulos e só com valores inteiros passam a int64 (como no JSON)."""
+    for coluna, tipo in tipos.items():
+        if tipo == "numero" and coluna in df.columns:
+            valores = df[coluna]
+            if valores.notna().all() and (valores % 1 == 0).all():
+                df[coluna] = valores.astype("int64")
+    return df
+
+def _ler_pagina_csv(texto, tipos: Dict[str, str]):
+    """
+    Lê uma página CSV do PostgREST para uma tabela Arrow com os tipos da
+    amostra (colunas desconhecidas ficam como texto). No CSV um texto vazio
+    e um nulo são iguais: ambos ficam nulos.
+    """
+    if not texto:
+        return None
+    cabecalho = next(csv.reader(io.StringIO(texto)))
+    opcoes = pa_csv.ConvertOptions(
+        column_types={c: pa.type_for_alias(_TIPOS_ARROW[tipos.get(c, "texto")]) for c in cabecalho},
+        null_values=[""],
+        strings_can_be_null=True,
+        true_values=["t", "true"],
+        false_values=["f", "false"],
+    )
+    return pa_csv.read_csv(pa.py_buffer(texto.encode("utf-8")), convert_options=opcoes)
+
+def _limpar_viagens(df: pd.DataFrame) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """
+    Normaliza as viagens vindas do Supabase: texto em maiúsculas sem acentos
+    e COD do motorista como inteiro (linhas sem COD são descartadas).
+    As linhas já normalizadas na importação (marca VERSAO_NORMALIZACAO) não
+    passam pela limpeza do texto.
+    """
+    brutas = ~_linhas_normalizadas(df)
+    df.drop(columns=[COLUNA_NORMALIZACAO], errors='ignore', inplace=True)
+
+    # Limpeza de Texto (só das linhas guardadas em bruto)
+    with span("limpeza_texto") as s:
+        s.linhas = int(brutas.sum())
+        if brutas.all():
+            for col in df.select_dtypes(include=['object']):
+                df[col] = df[col].apply(limpar_texto)
+        elif brutas.any():
+            for col in df.select_dtypes(include=['object']):
+                df.loc[brutas, col] = df.loc[brutas, col].apply(limpar_texto)
 
+    if 'COD' in df.columns:
+        # Coluna já inteira (todas as linhas normalizadas, sem nulos): nada a converter
+        if not pd.api.types.is_integer_dtype(df['COD']):
+            df['COD'] = pd.to_numeric(df['COD'], errors='coerce')
+            df.dropna(subset=['COD'], inplace=True)
+            df['COD'] = df['COD'].astype(int)
+    else:
+         return None, "A coluna 'COD' principal não foi encontrada."
     return df, None
 
+def _linhas_normalizadas(df: pd.DataFrame) -> np.ndarray:
+    """Máscara das linhas com a marca da normalização atual (o CSV pode trazê-la como texto)."""
+    if COLUNA_NORMALIZACAO not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    versao = pd.to_numeric(df[COLUNA_NORMALIZACAO], errors='coerce')
+    return (versao == VERSAO_NORMALIZACAO).to_numpy()
+
 # --- FUNÇÃO 2 (Existente) ---
-def get_cadastro_sincrono(supabase: Client) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+def get_cadastro_sincrono(supabase: Client, copiar: bool = True) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
     """
     Busca todos os dados da tabela de cadastro (public.Cadastro).
+    Usa a cópia em memória (ou a de outro worker, na cache partilhada) se
+    tiver menos de TTL_CADASTRO segundos. Com copiar=False devolve o próprio
+    DataFrame em memória (só para leitura; ex: a pesquisa de nomes, que o
+    reconhece pela identidade).
     """
+    versao = versao_vista("Cadastro")
+    texto_versao = None if versao is None else str(versao)
+    with _lock_cadastro:
+        if (
+            _cache_cadastro["df"] is not None and _cache_cadastro["versao"] == versao
+            and time.time() - _cache_cadastro["guardado_em"] < TTL_CADASTRO
+        ):
+            return _copia(_cache_cadastro["df"], copiar), None
+
+        partilhado = ler_frame("cadastro", texto_versao)
+        if partilhado is not None:
+            _cache_cadastro["df"], _cache_cadastro["guardado_em"] = partilhado
+            _cache_cadastro["versao"] = versao
+            return _copia(_cache_cadastro["df"], copiar), None
+
+        df_cadastro, error_message = _buscar_cadastro_sincrono(supabase)
+        if error_message is None:
+            _cache_cadastro["df"] = df_cadastro
+            _cache_cadastro["guardado_em"] = time.time()
+            _cache_cadastro["versao"] = versao
+            guardar_frame("cadastro", df_cadastro, TTL_CADASTRO, texto_versao)
+            return _copia(df_cadastro, copiar), None
+        return df_cadastro, error_message
+
+def _copia(df: pd.DataFrame, copiar: bool) -> pd.DataFrame:
+    return df.copy() if copiar else df
+
+def _buscar_cadastro_sincrono(supabase: Client) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
     try:
-        response = supabase.table("Cadastro").select("*").execute()
+        with span("supabase_cadastro") as s:
+            response = supabase.table("Cadastro").select("*").execute()
+            s.linhas = len(response.data or [])
         
         if not response.data:
             return None, "Tabela 'Cadastro' está vazia ou não foi encontrada no schema 'public'."
         
-        df_cadastro = pd.DataFrame(response.data)
-        
-        df_cadastro.columns = df_cadastro.columns.str.strip()
-
-        if 'CPF_M' in df_cadastro.columns:
-            df_cadastro['CPF_M'] = df_cadastro['CPF_M'].astype(str).str.replace(r'[.-]', '', regex=True).fillna('')
-        if 'CPF_J' in df_cadastro.columns:
-            df_cadastro['CPF_J'] = df_cadastro['CPF_J'].astype(str).str.replace(r'[.-]', '', regex=True).fillna('')
-
-        return df_cadastro, None
+        return _preparar_cadastro(pd.DataFrame(response.data)), None
 
+    except SupabaseOcupado:
+        raise
     except Exception as e:
         print(f"Erro ao buscar dados do Cadastro: {e}")
         if "permission denied" in str(e):
@@ -107,6 +334,16 @@ def get_cadastro_sincrono(supabase: Client) -> Tuple[Optional[pd.DataFrame], Opt
              return None, "Erro: A tabela 'Cadastro' não existe no schema 'public'."
         return None, "Erro ao conectar à tabela de Cadastro."
 
+def _preparar_cadastro(df_cadastro: pd.DataFrame) -> pd.DataFrame:
+    df_cadastro.columns = df_cadastro.columns.str.strip()
+
+    if 'CPF_M' in df_cadastro.columns:
+        df_cadastro['CPF_M'] = df_cadastro['CPF_M'].astype(str).str.replace(r'[.-]', '', regex=True).fillna('')
+    if 'CPF_J' in df_cadastro.columns:
+        df_cadastro['CPF_J'] = df_cadastro['CPF_J'].astype(str).str.replace(r'[.-]', '', regex=True).fillna('')
+
+    return df_cadastro
+
 # --- FUNÇÃO 3 (Nova) ---
 def get_indicadores_sincrono(
     supabase: Client, 
@@ -119,23 +356,25 @@ def get_indicadores_sincrono(
     try:
         # Busca os indicadores onde o período de pagamento corresponde
         # exatamente ao período calculado.
-        response = (
-            supabase.table("Resultados_Indicadores")
+        dados = _ler_paginas(
+            lambda: supabase.table("Resultados_Indicadores")
             .select("*")
             .eq("data_inicio_periodo", data_inicio_str)
-            .eq("data_fim_periodo", data_fim_str)
-            .execute()
+            .eq("data_fim_periodo", data_fim_str),
+            "supabase_indicadores"
         )
         
-        if not response.data:
+        if not dados:
             # Não é um erro, apenas não há dados de indicador para este períodoo
             return pd.DataFrame(), None 
         
-        df_indicadores = pd.DataFrame(response.data)
+        df_indicadores = pd.DataFrame(dados)
         df_indicadores.columns = df_indicadores.columns.str.strip()
 
         return df_indicadores, None
 
+    except SupabaseOcupado:
+        raise
     except Exception as e:
         print(f"Erro ao buscar dados de Indicadores: {e}")
         if "permission denied" in str(e):
@@ -154,32 +393,66 @@ def get_caixas_sincrono(
     Assume que a tabela 'Caixas' tem as colunas 'data', 'mapa', 'caixas'.
     """
     try:
-        response = (
-            supabase.table("Caixas")
+        # Por páginas: um mês de caixas passa do máximo de linhas por resposta
+        dados = _ler_paginas(
+            lambda: supabase.table("Caixas")
             .select("data, mapa, caixas") # Seleciona as colunas que você criou
             .gte("data", data_inicio_str)
-            .lte("data", data_fim_str)
-            .execute()
+            .lte("data", data_fim_str),
+            "supabase_caixas"
         )
         
-        if not response.data:
+        if not dados:
             # Não é um erro, apenas não há dados de caixas no período
             return pd.DataFrame(columns=["data", "mapa", "caixas"]), None 
         
-        df_caixas = pd.DataFrame(response.data)
-        
-        # Converte tipos para garantir o cálculo correto
-        # Assegura que 'mapa' seja tratado como texto/objeto para agrupar
-        df_caixas['mapa'] = df_caixas['mapa'].astype(str)
-        df_caixas['caixas'] = pd.to_numeric(df_caixas['caixas'], errors='coerce')
-        df_caixas.dropna(subset=['mapa', 'caixas'], inplace=True)
-        
-        df_caixas['caixas'] = df_caixas['caixas'].astype(float) 
-
-        return df_caixas, None
+        return _preparar_caixas(pd.DataFrame(dados)), None
 
+    except SupabaseOcupado:
+        raise
     except Exception as e:
         print(f"Erro ao buscar dados de Caixas: {e}")
         if "relation" in str(e) and "does not exist" in str(e):
              return None, "Erro: A tabela 'Caixas' não existe no schema 'public'."
-        return None, "Erro ao conectar à tabela de Caixas."
\ No newline at end of file
+        return None, "Erro ao conectar à tabela de Caixas."
+
+def _preparar_caixas(df_caixas: pd.DataFrame) -> pd.DataFrame:
+    # Converte tipos para garantir o cálculo correto
+    # Assegura que 'mapa' seja tratado como texto/objeto para agrupar
+    df_caixas['mapa'] = df_caixas['mapa'].astype(str)
+    df_caixas['caixas'] = pd.to_numeric(df_caixas['caixas'], errors='coerce')
+    df_caixas.dropna(subset=['mapa', 'caixas'], inplace=True)
+    
+    df_caixas['caixas'] = df_caixas['caixas'].astype(float) 
+
+    return df_caixas
+
+def get_indicadores_periodos_sincrono(
+    supabase: Client,
+    data_inicio_primeiro_str: str,
+    data_inicio_ultimo_str: str
+) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """
+    Indicadores de todos os períodos que começam entre as duas datas
+    (inclusive), numa só leitura (relatório de tendência). Cada linha mantém
+    data_inicio_periodo e data_fim_periodo para ser atribuída ao seu período.
+    """
+    try:
+        dados = _ler_paginas(
+            lambda: supabase.table("Resultados_Indicadores")
+            .select("*")
+            .gte("data_inicio_periodo", data_inicio_primeiro_str)
+            .lte("data_inicio_periodo", data_inicio_ultimo_str),
+            "supabase_indicadores"
+        )
+        if not dados:
+            return pd.DataFrame(), None
+        df_indicadores = pd.DataFrame(dados)
+        df_indicadores.columns = df_indicadores.columns.str.strip()
+        return df_indicadores, None
+
+    except SupabaseOcupado:
+        raise
+    except Exception as e:
+        print(f"Erro ao buscar dados de Indicadores: {e}")
+        return None, "Erro ao conectar à tabela de Indicadores."
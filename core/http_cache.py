@@ -0,0 +1,108 @@
+import time
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+from supabase import Client
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .versoes import Fonte, versao_fontes_sincrono
+
+# --- HTTP CACHING (ETag / Last-Modified / GET condicional) ---
+# O ETag é derivado de (rota, parâmetros da query, versão das tabelas de que o
+# relatório depende, ver core/versoes.py). Se o browser já tem essa versão,
+# responde-se 304 antes de qualquer trabalho com pandas.
+# Os fragmentos das sub-abas levam no URL (v=...) a versão com que a página foi
+# calculada: se esse resultado ainda está na cache, respondem sem ler as
+# versões no Supabase; só sem ele se faz a validação completa.
+
+# Momento em que cada ETag foi visto pela primeira vez (usado como Last-Modified)
+_PRIMEIRA_VEZ: Dict[str, float] = {}
+_MAX_ETAGS = 2048
+
+
+def _calcular_etag(request: Request, versao: str) -> str:
+    params = sorted(request.query_params.multi_items())
+    base = f"{request.url.path}?{params}#{versao}"
+    return '"' + hashlib.sha1(base.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def _registar_etag(etag: str) -> float:
+    if etag not in _PRIMEIRA_VEZ:
+        if len(_PRIMEIRA_VEZ) >= _MAX_ETAGS:
+            _PRIMEIRA_VEZ.clear()
+        _PRIMEIRA_VEZ[etag] = time.time()
+    return _PRIMEIRA_VEZ[etag]
+
+
+def cabecalhos_validacao(etag: Optional[str]) -> Dict[str, str]:
+    """
+    Cabeçalhos a enviar com a resposta completa. 'no-cache' obriga o browser
+    a revalidar sempre (com If-None-Match), mas sem voltar a descarregar.
+    """
+    if not etag:
+        return {}
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(_registar_etag(etag), usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+
+
+def _nao_modificado(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidatos = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return etag in candidatos or "*" in candidatos
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and etag in _PRIMEIRA_VEZ:
+        try:
+            desde = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(_PRIMEIRA_VEZ[etag]) <= desde
+    return False
+
+
+class ValidacaoHttp(NamedTuple):
+    versao: Optional[str]
+    etag: Optional[str]
+    resposta_304: Optional[Response]
+
+    def cabecalhos(self, resultado: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Validadores para a resposta completa. Só são enviados se o resultado
+        não tiver erro e tiver sido calculado com a versão atual dos dados
+        (um resultado antigo servido pela cache não pode ficar com o ETag novo).
+        """
+        if resultado.get("error_message") or resultado.get("versao_dados") != self.versao:
+            return {}
+        return cabecalhos_validacao(self.etag)
+
+
+def validar_versao(request: Request, versao: str) -> ValidacaoHttp:
+    """
+    Como validar_pedido, para uma versão já conhecida (ex: a da página,
+    levada no URL de um fragmento), sem ler as versões no Supabase.
+    """
+    etag = _calcular_etag(request, versao)
+    if _nao_modificado(request, etag):
+        return ValidacaoHttp(versao, etag, Response(status_code=304, headers=cabecalhos_validacao(etag)))
+    return ValidacaoHttp(versao, etag, None)
+
+
+async def validar_pedido(
+    request: Request,
+    supabase: Client,
+    fontes: List[Fonte]
+) -> ValidacaoHttp:
+    """
+    Calcula a versão dos dados e o ETag do pedido. Se resposta_304 não for
+    None, a rota deve devolvê-la de imediato.
+    """
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, fontes)
+    if versao is None:
+        return ValidacaoHttp(None, None, None)
+    return validar_versao(request, versao)
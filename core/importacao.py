@@ -0,0 +1,407 @@
+import os
+import time
+import zipfile
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from supabase import Client
+from postgrest import ReturnMethod
+
+from .analysis import limpar_texto
+from .database import NOME_DA_TABELA, NOME_COLUNA_DATA, COLUNA_NORMALIZACAO, VERSAO_NORMALIZACAO
+from .metricas import span
+from .saida import SupabaseOcupado
+from .periodo import calcular_periodo_pagamento
+
+# --- IMPORTAÇÃO EM MASSA (Caixas, Resultados_Indicadores e Distribuição) ---
+# Estas tabelas eram carregadas à mão no Supabase, fora da app. Aqui um
+# ficheiro XLSX ou CSV é lido em blocos (openpyxl em modo read-only ou
+# read_csv com chunksize), cada bloco é validado e convertido com operações
+# vetorizadas e as linhas válidas são gravadas em lotes grandes (upsert pela
+# chave da tabela). A memória fica limitada a alguns blocos, seja qual for o
+# tamanho do ficheiro. As linhas inválidas não são gravadas e voltam no
+# resumo (as primeiras IMPORTACAO_MAX_EXEMPLOS, com a linha do ficheiro).
+# Um upsert repetido não duplica linhas: se a importação falhar a meio, basta
+# enviar o ficheiro outra vez.
+# As viagens (Distribuição) são gravadas já normalizadas, com a marca
+# VERSAO_NORMALIZACAO (ver core/database.py): nomes e MAPA passam pelo mesmo
+# limpar_texto da leitura, os códigos vão como inteiros e a DATA em ISO, e a
+# leitura deixa de limpar essas linhas. O resumo diz os meses (AAAA-MM) das
+# viagens enviadas, para apagar as cópias Parquet desses meses (motor_sql.py).
+#   IMPORTACAO_LOTE=5000        linhas por bloco lido e por upsert
+#   IMPORTACAO_PARALELO=2       upserts em curso ao mesmo tempo (fica abaixo de SUPABASE_LIMITE_TABELA)
+#   IMPORTACAO_MAX_EXEMPLOS=20  linhas inválidas descritas no resumo
+#
+# O upsert precisa de uma restrição única com as colunas da chave:
+#   ALTER TABLE public."Caixas" ADD CONSTRAINT caixas_mapa_key UNIQUE (mapa);
+#   ALTER TABLE public."Resultados_Indicadores" ADD CONSTRAINT indicadores_periodo_key
+#       UNIQUE ("Codigo_M", data_inicio_periodo, data_fim_periodo);
+#   -- na Distribuição, apagar antes as linhas repetidas (o mesmo MAPA importado duas vezes)
+#   DELETE FROM public."Distribuição" a USING public."Distribuição" b
+#       WHERE a.ctid < b.ctid AND a."MAPA" = b."MAPA" AND a."COD" = b."COD";
+#   ALTER TABLE public."Distribuição" ADD CONSTRAINT distribuicao_mapa_cod_key UNIQUE ("MAPA", "COD");
+
+LOTE = int(os.environ.get("IMPORTACAO_LOTE", 5000))
+PARALELO = int(os.environ.get("IMPORTACAO_PARALELO", 2))
+MAX_EXEMPLOS = int(os.environ.get("IMPORTACAO_MAX_EXEMPLOS", 20))
+
+# Tipos: "texto", "texto_limpo" (com limpar_texto), "inteiro", "numero" (>= 0),
+# "data" (gravada em ISO)
+_INVALIDO = {
+    "texto": "texto inválido", "texto_limpo": "texto inválido", "inteiro": "não é um número inteiro",
+    "numero": "não é um número positivo", "data": "data inválida (aaaa-mm-dd ou dd/mm/aaaa)",
+}
+ESQUEMAS: Dict[str, Dict[str, Any]] = {
+    "Caixas": {
+        "colunas": {"data": "data", "mapa": "texto", "caixas": "numero"},
+        "obrigatorias": ("data", "mapa", "caixas"),
+        "chave": ("mapa",),
+    },
+    "Resultados_Indicadores": {
+        "colunas": {
+            "Codigo_M": "inteiro", "dev_pdv": "numero", "Rating_tx": "numero", "refugo": "numero",
+            "data_inicio_periodo": "data", "data_fim_periodo": "data",
+        },
+        # Um KPI em branco fica a nulo (o incentivo mostra "N/A")
+        "obrigatorias": ("Codigo_M", "data_inicio_periodo", "data_fim_periodo"),
+        "chave": ("Codigo_M", "data_inicio_periodo", "data_fim_periodo"),
+    },
+    NOME_DA_TABELA: {
+        "colunas": {
+            "MAPA": "texto_limpo", "DATA": "data", "COD": "inteiro", "MOTORISTA": "texto_limpo",
+            "MOTORISTA_2": "texto_limpo", "COD_2": "inteiro",
+            **{f"AJUDANTE_{n}": "texto_limpo" for n in (1, 2, 3)},
+            **{f"CODJ_{n}": "inteiro" for n in (1, 2, 3)},
+        },
+        "obrigatorias": ("MAPA", "DATA", "COD"),
+        "chave": ("MAPA", "COD"),
+        # Colunas fixas de cada linha gravada
+        "marca": {COLUNA_NORMALIZACAO: VERSAO_NORMALIZACAO},
+    },
+}
+
+
+class ErroImportacao(Exception):
+    """Ficheiro que não pode ser importado (formato, cabeçalho ou colunas em falta)."""
+
+
+# --- LEITURA EM BLOCOS ---
+def _blocos_csv(ficheiro: BinaryIO) -> Iterator[pd.DataFrame]:
+    inicio = ficheiro.read(65536)
+    ficheiro.seek(0)
+    try:
+        inicio.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # Um caráter cortado no fim da amostra não faz do ficheiro latin-1
+        encoding = "utf-8-sig" if e.start >= len(inicio) - 3 else "latin-1"
+    cabecalho = inicio.split(b"\n", 1)[0].decode(encoding, errors="replace")
+    separador = max((";", ",", "\t"), key=cabecalho.count)
+    # Tudo como texto: a conversão é feita (e validada) por _coagir
+    yield from pd.read_csv(
+        ficheiro, sep=separador, dtype=str, keep_default_na=False, chunksize=LOTE,
+        encoding=encoding, encoding_errors="replace", skip_blank_lines=True,
+    )
+
+
+def _blocos_xlsx(ficheiro: BinaryIO, tabela: str) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    livro = load_workbook(ficheiro, read_only=True, data_only=True)
+    try:
+        # Folha com o nome da tabela, se existir; senão a primeira
+        folha = livro[tabela] if tabela in livro.sheetnames else livro.worksheets[0]
+        linhas = folha.iter_rows(values_only=True)
+        cabecalho = None
+        for linha in linhas:
+            if any(v is not None and str(v).strip() for v in linha):
+                cabecalho = ["" if v is None else str(v) for v in linha]
+                break
+        if cabecalho is None:
+            return
+        bloco: List[tuple] = []
+        for linha in linhas:
+            bloco.append(linha[:len(cabecalho)])
+            if len(bloco) >= LOTE:
+                yield pd.DataFrame.from_records(bloco, columns=cabecalho)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame.from_records(bloco, columns=cabecalho)
+    finally:
+        livro.close()
+
+
+def ler_blocos(ficheiro: BinaryIO, nome_ficheiro: str, tabela: str) -> Iterator[pd.DataFrame]:
+    """Blocos de até IMPORTACAO_LOTE linhas do ficheiro (XLSX ou CSV), com os valores como vêm."""
+    extensao = os.path.splitext(nome_ficheiro or "")[1].lower()
+    if extensao in (".xlsx", ".xlsm"):
+        return _blocos_xlsx(ficheiro, tabela)
+    if extensao in (".csv", ".txt"):
+        return _blocos_csv(ficheiro)
+    raise ErroImportacao(f"Formato não suportado: '{extensao or nome_ficheiro}' (use .xlsx ou .csv)")
+
+
+# --- VALIDAÇÃO E CONVERSÃO (vetorizadas, por bloco) ---
+def _mapear_colunas(colunas: List[str], tabela: str) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Coluna do ficheiro -> coluna da tabela (sem diferença de maiúsculas nem
+    espaços) e as colunas do ficheiro que não são da tabela.
+    """
+    por_nome = {c.lower(): c for c in ESQUEMAS[tabela]["colunas"]}
+    mapa, ignoradas = {}, []
+    for coluna in colunas:
+        destino = por_nome.get(str(coluna).strip().lower())
+        if destino is not None and destino not in mapa.values():
+            mapa[coluna] = destino
+        elif str(coluna).strip():
+            ignoradas.append(str(coluna))
+    return mapa, ignoradas
+
+
+def _texto(serie: pd.Series) -> pd.Series:
+    """
+    Valores como texto limpo, em strings Arrow (as operações .str correm em
+    C++ em vez de objeto a objeto); vazios (None, NaN, '') ficam a NA.
+    """
+    texto = serie.astype("string[pyarrow]").str.strip()
+    return texto.where(texto != "")
+
+
+def _sem_decimal_excel(texto: pd.Series) -> pd.Series:
+    """Números do Excel (123456.0) ficam como o código que eram."""
+    inteiro = texto.str.fullmatch(r"\d+\.0+").fillna(False).to_numpy(dtype=bool)
+    if inteiro.any():
+        texto = texto.where(~inteiro, texto.str.replace(r"\.0+$", "", regex=True))
+    return texto
+
+
+def _coagir(texto: pd.Series, tipo: str, bruto: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    (valores convertidos, máscara dos valores presentes mas inválidos) a
+    partir de _texto() e da coluna como veio do ficheiro (bruto).
+    """
+    presente = texto.notna().to_numpy()
+    if tipo == "texto":
+        return _sem_decimal_excel(texto), np.zeros(len(texto), dtype=bool)
+    if tipo == "texto_limpo":
+        # O mesmo limpar_texto da leitura, sobre o valor sem strip (dá o mesmo
+        # que a limpeza de uma linha em bruto), uma vez por valor distinto
+        original = _sem_decimal_excel(bruto.astype("string[pyarrow]")).where(presente)
+        codigos, distintos = pd.factorize(original)
+        limpos = np.array([limpar_texto(v) for v in distintos] + [None], dtype=object)  # código -1 (vazio) -> None
+        return pd.Series(limpos[codigos], index=texto.index, dtype=object), np.zeros(len(texto), dtype=bool)
+    if tipo == "data":
+        # ISO (também datetime do Excel: "2025-10-01 00:00:00") ou dd/mm/aaaa
+        dez = texto.str.slice(0, 10)
+        datas = pd.to_datetime(dez, format="%Y-%m-%d", errors="coerce")
+        datas = datas.fillna(pd.to_datetime(dez, format="%d/%m/%Y", errors="coerce"))
+        return datas, presente & datas.isna().to_numpy()
+    # Números: vírgula decimal (1.234,5 -> 1234.5) quando o texto tem vírgula
+    com_virgula = texto.str.contains(",", regex=False).fillna(False).to_numpy(dtype=bool)
+    if com_virgula.any():
+        texto = texto.where(~com_virgula, texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    numeros = pd.to_numeric(texto, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    invalido = presente & ~np.isfinite(numeros)
+    with np.errstate(invalid="ignore"):
+        if tipo == "inteiro":
+            invalido |= np.isfinite(numeros) & (numeros != np.round(numeros))
+        else:
+            invalido |= numeros < 0
+    return pd.Series(np.where(invalido, np.nan, numeros), index=texto.index), invalido
+
+
+def validar_bloco(
+    bloco: pd.DataFrame,
+    tabela: str,
+    mapa_colunas: Dict[str, str],
+    primeira_linha: int,
+    periodo: Optional[Tuple[str, str]] = None
+) -> Tuple[pd.DataFrame, List[Dict[str, Any]], int]:
+    """
+    Converte o bloco para as colunas da tabela. Retorna (linhas válidas,
+    erros das linhas inválidas, número de linhas inválidas). primeira_linha é
+    a linha do ficheiro da primeira linha do bloco (para os erros).
+    """
+    esquema = ESQUEMAS[tabela]
+    bloco = bloco.rename(columns=mapa_colunas)[list(mapa_colunas.values())]
+    textos = {coluna: _texto(bloco[coluna]) for coluna in bloco.columns}
+    # Linhas totalmente vazias (fim de folha formatada) não contam
+    if textos:
+        preenchidas = np.logical_or.reduce([t.notna().to_numpy() for t in textos.values()])
+        bloco = bloco[preenchidas]
+        textos = {coluna: t[preenchidas] for coluna, t in textos.items()}
+    if periodo is not None:
+        for coluna, valor in zip(("data_inicio_periodo", "data_fim_periodo"), periodo):
+            if coluna not in textos:
+                textos[coluna] = pd.Series(valor, index=bloco.index, dtype="string[pyarrow]")
+
+    limpo = pd.DataFrame(index=bloco.index)
+    motivo = np.full(len(bloco), None, dtype=object)
+    for coluna, tipo in esquema["colunas"].items():
+        if coluna not in textos:
+            continue
+        valores, invalido = _coagir(textos[coluna], tipo, bloco[coluna] if coluna in bloco.columns else textos[coluna])
+        motivo[invalido & pd.isna(motivo)] = f"{coluna}: {_INVALIDO[tipo]}"
+        if coluna in esquema["obrigatorias"]:
+            falta = valores.isna().to_numpy() & ~invalido
+            motivo[falta & pd.isna(motivo)] = f"{coluna}: obrigatório"
+        limpo[coluna] = valores
+
+    if "data_inicio_periodo" in limpo.columns and "data_fim_periodo" in limpo.columns:
+        # O período tem de ser o de pagamento (26 a 25), como as rotas o procuram
+        inicio, fim = limpo["data_inicio_periodo"], limpo["data_fim_periodo"]
+        esperado = inicio + pd.DateOffset(months=1) - pd.Timedelta(days=1)
+        fora = (inicio.notna() & fim.notna() & ((inicio.dt.day != 26) | (fim != esperado))).to_numpy()
+        motivo[fora & pd.isna(motivo)] = "período: tem de ir do dia 26 ao dia 25 do mês seguinte"
+
+    invalidas = pd.notna(motivo)
+    erros = []
+    for posicao in np.flatnonzero(invalidas)[:MAX_EXEMPLOS]:
+        coluna = motivo[posicao].split(":", 1)[0]
+        valor = textos[coluna].iat[posicao] if coluna in textos else None
+        erros.append({
+            "linha": primeira_linha + int(bloco.index[posicao]),
+            "erro": motivo[posicao],
+            "valor": None if pd.isna(valor) else str(valor),
+        })
+
+    validas = limpo[~invalidas].copy()
+    for coluna, tipo in esquema["colunas"].items():
+        if coluna not in validas.columns:
+            continue
+        if tipo == "data":
+            validas[coluna] = validas[coluna].dt.strftime("%Y-%m-%d")
+        elif tipo == "inteiro":
+            validas[coluna] = validas[coluna].astype("Int64")
+    for coluna, valor in esquema.get("marca", {}).items():
+        validas[coluna] = valor
+    # A mesma chave duas vezes no mesmo upsert é recusada pelo Postgres: fica a última
+    validas = validas.drop_duplicates(subset=list(esquema["chave"]), keep="last")
+    return validas, erros, int(invalidas.sum())
+
+
+# --- GRAVAÇÃO ---
+def _registos(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Linhas em JSON (tipos Python, NaN/NA -> None), coluna a coluna."""
+    colunas = []
+    for coluna in df.columns:
+        serie = df[coluna]
+        # Números inteiros vão como inteiros (colunas integer no Postgres recusam "286.0")
+        if serie.dtype == "float64" and np.array_equal(serie.dropna(), serie.dropna().round()):
+            serie = serie.astype("Int64")
+        colunas.append(serie.astype(object).where(serie.notna(), None).tolist())
+    nomes = list(df.columns)
+    return [dict(zip(nomes, linha)) for linha in zip(*colunas)]
+
+
+def _gravar_lote(supabase: Client, tabela: str, registos: List[Dict[str, Any]]):
+    with span("supabase_upsert") as s:
+        s.linhas = len(registos)
+        supabase.table(tabela).upsert(
+            registos, on_conflict=",".join(ESQUEMAS[tabela]["chave"]), returning=ReturnMethod.minimal
+        ).execute()
+
+
+def _esperar(lote: Tuple[Future, int]) -> int:
+    futuro, linhas = lote
+    futuro.result()
+    return linhas
+
+
+def importar_sincrono(
+    supabase: Client,
+    tabela: str,
+    ficheiro: BinaryIO,
+    nome_ficheiro: str,
+    data_periodo: Optional[str] = None,
+    simular: bool = False
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Lê, valida e grava (upsert) o ficheiro na tabela. data_periodo (uma data
+    do período de pagamento) preenche data_inicio_periodo/data_fim_periodo
+    quando o ficheiro não as tem. Com simular=True só valida.
+    Retorna (resumo, error_message); com erro a meio, o resumo diz quantas
+    linhas já foram gravadas. Na Distribuição, resumo["meses"] são os meses
+    das linhas enviadas para gravar.
+    """
+    esquema = ESQUEMAS[tabela]
+    resumo = {
+        "tabela": tabela, "ficheiro": nome_ficheiro, "simulacao": simular,
+        "linhas_lidas": 0, "linhas_validas": 0, "linhas_invalidas": 0,
+        "linhas_gravadas": 0, "lotes": 0, "colunas_ignoradas": [], "erros": [],
+    }
+    inicio = time.perf_counter()
+    meses = set()
+    pendentes: deque = deque()
+    executor = ThreadPoolExecutor(max_workers=max(1, PARALELO), thread_name_prefix="importacao")
+    try:
+        periodo = calcular_periodo_pagamento(data_periodo) if data_periodo else None
+        mapa_colunas = None
+        primeira_linha = 2  # linha 1 é o cabeçalho
+        blocos = ler_blocos(ficheiro, nome_ficheiro, tabela)
+        while True:
+            with span("importacao_ler") as s:
+                bloco = next(blocos, None)
+                s.linhas = 0 if bloco is None else len(bloco)
+            if bloco is None:
+                break
+            if mapa_colunas is None:
+                mapa_colunas, resumo["colunas_ignoradas"] = _mapear_colunas(list(bloco.columns), tabela)
+                presentes = set(mapa_colunas.values()) | ({"data_inicio_periodo", "data_fim_periodo"} if periodo else set())
+                em_falta = [c for c in esquema["obrigatorias"] if c not in presentes]
+                if em_falta:
+                    raise ErroImportacao(
+                        f"Colunas em falta: {', '.join(em_falta)} (encontradas: {', '.join(map(str, bloco.columns))})"
+                    )
+            bloco = bloco.reset_index(drop=True)
+
+            with span("importacao_validar") as s:
+                s.linhas = len(bloco)
+                validas, erros, n_invalidas = validar_bloco(bloco, tabela, mapa_colunas, primeira_linha, periodo)
+            primeira_linha += len(bloco)
+            resumo["linhas_lidas"] += len(bloco)
+            resumo["linhas_validas"] += len(bloco) - n_invalidas  # incluindo chaves repetidas no bloco
+            resumo["linhas_invalidas"] += n_invalidas
+            resumo["erros"].extend(erros[:MAX_EXEMPLOS - len(resumo["erros"])])
+            if simular or validas.empty:
+                continue
+
+            # No máximo PARALELO lotes em curso: o próximo bloco é lido enquanto
+            # os anteriores são gravados, sem acumular o ficheiro em memória
+            while len(pendentes) >= max(1, PARALELO):
+                resumo["linhas_gravadas"] += _esperar(pendentes.popleft())
+            if tabela == NOME_DA_TABELA:
+                meses.update(validas[NOME_COLUNA_DATA].str.slice(0, 7).unique())
+            registos = _registos(validas)
+            contexto = contextvars.copy_context()  # spans do upsert entram no Server-Timing do pedido
+            pendentes.append((executor.submit(contexto.run, _gravar_lote, supabase, tabela, registos), len(registos)))
+            resumo["lotes"] += 1
+
+        while pendentes:
+            resumo["linhas_gravadas"] += _esperar(pendentes.popleft())
+        return resumo, None
+
+    except SupabaseOcupado:
+        raise
+    except ErroImportacao as e:
+        return None, str(e)
+    except (ValueError, zipfile.BadZipFile) as e:
+        # Data do período inválida ou ficheiro ilegível (CSV mal formado, XLSX corrompido)
+        return None, f"Ficheiro inválido: {e}"
+    except Exception as e:
+        print(f"Erro ao importar '{nome_ficheiro}' para {tabela}: {e}")
+        for futuro, _ in pendentes:
+            futuro.cancel()
+        if "no unique or exclusion constraint" in str(e):
+            return resumo, f"Erro: a tabela '{tabela}' não tem a restrição única ({', '.join(esquema['chave'])}) de que o upsert precisa."
+        if "permission denied" in str(e):
+            return resumo, f"Erro de permissão. Execute 'GRANT ALL ON TABLE public.\"{tabela}\" TO service_role;' no Supabase."
+        return resumo, f"Erro ao gravar na tabela {tabela} ({resumo['linhas_gravadas']} linhas gravadas; pode reenviar o ficheiro)."
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        resumo["segundos"] = round(time.perf_counter() - inicio, 3)
+        if tabela == NOME_DA_TABELA:
+            resumo["meses"] = sorted(meses)
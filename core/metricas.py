@@ -0,0 +1,241 @@
+import os
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+# --- MÉTRICAS POR ETAPA (spans) ---
+# Uso:
+#     with span("supabase_distribuicao") as s:
+#         ...
+#         s.linhas = len(dados)
+# Cada span regista a duração, as linhas processadas e os bytes recebidos do
+# Supabase (contados automaticamente pelo hook do cliente HTTP). Os valores
+# vão para histogramas em formato Prometheus (/metrics) e para o cabeçalho
+# Server-Timing do pedido em curso.
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_LINHAS = (10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BUCKETS_BYTES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+class Span:
+    __slots__ = ("nome", "inicio", "duracao", "linhas", "bytes")
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.inicio = time.perf_counter()
+        self.duracao = 0.0
+        self.linhas = None
+        self.bytes = 0
+
+
+class Histograma:
+    def __init__(self, nome: str, ajuda: str, buckets: Tuple[float, ...]):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.buckets = buckets
+        # etapa -> [contagens por bucket..., soma, total]
+        self._series: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, etapa: str, valor: float):
+        with self._lock:
+            serie = self._series.get(etapa)
+            if serie is None:
+                serie = self._series[etapa] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def formatar(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            series = {etapa: list(serie) for etapa, serie in self._series.items()}
+        for etapa in sorted(series):
+            serie = series[etapa]
+            for limite, contagem in zip(self.buckets, serie):
+                linhas.append(f'{self.nome}_bucket{{etapa="{etapa}",le="{limite}"}} {contagem}')
+            linhas.append(f'{self.nome}_bucket{{etapa="{etapa}",le="+Inf"}} {serie[-1]}')
+            linhas.append(f'{self.nome}_sum{{etapa="{etapa}"}} {serie[-2]}')
+            linhas.append(f'{self.nome}_count{{etapa="{etapa}"}} {serie[-1]}')
+        return linhas
+
+
+HISTOGRAMA_DURACAO = Histograma("etapa_duracao_segundos", "Duração de cada etapa do pedido", BUCKETS_SEGUNDOS)
+HISTOGRAMA_LINHAS = Histograma("etapa_linhas", "Linhas processadas por etapa", BUCKETS_LINHAS)
+HISTOGRAMA_BYTES = Histograma("etapa_bytes_recebidos", "Bytes recebidos do Supabase por etapa", BUCKETS_BYTES)
+_HISTOGRAMAS = [HISTOGRAMA_DURACAO, HISTOGRAMA_LINHAS, HISTOGRAMA_BYTES]
+
+# Spans terminados no pedido em curso (para o Server-Timing) e span aberto atual
+_spans_pedido: ContextVar[Optional[List[Span]]] = ContextVar("spans_pedido", default=None)
+_span_atual: ContextVar[Optional[Span]] = ContextVar("span_atual", default=None)
+# Função chamada com cada span terminado no contexto em curso (ex: progresso
+# de uma tarefa em segundo plano, ver core/tarefas.py)
+_observador: ContextVar[Optional[Callable[[Span], None]]] = ContextVar("observador_spans", default=None)
+
+
+def _registar(s: Span):
+    HISTOGRAMA_DURACAO.observar(s.nome, s.duracao)
+    if s.linhas is not None:
+        HISTOGRAMA_LINHAS.observar(s.nome, s.linhas)
+    if s.bytes:
+        HISTOGRAMA_BYTES.observar(s.nome, s.bytes)
+    spans = _spans_pedido.get()
+    if spans is not None:
+        spans.append(s)
+    observador = _observador.get()
+    if observador is not None:
+        observador(s)
+
+
+def observar_spans(funcao: Callable[[Span], None]):
+    """
+    A partir daqui, no contexto em curso (e nas threads que o copiam, como
+    o run_in_threadpool), cada span terminado é passado a funcao.
+    """
+    _observador.set(funcao)
+
+
+@contextmanager
+def span(nome: str):
+    s = Span(nome)
+    token = _span_atual.set(s)
+    try:
+        yield s
+    finally:
+        _span_atual.reset(token)
+        s.duracao = time.perf_counter() - s.inicio
+        _registar(s)
+
+
+def registar_etapa(nome: str, duracao: float, linhas: Optional[int] = None):
+    """
+    Regista uma etapa medida à mão. Usado onde o 'with span()' não serve,
+    ex: geradores consumidos pelo StreamingResponse, em que cada next()
+    corre num contexto diferente.
+    """
+    s = Span(nome)
+    s.duracao = duracao
+    s.linhas = linhas
+    _registar(s)
+
+
+def medir(nome: str):
+    """
+    Decorador: mede a função inteira como um span. Se o primeiro argumento
+    for um DataFrame, o número de linhas fica registado.
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(nome) as s:
+                if args and hasattr(args[0], "shape"):
+                    s.linhas = len(args[0])
+                return func(*args, **kwargs)
+        return wrapper
+    return decorador
+
+
+def adicionar_bytes(n: int):
+    s = _span_atual.get()
+    if s is not None:
+        s.bytes += n
+
+
+def iniciar_pedido() -> List[Span]:
+    """
+    Chamado no início de cada pedido (middleware). Os spans terminados
+    durante o pedido, incluindo os das funções em thread pool, ficam na lista.
+    """
+    spans: List[Span] = []
+    _spans_pedido.set(spans)
+    return spans
+
+
+def server_timing(spans: List[Span]) -> str:
+    # Agrega por nome (ex: várias páginas buscadas ao Supabase)
+    totais: Dict[str, float] = {}
+    for s in spans:
+        totais[s.nome] = totais.get(s.nome, 0.0) + s.duracao
+    return ", ".join(f"{nome};dur={duracao * 1000:.1f}" for nome, duracao in totais.items())
+
+
+# Funções que devolvem gauges extra para o /metrics (ver registar_gauges)
+_FONTES_GAUGES: List[Callable[[], List[tuple]]] = []
+
+
+def registar_gauges(fonte: Callable[[], List[tuple]]):
+    """
+    Regista uma função que devolve gauges [(nome, ajuda, valor, labels), ...],
+    lida em cada pedido ao /metrics (ex: ocupação da porta do Supabase).
+    """
+    _FONTES_GAUGES.append(fonte)
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource  # fora do Linux: pico de RSS (em KB)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _metricas_processo() -> List[str]:
+    """
+    Gauges do worker: RSS e ocupação do thread pool (onde correm as funções
+    síncronas). Com vários workers, o label pid distingue cada processo.
+    Tem de ser chamada no event loop.
+    """
+    import anyio.to_thread
+
+    pid = os.getpid()
+    limitador = anyio.to_thread.current_default_thread_limiter()
+    estatisticas = limitador.statistics()
+    gauges = [
+        ("processo_rss_bytes", "Memória residente do worker", _rss_bytes()),
+        ("threadpool_ocupadas", "Threads do pool em uso", estatisticas.borrowed_tokens),
+        ("threadpool_limite", "Tamanho máximo do pool", estatisticas.total_tokens),
+        ("threadpool_em_espera", "Tarefas à espera de uma thread livre", estatisticas.tasks_waiting),
+    ]
+    linhas = []
+    for nome, ajuda, valor in gauges:
+        linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} gauge", f'{nome}{{pid="{pid}"}} {valor}']
+
+    # Gauges de outros módulos: (nome, ajuda, valor, labels)
+    vistos = set()
+    for fonte in _FONTES_GAUGES:
+        for nome, ajuda, valor, labels in fonte():
+            if nome not in vistos:
+                vistos.add(nome)
+                linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} gauge"]
+            rotulos = "".join(f',{k}="{v}"' for k, v in labels.items())
+            linhas.append(f'{nome}{{pid="{pid}"{rotulos}}} {valor}')
+    return linhas
+
+
+def formatar_prometheus() -> str:
+    linhas = _metricas_processo()
+    for histograma in _HISTOGRAMAS:
+        linhas.extend(histograma.formatar())
+    return "\n".join(linhas) + "\n"
+
+
+def instrumentar_cliente(supabase):
+    """
+    Regista um hook no cliente HTTP do PostgREST que soma os bytes de cada
+    resposta ao span aberto no momento (ex: 'supabase_distribuicao').
+    """
+    def _contar_bytes(response):
+        response.read()
+        adicionar_bytes(len(response.content))
+
+    try:
+        supabase.postgrest.session.event_hooks["response"].append(_contar_bytes)
+    except AttributeError as e:
+        print(f"Não foi possível instrumentar o cliente Supabase: {e}")
@@ -0,0 +1,305 @@
+import os
+import re
+import glob
+import datetime
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from supabase import Client
+
+from .analysis import REGRAS_EQUIPAS, _montar_dashboard
+from .database import get_dados_apurados, NOME_DA_TABELA, NOME_COLUNA_DATA
+from .versoes import versoes_tabelas_sincrono
+from .metricas import span, medir
+from .saida import SupabaseOcupado
+
+try:
+    import duckdb
+except ImportError:  # duckdb é opcional; sem ele fica sempre o motor pandas
+    duckdb = None
+
+# --- MOTOR DE CÁLCULO EM SQL (DuckDB) ---
+# A deteção de equipas (xadrez) e a acumulação de caixas são group-bys e
+# joins. Com MOTOR_CALCULO=duckdb correm em SQL num DuckDB embebido (vetorizado
+# e multi-thread) sobre cópias locais da Distribuição em Parquet:
+#   MOTOR_CALCULO=pandas|duckdb     motor usado no xadrez (equipas) e nas caixas
+#   CACHE_PARQUET_DIR=...           pasta das cópias (uma por mês)
+#   MOTOR_THREADS=0                 threads do DuckDB (0 = todos os CPUs)
+#   CACHE_TTL_PARQUET=300           validade (s) das cópias quando não há versão
+# Cada mês fica num ficheiro distribuicao_AAAA-MM_v<versão>.parquet, com a
+# versão da Distribuição em versoes_dados (ver versoes.py, um só pedido para
+# todos os meses): qualquer escrita na tabela, mesmo uma correção que mantenha
+# o número de linhas, muda a versão e o mês é buscado de novo. Sem a tabela
+# versoes_dados, a cópia (distribuicao_AAAA-MM_sem_versao.parquet) só serve
+# durante CACHE_TTL_PARQUET segundos. A importação apaga as cópias dos meses
+# que alterou (apagar_snapshots). Só a parte pesada passa para
+# SQL; a montagem final (por motorista/colaborador) é a mesma função Python do
+# motor pandas, e benchmarks/motor_sql.py confirma que o resultado é igual.
+
+MOTOR_CALCULO = os.environ.get("MOTOR_CALCULO", "pandas")
+PASTA_PARQUET = os.environ.get("CACHE_PARQUET_DIR", os.path.join(tempfile.gettempdir(), "cache_parquet"))
+MOTOR_THREADS = int(os.environ.get("MOTOR_THREADS", 0))
+TTL_PARQUET = float(os.environ.get("CACHE_TTL_PARQUET", 300))
+
+if MOTOR_CALCULO == "duckdb" and duckdb is None:
+    print("MOTOR_CALCULO=duckdb mas o duckdb não está instalado; a usar pandas")
+
+# Evita buscar o mesmo mês duas vezes em simultâneo no mesmo processo
+_locks_meses: Dict[str, threading.Lock] = {}
+_lock_locks = threading.Lock()
+
+
+def duckdb_ativo() -> bool:
+    return MOTOR_CALCULO == "duckdb" and duckdb is not None
+
+
+def _ligar() -> "duckdb.DuckDBPyConnection":
+    con = duckdb.connect()
+    if MOTOR_THREADS > 0:
+        con.execute(f"SET threads TO {MOTOR_THREADS}")
+    return con
+
+
+def _literal(valor: str) -> str:
+    return "'" + str(valor).replace("'", "''") + "'"
+
+
+def _coluna(nome: str) -> str:
+    return '"' + nome.replace('"', '""') + '"'
+
+
+# --- CÓPIAS MENSAIS EM PARQUET ---
+def _meses(data_inicio: str, data_fim: str) -> List[Tuple[str, str, str]]:
+    """[(AAAA-MM, primeiro dia, último dia), ...] dos meses que o período toca."""
+    inicio = datetime.date.fromisoformat(data_inicio).replace(day=1)
+    fim = datetime.date.fromisoformat(data_fim)
+    meses = []
+    while inicio <= fim:
+        seguinte = (inicio + datetime.timedelta(days=32)).replace(day=1)
+        meses.append((inicio.strftime("%Y-%m"), inicio.isoformat(), (seguinte - datetime.timedelta(days=1)).isoformat()))
+        inicio = seguinte
+    return meses
+
+
+def _lock_mes(mes: str) -> threading.Lock:
+    with _lock_locks:
+        return _locks_meses.setdefault(mes, threading.Lock())
+
+
+def escrever_parquet(df: pd.DataFrame, caminho: str, ordem_inicial: int = 0):
+    """
+    Grava o DataFrame em Parquet com a coluna _ordem (posição original da
+    linha), usada para reproduzir o "primeiro" do drop_duplicates do pandas.
+    Escreve para um ficheiro temporário e troca no fim (vários workers).
+    """
+    df = df.copy(deep=False)
+    df["_ordem"] = np.arange(ordem_inicial, ordem_inicial + len(df), dtype=np.int64)
+    temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    con = _ligar()
+    try:
+        con.register("origem", df)
+        con.execute(f"COPY origem TO {_literal(temporario)} (FORMAT parquet)")
+    finally:
+        con.close()
+    os.replace(temporario, caminho)
+
+
+def _padrao_mes(mes: str) -> str:
+    return os.path.join(PASTA_PARQUET, f"distribuicao_{mes}_*.parquet")
+
+
+def _copia_valida(caminho: str, versao: Optional[int]) -> bool:
+    try:
+        modificado = os.path.getmtime(caminho)
+    except OSError:
+        return False
+    # Com versão, o nome do ficheiro já diz se está atualizado
+    return versao is not None or (datetime.datetime.now().timestamp() - modificado) < TTL_PARQUET
+
+
+def _snapshot_mes(supabase: Client, mes: str, inicio: str, fim: str, versao: Optional[int]) -> Tuple[Optional[str], Optional[str]]:
+    """Caminho da cópia do mês (None se o mês não tem viagens) ou (None, erro)."""
+    sufixo = f"v{versao}" if versao is not None else "sem_versao"
+    caminho = os.path.join(PASTA_PARQUET, f"distribuicao_{mes}_{sufixo}.parquet")
+    with _lock_mes(mes):
+        if _copia_valida(caminho, versao):
+            return caminho, None
+
+        df, error_message = get_dados_apurados(supabase, inicio, fim, "")
+        if error_message is not None:
+            if df is None and error_message.startswith("Nenhum dado"):
+                return None, None  # mês sem viagens
+            return None, error_message
+
+        os.makedirs(PASTA_PARQUET, exist_ok=True)
+        with span("parquet_gravar") as s:
+            s.linhas = len(df)
+            # _ordem começa em AAAAMM * 10^8: a ordem entre meses segue o calendário
+            escrever_parquet(df, caminho, int(mes.replace("-", "")) * 10**8)
+        for antigo in glob.glob(_padrao_mes(mes)):
+            if antigo != caminho:
+                try:
+                    os.remove(antigo)
+                except OSError:
+                    pass  # outro worker já o apagou
+    return caminho, None
+
+
+def snapshots_viagens(supabase: Client, data_inicio: str, data_fim: str) -> Tuple[Optional[List[str]], Optional[str]]:
+    """
+    Ficheiros Parquet (um por mês) que cobrem o período, atualizados se a
+    versão da Distribuição mudou. Retorna (ficheiros, None) ou (None, erro).
+    """
+    meses = _meses(data_inicio, data_fim)
+    try:
+        with span("versao_dados"):
+            versao = versoes_tabelas_sincrono(supabase).get(NOME_DA_TABELA)
+    except SupabaseOcupado:
+        raise
+    except Exception as e:
+        print(f"Sem versão da Distribuição para as cópias Parquet (validade de {TTL_PARQUET:.0f}s): {e}")
+        versao = None
+    with span("parquet_snapshots"):
+        # Os meses em falta são buscados em paralelo
+        with ThreadPoolExecutor(max_workers=min(4, len(meses))) as executor:
+            futuros = [
+                executor.submit(contextvars.copy_context().run, _snapshot_mes, supabase, mes, inicio, fim, versao)
+                for mes, inicio, fim in meses
+            ]
+            resultados = [f.result() for f in futuros]
+
+    ficheiros = []
+    for caminho, error_message in resultados:
+        if error_message is not None:
+            return None, error_message
+        if caminho is not None:
+            ficheiros.append(caminho)
+    if not ficheiros:
+        return None, "Nenhum dado encontrado para o período selecionado."
+    return ficheiros, None
+
+
+def apagar_snapshots(meses: List[str]):
+    """Apaga as cópias Parquet dos meses dados (AAAA-MM), ex: depois de uma importação."""
+    for mes in meses:
+        with _lock_mes(mes):
+            for caminho in glob.glob(_padrao_mes(mes)):
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass  # outro worker já o apagou
+
+
+# --- LIGAÇÃO COM A VISTA 'viagens' ---
+FonteViagens = Union[pd.DataFrame, List[str]]
+
+
+def abrir_viagens(fonte: FonteViagens, data_inicio: str = None, data_fim: str = None):
+    """
+    Abre uma ligação DuckDB com a vista 'viagens' (colunas da Distribuição
+    já limpas + _ordem), a partir de um DataFrame ou dos ficheiros Parquet
+    filtrados pelo período.
+    """
+    con = _ligar()
+    if isinstance(fonte, pd.DataFrame):
+        df = fonte.copy(deep=False)
+        df["_ordem"] = np.arange(len(df), dtype=np.int64)
+        con.register("viagens_df", df)
+        con.execute("CREATE TEMP VIEW viagens AS SELECT * FROM viagens_df")
+    else:
+        lista = ", ".join(_literal(f) for f in fonte)
+        filtro = ""
+        if data_inicio and data_fim:
+            coluna = _coluna(NOME_COLUNA_DATA)
+            filtro = f" WHERE {coluna} >= {_literal(data_inicio)} AND {coluna} <= {_literal(data_fim)}"
+        con.execute(f"CREATE TEMP VIEW viagens AS SELECT * FROM read_parquet([{lista}], union_by_name = true){filtro}")
+    return con
+
+
+def colunas_viagens(con) -> List[str]:
+    return [linha[0] for linha in con.execute("DESCRIBE viagens").fetchall()]
+
+
+# --- EQUIPAS (XADREZ) ---
+def _modas(con, coluna: str) -> Dict[Any, Any]:
+    # Moda por ajudante; empates -> o menor valor, como o Series.mode() do pandas
+    return dict(con.execute(f"""
+        SELECT aj, {coluna} FROM (SELECT aj, {coluna}, count(*) AS n FROM m GROUP BY aj, {coluna})
+        QUALIFY row_number() OVER (PARTITION BY aj ORDER BY n DESC, {coluna}) = 1
+    """).fetchall())
+
+
+@medir("analise_equipas_duckdb")
+def equipas_duckdb(con) -> list:
+    """
+    Igual a gerar_dashboard_e_mapas(df.drop_duplicates(subset=['MAPA']))["dashboard_data"],
+    com as viagens na vista 'viagens' de abrir_viagens().
+    """
+    colunas = colunas_viagens(con)
+    posicoes = [
+        aj_col.split("_")[-1] for aj_col in sorted(c for c in colunas if re.fullmatch(r"AJUDANTE_\d+", c))
+        if f"CODJ_{aj_col.split('_')[-1]}" in colunas
+    ]
+    colunas_motorista = [c for c in ["COD", "MOTORISTA", "MOTORISTA_2", "COD_2"] if c in colunas]
+    usadas = colunas_motorista + [c for num in posicoes for c in (f"AJUDANTE_{num}", f"CODJ_{num}")] + ["_ordem"]
+    lista = ", ".join(_coluna(c) for c in usadas)
+    if "MAPA" in colunas:
+        # Primeira linha de cada MAPA (agregação por hash; mais leve que uma janela)
+        con.execute(f'CREATE TEMP TABLE v AS SELECT {lista} FROM viagens WHERE _ordem IN (SELECT min(_ordem) FROM viagens GROUP BY "MAPA")')
+    else:
+        chave = ", ".join(_coluna(c) for c in colunas if c != "_ordem")
+        con.execute(f"CREATE TEMP TABLE v AS SELECT {lista} FROM viagens QUALIFY row_number() OVER (PARTITION BY {chave} ORDER BY _ordem) = 1")
+
+    # Ajudantes em formato longo (uma linha por viagem e posição)
+    partes = [
+        f"SELECT \"COD\" AS mot, CAST(\"AJUDANTE_{num}\" AS VARCHAR) AS aj_nome, "
+        f"TRY_CAST(\"CODJ_{num}\" AS DOUBLE) AS aj_num, 'AJUDANTE {num}' AS posicao FROM v"
+        for num in posicoes
+    ]
+    if not partes:
+        return []
+    con.execute(f"""
+        CREATE TEMP TABLE m AS
+        SELECT mot, aj_nome, CAST(trunc(aj_num) AS BIGINT) AS aj, posicao
+        FROM ({' UNION ALL '.join(partes)})
+        WHERE aj_nome IS NOT NULL AND regexp_matches(aj_nome, '\\S')
+          AND aj_num IS NOT NULL AND NOT isnan(aj_num)
+    """)
+    max_pos = con.execute("SELECT count(DISTINCT posicao) FROM m").fetchone()[0]
+    if max_pos == 0:
+        return []
+
+    motoristas_no_periodo = con.execute(f"""
+        SELECT {', '.join(_coluna(c) for c in colunas_motorista)} FROM v
+        QUALIFY row_number() OVER (PARTITION BY "COD" ORDER BY _ordem) = 1
+        ORDER BY _ordem
+    """).df()
+
+    mapas = {
+        "motorista_fixo_map": _modas(con, "mot"),
+        "posicao_fixa_map": _modas(con, "posicao"),
+        "nome_ajudante_map": _modas(con, "aj_nome"),
+        "contagem_viagens_motorista": dict(con.execute('SELECT "COD", count(*) FROM v GROUP BY "COD"').fetchall()),
+    }
+    contagem_viagens_ajudantes = con.execute("""
+        SELECT mot AS MOTORISTA_COD, aj AS AJUDANTE_COD, count(*) AS VIAGENS
+        FROM m GROUP BY mot, aj ORDER BY mot, aj
+    """).df()
+
+    return _montar_dashboard(motoristas_no_periodo, contagem_viagens_ajudantes, mapas, max_pos, REGRAS_EQUIPAS)
+
+
+def equipas_periodo(supabase: Client, data_inicio: str, data_fim: str) -> Tuple[list, Optional[str]]:
+    """Dashboard de equipas do período a partir das cópias Parquet."""
+    ficheiros, error_message = snapshots_viagens(supabase, data_inicio, data_fim)
+    if error_message is not None:
+        return [], error_message
+    con = abrir_viagens(ficheiros, data_inicio, data_fim)
+    try:
+        return equipas_duckdb(con), None
+    finally:
+        con.close()
@@ -0,0 +1,212 @@
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from .analysis import limpar_texto
+from .metricas import span
+
+# --- ÍNDICE DE NOMES (pesquisa e sugestões do xadrez) ---
+# A pesquisa por nome fazia str.contains nas cinco colunas de nomes a cada
+# pedido; com a sugestão a cada tecla, isso é um varrimento do período por
+# letra. Aqui os nomes distintos (viagens + Cadastro, já com limpar_texto)
+# ficam num índice de n-gramas (1 a 3 letras): o termo procura-se pela
+# interseção das listas dos seus n-gramas e só os candidatos são confirmados
+# com "termo in nome". Cada nome aponta para as linhas onde aparece e, pelo
+# Cadastro, para o código do colaborador (e daí para as suas viagens, mesmo
+# que numa viagem o nome esteja escrito de outra forma).
+# O índice de n-gramas depende só do vocabulário: é reaproveitado enquanto
+# os nomes não mudarem (chave = hash dos nomes distintos).
+
+MAX_INDICES = 4
+MIN_LETRAS_SUGESTAO = 2
+
+_indices: "OrderedDict[str, IndiceNgramas]" = OrderedDict()
+_lock_indices = threading.Lock()
+
+
+class IndiceNgramas:
+    """Nomes distintos -> listas de n-gramas (1 a 3 letras) para pesquisa por substring."""
+
+    def __init__(self, nomes: List[str]):
+        self.nomes = nomes
+        listas = defaultdict(list)
+        for i, nome in enumerate(nomes):
+            for n in (1, 2, 3):
+                for grama in {nome[k:k + n] for k in range(len(nome) - n + 1)}:
+                    listas[grama].append(i)
+        # Os ids entram por ordem, por isso cada lista já está ordenada
+        self._listas = {grama: np.array(ids, dtype=np.int32) for grama, ids in listas.items()}
+
+    def procurar(self, termo: str) -> np.ndarray:
+        """Ids dos nomes que contêm o termo (já normalizado)."""
+        if not termo:
+            return np.arange(len(self.nomes), dtype=np.int32)
+        n = min(3, len(termo))
+        gramas = sorted({termo[k:k + n] for k in range(len(termo) - n + 1)}, key=lambda g: len(self._listas.get(g, ())))
+        candidatos = self._listas.get(gramas[0])
+        if candidatos is None:
+            return np.empty(0, dtype=np.int32)
+        for grama in gramas[1:]:
+            candidatos = np.intersect1d(candidatos, self._listas.get(grama, ()), assume_unique=True)
+            if len(candidatos) == 0:
+                return candidatos
+        if len(termo) <= 3:
+            return candidatos  # o próprio termo é um n-grama: não há falsos positivos
+        return np.array([i for i in candidatos if termo in self.nomes[i]], dtype=np.int32)
+
+
+def _indice_para(nomes: List[str]) -> IndiceNgramas:
+    chave = hashlib.sha1("\n".join(nomes).encode("utf-8")).hexdigest()
+    with _lock_indices:
+        indice = _indices.get(chave)
+        if indice is not None:
+            _indices.move_to_end(chave)
+            return indice
+    with span("indexar_nomes") as s:
+        s.linhas = len(nomes)
+        indice = IndiceNgramas(nomes)
+    with _lock_indices:
+        _indices[chave] = indice
+        while len(_indices) > MAX_INDICES:
+            _indices.popitem(last=False)
+    return indice
+
+
+def _por_valor(valores: pd.Series) -> Dict[object, np.ndarray]:
+    """Valor -> linhas (posições) onde aparece, ignorando nulos."""
+    fatores, unicos = pd.factorize(valores)
+    validas = np.flatnonzero(fatores >= 0)
+    ordem = validas[np.argsort(fatores[validas], kind="stable")]
+    limites = np.flatnonzero(np.diff(fatores[ordem])) + 1
+    return {unicos[fatores[grupo[0]]]: grupo for grupo in np.split(ordem, limites) if len(grupo)}
+
+
+def _codigos(valores: pd.Series) -> pd.Series:
+    return pd.to_numeric(valores, errors="coerce")
+
+
+class PesquisaNomes:
+    """
+    Pesquisa de nomes sobre as viagens de um ArmazemViagens (todas as linhas
+    do armazém) e o Cadastro.
+    """
+
+    def __init__(self, df: pd.DataFrame, df_cadastro: Optional[pd.DataFrame]):
+        self.n_linhas = len(df)
+        # Referência ao Cadastro usado: enquanto esta pesquisa existir, o id()
+        # que a identifica em pesquisa_nomes não passa para outro DataFrame
+        self._cadastro = df_cadastro
+        # (coluna do nome, coluna do código, tipo), como a pesquisa antiga
+        pares = [("MOTORISTA", "COD", "motorista"), ("MOTORISTA_2", "COD_2", "motorista")]
+        pares += [(f"AJUDANTE_{n}", f"CODJ_{n}", "ajudante") for n in (1, 2, 3)]
+        pares = [(nome, cod, tipo) for nome, cod, tipo in pares if nome in df.columns]
+
+        linhas_por_nome: Dict[str, List[np.ndarray]] = defaultdict(list)
+        contagens: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        linhas_por_codigo: Dict[Tuple[str, int], List[np.ndarray]] = defaultdict(list)
+        for col_nome, col_cod, tipo in pares:
+            for nome, linhas in _por_valor(df[col_nome]).items():
+                if isinstance(nome, str):
+                    linhas_por_nome[nome].append(linhas)
+            if col_cod in df.columns:
+                codigos = _codigos(df[col_cod])
+                for cod, linhas in _por_valor(codigos).items():
+                    linhas_por_codigo[(tipo, int(cod))].append(linhas)
+                # Viagens por (nome, código), para ordenar e identificar as sugestões
+                pares_validos = pd.DataFrame({"nome": df[col_nome], "cod": codigos}).dropna()
+                for (nome, cod), n in pares_validos.groupby(["nome", "cod"], sort=False).size().items():
+                    if isinstance(nome, str):
+                        contagens[(nome, tipo, int(cod))] += int(n)
+
+        # Nomes do Cadastro -> códigos
+        codigos_por_nome: Dict[str, set] = defaultdict(set)
+        if df_cadastro is not None:
+            for col_nome, col_cod, tipo in (("Nome_M", "Codigo_M", "motorista"), ("Nome_J", "Codigo_J", "ajudante")):
+                if col_nome not in df_cadastro.columns or col_cod not in df_cadastro.columns:
+                    continue
+                cadastro = pd.DataFrame({"nome": df_cadastro[col_nome], "cod": _codigos(df_cadastro[col_cod])}).dropna()
+                for nome, cod in zip(cadastro["nome"].tolist(), cadastro["cod"].tolist()):
+                    nome = limpar_texto(str(nome)).strip()
+                    if nome and cod:
+                        codigos_por_nome[nome].add((tipo, int(cod)))
+
+        self.indice = _indice_para(sorted(set(linhas_por_nome) | set(codigos_por_nome)))
+        nomes = self.indice.nomes
+        self._linhas_por_nome = [linhas_por_nome.get(nome, []) for nome in nomes]
+        self._codigos_por_nome = [codigos_por_nome.get(nome, set()) for nome in nomes]
+        self._linhas_por_codigo = {chave: np.concatenate(partes) for chave, partes in linhas_por_codigo.items()}
+
+        # Sugestões: cada nome com o código mais frequente nas viagens (ou do Cadastro)
+        melhor: Dict[str, Tuple[str, int, int]] = {}
+        for (nome, tipo, cod), n in contagens.items():
+            if nome not in melhor or n > melhor[nome][2]:
+                melhor[nome] = (tipo, cod, n)
+        self._sugestao = []
+        for nome, codigos, linhas in zip(nomes, self._codigos_por_nome, self._linhas_por_nome):
+            if nome in melhor:
+                self._sugestao.append(melhor[nome])
+            elif codigos:
+                tipo, cod = min(codigos)
+                self._sugestao.append((tipo, cod, 0))
+            else:  # nome sem código nas viagens nem no Cadastro
+                self._sugestao.append((None, None, sum(len(l) for l in linhas)))
+
+    def linhas(self, termo: str) -> np.ndarray:
+        """
+        Linhas (posições, por ordem) em que o termo aparece num nome, ou de
+        um colaborador cujo nome no Cadastro contém o termo.
+        """
+        # Sem strip, como o str.contains antigo (o termo já vem sem espaços do formulário)
+        termo = limpar_texto(termo or "")
+        partes = []
+        for i in self.indice.procurar(termo):
+            partes.extend(self._linhas_por_nome[i])
+            for chave in self._codigos_por_nome[i]:
+                if chave in self._linhas_por_codigo:
+                    partes.append(self._linhas_por_codigo[chave])
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(partes))
+
+    def sugestoes(self, termo: str, limite: int = 10) -> List[Dict[str, object]]:
+        """
+        Nomes que contêm o termo: primeiro os que têm uma palavra a começar
+        pelo termo, depois os com mais viagens no armazém.
+        """
+        termo = limpar_texto(termo or "").strip()
+        if len(termo) < MIN_LETRAS_SUGESTAO:
+            return []
+        nomes = self.indice.nomes
+        ordenados = sorted(
+            self.indice.procurar(termo).tolist(),
+            key=lambda i: (not any(p.startswith(termo) for p in nomes[i].split()), -self._sugestao[i][2], nomes[i])
+        )
+        # Variantes do mesmo nome com espaços a mais aparecem uma só vez
+        resultado, vistos = [], set()
+        for i in ordenados:
+            nome = nomes[i].strip()
+            if nome in vistos:
+                continue
+            vistos.add(nome)
+            resultado.append({"nome": nome, "tipo": self._sugestao[i][0], "cod": self._sugestao[i][1], "viagens": self._sugestao[i][2]})
+            if len(resultado) == limite:
+                break
+        return resultado
+
+
+def pesquisa_nomes(armazem, df_cadastro: Optional[pd.DataFrame]) -> PesquisaNomes:
+    """
+    PesquisaNomes do armazém, calculada uma vez por armazém e cópia do
+    Cadastro em memória (guardada como uma vista do próprio armazém). O
+    Cadastro deve ser o DataFrame da cache, sem cópia
+    (get_cadastro_sincrono(..., copiar=False)): cada recarga cria um novo e
+    é pela identidade que a vista o reconhece, sem percorrer as colunas a
+    cada pedido.
+    """
+    return armazem.vista(
+        ("nomes", None if df_cadastro is None else id(df_cadastro)), None, None,
+        lambda: PesquisaNomes(armazem.df, df_cadastro)
+    )
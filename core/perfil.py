@@ -0,0 +1,203 @@
+import os
+import sys
+import hmac
+import html
+import time
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+
+# --- PROFILING A PEDIDO (só para administradores) ---
+# Um pedido com ?__profile=1 (ou cabeçalho X-Profile: 1) e o token certo em
+# X-Admin-Token (ou ?__token=) corre sob um profiler de amostragem e devolve a
+# árvore de chamadas em vez da página:
+#   ?__profile=1           -> HTML
+#   ?__profile=speedscope  -> JSON para abrir em https://www.speedscope.app
+# Sem ADMIN_TOKEN definido no ambiente, o profiling fica desligado.
+#
+# O amostrador lê as pilhas de TODAS as threads (sys._current_frames), por isso
+# apanha o trabalho feito no thread pool (get_dados_apurados, processar_*_sincrono,
+# render). Threads paradas à espera (pool sem trabalho, event loop no select)
+# são ignoradas. Com outros pedidos a decorrer ao mesmo tempo, o trabalho
+# deles também aparece: usar de preferência num worker com pouco tráfego.
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+INTERVALO_PERFIL = float(os.environ.get("PERFIL_INTERVALO_MS", 1)) / 1000
+
+# True durante um pedido com profiling (a cache de resultados é ignorada,
+# senão o perfil só mostraria um acerto na cache)
+perfil_ativo: ContextVar[bool] = ContextVar("perfil_ativo", default=False)
+
+# Funções onde uma thread está parada à espera (não interessa para o perfil)
+_FUNCOES_ESPERA = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("base_events.py", "_run_once"),
+    ("selector_events.py", "_write_to_self"),  # worker a acordar o event loop
+}
+
+Frame = Tuple[str, str, int]  # (função, ficheiro, linha de início)
+
+
+def perfil_pedido(request: Request) -> Optional[str]:
+    """
+    Retorna o formato pedido ('html' ou 'speedscope') se o pedido pedir
+    profiling e trouxer o token de administrador certo; caso contrário None
+    (e o pedido segue normalmente).
+    """
+    valor = request.query_params.get("__profile") or request.headers.get("x-profile")
+    if not valor or not ADMIN_TOKEN:
+        return None
+    token = request.headers.get("x-admin-token") or request.query_params.get("__token") or ""
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return None
+    return "speedscope" if valor == "speedscope" else "html"
+
+
+class AmostradorPilhas:
+    def __init__(self, intervalo: float = INTERVALO_PERFIL):
+        self.intervalo = intervalo
+        # (nome da thread, pilha da raiz para a folha) -> nº de amostras
+        self.amostras: Counter = Counter()
+        self.inicio = 0.0
+        self.duracao = 0.0
+        self.ciclos = 0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name="perfil-amostrador", daemon=True)
+
+    def iniciar(self):
+        self.inicio = time.perf_counter()
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+        self.duracao = time.perf_counter() - self.inicio
+
+    def _executar(self):
+        proprio = threading.get_ident()
+        while not self._parar.wait(self.intervalo):
+            self.ciclos += 1
+            nomes = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == proprio:
+                    continue
+                pilha = []
+                while frame is not None:
+                    codigo = frame.f_code
+                    pilha.append((codigo.co_name, codigo.co_filename, codigo.co_firstlineno))
+                    frame = frame.f_back
+                if not pilha or (os.path.basename(pilha[0][1]), pilha[0][0]) in _FUNCOES_ESPERA:
+                    continue
+                pilha.reverse()
+                self.amostras[(nomes.get(ident, str(ident)), tuple(pilha))] += 1
+
+    @property
+    def ms_por_amostra(self) -> float:
+        # Intervalo efetivo entre amostras (maior que o pedido: o próprio
+        # amostrador gasta tempo e disputa o GIL)
+        return self.duracao / max(1, self.ciclos) * 1000
+
+    # --- Exportação ---
+    def para_speedscope(self, nome: str) -> Dict:
+        frames: List[Dict] = []
+        indices: Dict[Frame, int] = {}
+        por_thread: Dict[str, Tuple[List, List]] = {}
+        ms = self.ms_por_amostra
+        for (thread, pilha), contagem in self.amostras.items():
+            ids = []
+            for f in pilha:
+                if f not in indices:
+                    indices[f] = len(frames)
+                    frames.append({"name": f[0], "file": f[1], "line": f[2]})
+                ids.append(indices[f])
+            samples, weights = por_thread.setdefault(thread, ([], []))
+            samples.append(ids)
+            weights.append(contagem * ms)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": nome,
+            "exporter": "perfil-amostrador",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+                for thread, (samples, weights) in por_thread.items()
+            ],
+        }
+
+    def para_html(self, nome: str, percentagem_minima: float = 0.5) -> str:
+        # Árvore: nó = {"n": amostras, "filhos": {frame: nó}}
+        raiz: Dict = {"n": 0, "filhos": {}}
+        for (thread, pilha), contagem in self.amostras.items():
+            no = raiz
+            no["n"] += contagem
+            for f in (("thread: " + thread, "", 0),) + pilha:
+                no = no["filhos"].setdefault(f, {"n": 0, "filhos": {}})
+                no["n"] += contagem
+
+        total = raiz["n"] or 1
+        ms = self.ms_por_amostra
+        partes = []
+
+        def _escrever(no: Dict):
+            for f, filho in sorted(no["filhos"].items(), key=lambda item: -item[1]["n"]):
+                perc = 100 * filho["n"] / total
+                if perc < percentagem_minima:
+                    continue
+                local = f" <small>{html.escape(f[1])}:{f[2]}</small>" if f[1] else ""
+                partes.append(
+                    f"<details open><summary>{perc:5.1f}% &middot; {filho['n'] * ms:.0f} ms "
+                    f"&middot; <b>{html.escape(f[0])}</b>{local}</summary>"
+                )
+                _escrever(filho)
+                partes.append("</details>")
+
+        _escrever(raiz)
+        return (
+            "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+            f"<title>Perfil {html.escape(nome)}</title>"
+            "<style>body{font-family:monospace;font-size:13px}"
+            "details{margin-left:1.2em}small{color:#888}</style></head><body>"
+            f"<h3>{html.escape(nome)}</h3>"
+            f"<p>Duração: {self.duracao * 1000:.0f} ms &middot; {total} amostras "
+            f"&middot; {ms:.2f} ms/amostra (frames abaixo de {percentagem_minima}% omitidos)</p>"
+            + "".join(partes)
+            + "</body></html>"
+        )
+
+
+async def executar_com_perfil(request: Request, call_next, formato: str) -> Response:
+    """
+    Corre o pedido inteiro sob o amostrador (incluindo o render em streaming,
+    que é consumido aqui) e devolve o perfil em vez da página.
+    """
+    nome = f"{request.method} {request.url.path}?{request.url.query}"
+    amostrador = AmostradorPilhas()
+    token = perfil_ativo.set(True)
+    amostrador.iniciar()
+    try:
+        response = await call_next(request)
+        async for _ in response.body_iterator:
+            pass
+    finally:
+        amostrador.parar()
+        perfil_ativo.reset(token)
+
+    cabecalhos = {"Cache-Control": "no-store"}
+    if formato == "speedscope":
+        return JSONResponse(amostrador.para_speedscope(nome), headers={
+            **cabecalhos, "Content-Disposition": "attachment; filename=perfil.speedscope.json"
+        })
+    return HTMLResponse(amostrador.para_html(nome), headers=cabecalhos)
@@ -0,0 +1,59 @@
+import os
+import datetime
+from typing import List, Optional, Tuple
+
+# Dias depois do fim de um intervalo até ele contar como fechado (os
+# indicadores e as caixas de um período ainda chegam nos dias seguintes)
+DIAS_FECHO = int(os.environ.get("PERIODO_DIAS_FECHO", 10))
+
+
+def resolver_datas_filtro(data_inicio: Optional[str], data_fim: Optional[str]) -> Tuple[str, str]:
+    """
+    Aplica os valores por defeito do filtro de datas (início do mês até hoje).
+    """
+    hoje = datetime.date.today()
+    return data_inicio or hoje.replace(day=1).isoformat(), data_fim or hoje.isoformat()
+
+
+def calcular_periodo_pagamento(data_inicio_str: str) -> Tuple[str, str]:
+    """
+    Período de pagamento (dia 26 a dia 25) que contém a data dada.
+    Lança ValueError se a data for inválida.
+    """
+    user_date_obj = datetime.date.fromisoformat(data_inicio_str)
+    dia_corte = 26
+    if user_date_obj.day < dia_corte:
+        data_fim_periodo = user_date_obj.replace(day=25)
+        data_inicio_periodo = (user_date_obj.replace(day=1) - datetime.timedelta(days=1)).replace(day=dia_corte)
+    else:
+        data_inicio_periodo = user_date_obj.replace(day=dia_corte)
+        data_fim_periodo = (data_inicio_periodo + datetime.timedelta(days=32)).replace(day=25)
+    return data_inicio_periodo.isoformat(), data_fim_periodo.isoformat()
+
+
+def periodos_pagamento(data_referencia_str: str, quantidade: int) -> List[Tuple[str, str]]:
+    """
+    Os 'quantidade' períodos de pagamento até ao que contém a data dada
+    (inclusive), do mais antigo para o mais recente.
+    Lança ValueError se a data for inválida.
+    """
+    periodos = []
+    data_str = data_referencia_str
+    for _ in range(quantidade):
+        data_inicio_periodo, data_fim_periodo = calcular_periodo_pagamento(data_str)
+        periodos.append((data_inicio_periodo, data_fim_periodo))
+        data_str = (datetime.date.fromisoformat(data_inicio_periodo) - datetime.timedelta(days=1)).isoformat()
+    return periodos[::-1]
+
+
+def periodo_fechado(data_fim_str: str) -> bool:
+    """
+    True se o intervalo que acaba na data dada já fechou (passaram mais de
+    PERIODO_DIAS_FECHO dias): os seus resultados já não mudam e podem ficar
+    em cache sem prazo. Datas inválidas contam como abertas.
+    """
+    try:
+        data_fim = datetime.date.fromisoformat(data_fim_str)
+    except (TypeError, ValueError):
+        return False
+    return (datetime.date.today() - data_fim).days > DIAS_FECHO
@@ -0,0 +1,110 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+import pandas as pd
+from fastapi.concurrency import run_in_threadpool
+
+from .metricas import span
+from .cache_partilhada import tabela_para_pandas
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow é opcional; sem ele os DataFrames seguem em pickle
+    pa = None
+
+# --- POOL DE PROCESSOS PARA O CÁLCULO PESADO ---
+# As funções processar_*_sincrono são loops pandas/Python presos ao GIL: dois
+# meses grandes no mesmo worker correm em série e atrasam as threads de I/O.
+# Com COMPUTE_PROCESSOS > 0, os cálculos com muitas linhas correm num pool de
+# processos; os pequenos continuam no thread pool (não compensa a passagem).
+#   COMPUTE_PROCESSOS=2            nº de processos por worker (0 = desligado)
+#   COMPUTE_LIMIAR_LINHAS=20000    a partir de quantas linhas (soma dos DataFrames)
+# Os DataFrames passam para o processo em Arrow IPC (colunas em bloco, sem
+# serializar objeto a objeto como o pickle); sem pyarrow, vão em pickle.
+
+COMPUTE_PROCESSOS = int(os.environ.get("COMPUTE_PROCESSOS", 0))
+COMPUTE_LIMIAR_LINHAS = int(os.environ.get("COMPUTE_LIMIAR_LINHAS", 20_000))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Argumento codificado: ("arrow", bytes) | ("valor", objeto)
+ArgCodificado = Tuple[str, Any]
+
+
+def _obter_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # 'spawn': o worker tem threads (event loop, pool HTTP) e o fork copiaria locks em uso
+        contexto = multiprocessing.get_context("spawn")
+        _pool = ProcessPoolExecutor(max_workers=COMPUTE_PROCESSOS, mp_context=contexto)
+    return _pool
+
+
+def aquecer_pool():
+    """Arranca os processos (imports do pandas/routers) antes do primeiro pedido."""
+    if COMPUTE_PROCESSOS > 0:
+        pool = _obter_pool()
+        for _ in range(COMPUTE_PROCESSOS):
+            pool.submit(_importar_modulos)
+
+
+def encerrar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _importar_modulos():
+    import routers.xadrez, routers.incentivo, routers.caixas, routers.pagamento  # noqa: F401
+
+
+def _codificar(valor: Any) -> ArgCodificado:
+    if pa is not None and isinstance(valor, pd.DataFrame):
+        try:
+            tabela = pa.Table.from_pandas(valor, preserve_index=True)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, tabela.schema) as escritor:
+                escritor.write_table(tabela)
+            return "arrow", sink.getvalue().to_pybytes()
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            # Ex: coluna com tipos misturados; segue em pickle
+            print(f"DataFrame não convertível para Arrow ({e}); a usar pickle")
+    return "valor", valor
+
+
+def _descodificar(arg: ArgCodificado) -> Any:
+    tipo, valor = arg
+    if tipo == "arrow":
+        # Colunas object com inteiros e None (ex: Codigo_M do Cadastro) não passam a float64
+        return tabela_para_pandas(pa.ipc.open_stream(valor).read_all())
+    return valor
+
+
+def _executar_no_processo(funcao: Callable, args: List[ArgCodificado]) -> Any:
+    return funcao(*(_descodificar(a) for a in args))
+
+
+def _linhas(args) -> int:
+    return sum(len(a) for a in args if isinstance(a, pd.DataFrame))
+
+
+async def executar_calculo(funcao: Callable, *args) -> Any:
+    """
+    Corre funcao(*args) no pool de processos se estiver ativo e as entradas
+    tiverem pelo menos COMPUTE_LIMIAR_LINHAS linhas; senão no thread pool.
+    A função tem de estar definida ao nível do módulo (é enviada por nome).
+    """
+    if COMPUTE_PROCESSOS <= 0 or _linhas(args) < COMPUTE_LIMIAR_LINHAS:
+        return await run_in_threadpool(funcao, *args)
+
+    with span("ipc_serializar") as s:
+        s.linhas = _linhas(args)
+        codificados = await run_in_threadpool(lambda: [_codificar(a) for a in args])
+        s.bytes = sum(len(v) for t, v in codificados if t == "arrow")
+
+    with span("pool_processos"):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_obter_pool(), _executar_no_processo, funcao, codificados)
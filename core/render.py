@@ -0,0 +1,63 @@
+import time
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from typing import Dict, Any, Iterator
+
+from .metricas import registar_etapa
+
+# Ambiente Jinja partilhado por todos os routers (compila cada template uma só vez)
+templates = Jinja2Templates(directory="templates")
+
+# Tamanho mínimo (em bytes) de cada bloco enviado ao browser.
+# Blocos pequenos = cabeçalho chega mais cedo; blocos grandes = menos overhead.
+TAMANHO_BLOCO = 8 * 1024
+
+
+def _gerar_blocos(template, contexto: Dict[str, Any]) -> Iterator[bytes]:
+    """
+    Consome o template.generate() do Jinja e agrupa os pedaços em blocos
+    de ~TAMANHO_BLOCO, para que o cabeçalho e os filtros sejam enviados
+    antes de as tabelas grandes terminarem de ser renderizadas.
+    """
+    buffer = []
+    tamanho = 0
+    # Conta só o tempo passado a renderizar, não o tempo à espera do browser
+    duracao = 0.0
+    inicio = time.perf_counter()
+    for parte in template.generate(contexto):
+        buffer.append(parte)
+        tamanho += len(parte)
+        if tamanho >= TAMANHO_BLOCO:
+            bloco = "".join(buffer).encode("utf-8")
+            duracao += time.perf_counter() - inicio
+            yield bloco
+            inicio = time.perf_counter()
+            buffer = []
+            tamanho = 0
+    bloco = "".join(buffer).encode("utf-8")
+    registar_etapa("render", duracao + time.perf_counter() - inicio)
+    if bloco:
+        yield bloco
+
+
+def render_pagina(
+    request: Request,
+    contexto: Dict[str, Any],
+    nome_template: str = "index.html",
+    status_code: int = 200,
+    headers: Dict[str, str] = None
+) -> StreamingResponse:
+    """
+    Renderiza a página em streaming. O index.html só inclui o template da
+    aba ativa (templates/abas/<main_tab>.html), por isso as outras abas
+    nem chegam a ser compiladas.
+    """
+    template = templates.get_template(nome_template)
+    contexto = {"request": request, **contexto}
+    return StreamingResponse(
+        _gerar_blocos(template, contexto),
+        status_code=status_code,
+        media_type="text/html; charset=utf-8",
+        headers=headers
+    )
@@ -0,0 +1,180 @@
+import os
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Callable, List, Optional, TypeVar
+import httpx
+from postgrest.exceptions import APIError
+
+from .metricas import registar_gauges
+from .saida import SupabaseOcupado, porta_supabase, LIMITE_GLOBAL, FILA_MAXIMA
+
+# --- REPETIÇÕES E CÓPIAS (hedging) DAS LEITURAS PAGINADAS ---
+# Uma página lenta atrasa o pedido inteiro e um erro transitório dava logo
+# "Erro ao conectar". Para leituras idempotentes (GET de uma página):
+#  - erro transitório (rede, 5xx, 429, statement timeout) -> nova tentativa
+#    com espera aleatória (backoff exponencial com jitter);
+#  - página mais lenta que o p95 observado -> envia uma cópia do pedido e
+#    fica com a primeira resposta.
+# As cópias são limitadas a uma fração das chamadas e só saem se a porta do
+# Supabase (core/saida.py) não tiver chamadas à espera, para não gerar mais
+# tráfego precisamente quando o Supabase está lento.
+#   SUPABASE_TENTATIVAS=3          tentativas por página
+#   SUPABASE_BACKOFF_MS=200        base do backoff (200, 400, 800 ms, com jitter)
+#   SUPABASE_COPIAS=1              0 desliga as cópias
+#   SUPABASE_COPIAS_FRACAO=0.1     máximo de cópias por chamada
+#   SUPABASE_COPIAS_AMOSTRAS=20    latências observadas antes de usar o p95
+
+TENTATIVAS = int(os.environ.get("SUPABASE_TENTATIVAS", 3))
+BACKOFF_BASE = float(os.environ.get("SUPABASE_BACKOFF_MS", 200)) / 1000
+COPIAS_ATIVAS = os.environ.get("SUPABASE_COPIAS", "1") == "1"
+COPIAS_FRACAO = float(os.environ.get("SUPABASE_COPIAS_FRACAO", 0.1))
+COPIAS_AMOSTRAS = int(os.environ.get("SUPABASE_COPIAS_AMOSTRAS", 20))
+
+# Códigos HTTP / PostgreSQL que valem nova tentativa (57014 = statement timeout)
+CODIGOS_TRANSITORIOS = {"429", "500", "502", "503", "504", "520", "57014"}
+
+T = TypeVar("T")
+
+# As chamadas correm neste pool para se poder esperar com prazo pela
+# primeira; as threads ficam quase sempre bloqueadas em I/O ou na porta.
+_executor = ThreadPoolExecutor(max_workers=LIMITE_GLOBAL + FILA_MAXIMA, thread_name_prefix="supabase_pagina")
+
+
+class Latencias:
+    """Janela deslizante das últimas durações (segundos) de uma operação."""
+
+    def __init__(self, tamanho: int = 200):
+        self._valores = deque(maxlen=tamanho)
+        self._lock = threading.Lock()
+
+    def registar(self, duracao: float):
+        with self._lock:
+            self._valores.append(duracao)
+
+    def percentil(self, p: float) -> Optional[float]:
+        with self._lock:
+            if len(self._valores) < COPIAS_AMOSTRAS:
+                return None
+            ordenados = sorted(self._valores)
+        return ordenados[min(int(p * len(ordenados)), len(ordenados) - 1)]
+
+
+class _Contadores:
+    def __init__(self):
+        self.chamadas = 0
+        self.copias = 0
+        self.copias_vencedoras = 0
+        self.repeticoes = 0
+        self.lock = threading.Lock()
+
+    def permite_copia(self) -> bool:
+        with self.lock:
+            if self.copias + 1 > COPIAS_FRACAO * self.chamadas:
+                return False
+            self.copias += 1
+            return True
+
+
+_latencias = {}
+_contadores = _Contadores()
+
+
+def _latencias_de(nome: str) -> Latencias:
+    if nome not in _latencias:
+        _latencias.setdefault(nome, Latencias())
+    return _latencias[nome]
+
+
+def _transitorio(e: Exception) -> bool:
+    if isinstance(e, SupabaseOcupado):
+        return False  # já esperou o prazo; repetir só alongava a fila
+    if isinstance(e, httpx.TransportError):
+        return True
+    if isinstance(e, APIError):
+        return str(e.code) in CODIGOS_TRANSITORIOS
+    return False
+
+
+def _submeter(funcao: Callable[[], T], latencias: Latencias) -> Future:
+    def medir():
+        inicio = time.perf_counter()
+        resultado = funcao()
+        latencias.registar(time.perf_counter() - inicio)
+        return resultado
+
+    # Cada thread leva uma cópia do contexto (spans do pedido, span aberto)
+    return _executor.submit(contextvars.copy_context().run, medir)
+
+
+def _com_copia(funcao: Callable[[], T], nome: str) -> T:
+    latencias = _latencias_de(nome)
+    with _contadores.lock:
+        _contadores.chamadas += 1
+
+    limiar = latencias.percentil(0.95) if COPIAS_ATIVAS else None
+    original = _submeter(funcao, latencias)
+    if limiar is None:
+        return original.result()
+
+    feitos, _ = wait([original], timeout=limiar)
+    if feitos or porta_supabase.em_espera > 0 or not _contadores.permite_copia():
+        return original.result()
+
+    copia = _submeter(funcao, latencias)
+    pendentes = {original, copia}
+    while pendentes:
+        feitos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+        for f in feitos:
+            if f.exception() is None:
+                if f is copia:
+                    with _contadores.lock:
+                        _contadores.copias_vencedoras += 1
+                # A chamada perdedora não pode ser interrompida a meio (cliente
+                # síncrono): se ainda não arrancou é cancelada, senão o
+                # resultado é descartado.
+                for p in pendentes:
+                    p.cancel()
+                return f.result()
+    # Falharam as duas: propaga o erro da original
+    return original.result()
+
+
+def ler_com_repeticao(funcao: Callable[[], T], nome: str) -> T:
+    """
+    Executa uma leitura idempotente (ex: query.execute de uma página) com
+    repetição dos erros transitórios e cópia do pedido quando passa do p95.
+    """
+    for tentativa in range(TENTATIVAS):
+        try:
+            return _com_copia(funcao, nome)
+        except Exception as e:
+            if tentativa == TENTATIVAS - 1 or not _transitorio(e):
+                raise
+            espera = random.uniform(0, BACKOFF_BASE * 2 ** tentativa)
+            with _contadores.lock:
+                _contadores.repeticoes += 1
+            print(f"Erro transitório em '{nome}' ({e}); nova tentativa em {espera * 1000:.0f} ms")
+            time.sleep(espera)
+
+
+def _gauges() -> List[tuple]:
+    with _contadores.lock:
+        valores = (_contadores.chamadas, _contadores.copias, _contadores.copias_vencedoras, _contadores.repeticoes)
+    gauges = [
+        ("supabase_leituras", "Leituras paginadas feitas (acumulado)", valores[0], {}),
+        ("supabase_copias_enviadas", "Cópias de pedidos lentos enviadas (acumulado)", valores[1], {}),
+        ("supabase_copias_vencedoras", "Cópias que responderam antes da original (acumulado)", valores[2], {}),
+        ("supabase_repeticoes", "Novas tentativas após erro transitório (acumulado)", valores[3], {}),
+    ]
+    for nome in sorted(_latencias):
+        p95 = _latencias[nome].percentil(0.95)
+        if p95 is not None:
+            gauges.append(("supabase_limiar_copia_segundos", "p95 observado a partir do qual se envia uma cópia", round(p95, 4), {"etapa": nome}))
+    return gauges
+
+
+registar_gauges(_gauges)
@@ -0,0 +1,201 @@
+import os
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+import httpx
+
+from .metricas import registar_etapa, registar_gauges
+
+# --- PORTA DE SAÍDA PARA O SUPABASE ---
+# Cada pedido abre várias chamadas ao PostgREST (páginas da Distribuição,
+# Cadastro, Indicadores, Caixas, Metas, contagens do ETag). Com muitos
+# utilizadores em simultâneo isto inunda o Supabase e tudo fica mais lento.
+# Todas as chamadas passam por um único cliente HTTP (HTTP/2, ligações
+# keep-alive partilhadas) cujo transporte limita a concorrência:
+#   SUPABASE_LIMITE_GLOBAL=8        chamadas em curso por worker
+#   SUPABASE_LIMITE_TABELA=4        chamadas em curso por tabela
+#   SUPABASE_ESPERA_MAXIMA_MS=2000  espera máxima por uma vaga
+#   SUPABASE_FILA_MAXIMA=32         chamadas à espera a partir das quais se recusa logo
+#   SUPABASE_TIMEOUT_S=120          timeout de cada chamada (como o do postgrest-py)
+# Quando não há vaga a tempo, a chamada levanta SupabaseOcupado e a app
+# responde 503 "ocupado" (ver main.py) em vez de prender threads do pool.
+
+LIMITE_GLOBAL = int(os.environ.get("SUPABASE_LIMITE_GLOBAL", 8))
+LIMITE_TABELA = int(os.environ.get("SUPABASE_LIMITE_TABELA", 4))
+ESPERA_MAXIMA = float(os.environ.get("SUPABASE_ESPERA_MAXIMA_MS", 2000)) / 1000
+FILA_MAXIMA = int(os.environ.get("SUPABASE_FILA_MAXIMA", 32))
+TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT_S", 120))
+KEEPALIVE = float(os.environ.get("SUPABASE_KEEPALIVE_S", 60))
+
+PREFIXO_REST = "/rest/v1/"
+
+
+class SupabaseOcupado(Exception):
+    """Não houve vaga para a chamada ao Supabase dentro do prazo."""
+
+    def __init__(self, tabela: str, espera: float):
+        super().__init__(f"Supabase ocupado: sem vaga para '{tabela}' após {espera * 1000:.0f} ms")
+        self.tabela = tabela
+        self.espera = espera
+
+
+class PortaSaida:
+    """
+    Semáforo global + um semáforo por tabela, com prazo de espera.
+    Usado a partir das threads do pool (as chamadas ao Supabase são síncronas).
+    """
+
+    def __init__(self, limite_global: int, limite_tabela: int, espera_maxima: float, fila_maxima: int):
+        self.limite_global = limite_global
+        self.limite_tabela = limite_tabela
+        self.espera_maxima = espera_maxima
+        self.fila_maxima = fila_maxima
+        self._global = threading.BoundedSemaphore(limite_global)
+        self._tabelas: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.em_espera = 0
+        self.rejeitadas = 0
+        self.em_curso: Dict[str, int] = {}
+
+    def _semaforo(self, tabela: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaforo = self._tabelas.get(tabela)
+            if semaforo is None:
+                semaforo = self._tabelas[tabela] = threading.BoundedSemaphore(self.limite_tabela)
+            return semaforo
+
+    def _recusar(self, tabela: str, espera: float):
+        with self._lock:
+            self.rejeitadas += 1
+        registar_etapa("fila_supabase", espera)
+        raise SupabaseOcupado(tabela, espera)
+
+    def entrar(self, tabela: str) -> Callable[[], None]:
+        """
+        Espera por uma vaga na tabela e no limite global (por esta ordem,
+        sempre a mesma, para não haver bloqueios cruzados). Devolve a função
+        que liberta a vaga (pode ser chamada mais de uma vez).
+        """
+        with self._lock:
+            fila_cheia = self.em_espera >= self.fila_maxima
+            if not fila_cheia:
+                self.em_espera += 1
+        if fila_cheia:
+            self._recusar(tabela, 0.0)
+
+        semaforo = self._semaforo(tabela)
+        inicio = time.perf_counter()
+        try:
+            if not semaforo.acquire(timeout=self.espera_maxima):
+                self._recusar(tabela, time.perf_counter() - inicio)
+            restante = self.espera_maxima - (time.perf_counter() - inicio)
+            if not self._global.acquire(timeout=max(restante, 0)):
+                semaforo.release()
+                self._recusar(tabela, time.perf_counter() - inicio)
+        finally:
+            with self._lock:
+                self.em_espera -= 1
+
+        registar_etapa("fila_supabase", time.perf_counter() - inicio)
+        with self._lock:
+            self.em_curso[tabela] = self.em_curso.get(tabela, 0) + 1
+
+        libertada = False
+
+        def libertar():
+            nonlocal libertada
+            with self._lock:
+                if libertada:
+                    return
+                libertada = True
+                self.em_curso[tabela] -= 1
+            self._global.release()
+            semaforo.release()
+
+        return libertar
+
+    def gauges(self) -> List[tuple]:
+        with self._lock:
+            em_curso = dict(self.em_curso)
+            em_espera, rejeitadas = self.em_espera, self.rejeitadas
+        gauges = [
+            ("supabase_chamadas_em_espera", "Chamadas ao Supabase à espera de vaga", em_espera, {}),
+            ("supabase_chamadas_rejeitadas", "Chamadas recusadas por falta de vaga (acumulado)", rejeitadas, {}),
+            ("supabase_limite_global", "Máximo de chamadas em curso por worker", self.limite_global, {}),
+        ]
+        for tabela in sorted(em_curso):
+            gauges.append(("supabase_chamadas_em_curso", "Chamadas ao Supabase em curso", em_curso[tabela], {"tabela": tabela}))
+        return gauges
+
+
+def _tabela_do_pedido(request: httpx.Request) -> Optional[str]:
+    caminho = request.url.path
+    if PREFIXO_REST not in caminho:
+        return None  # auth, storage, etc. não passam pela porta
+    return caminho.split(PREFIXO_REST, 1)[1] or None
+
+
+class _CorpoComVaga(httpx.SyncByteStream):
+    """Corpo da resposta que liberta a vaga quando o httpx o fecha (já lido)."""
+
+    def __init__(self, corpo: httpx.SyncByteStream, libertar: Callable[[], None]):
+        self._corpo = corpo
+        self._libertar = libertar
+
+    def __iter__(self):
+        yield from self._corpo
+
+    def close(self):
+        try:
+            self._corpo.close()
+        finally:
+            self._libertar()
+
+
+class TransporteLimitado(httpx.BaseTransport):
+    def __init__(self, porta: PortaSaida, transporte: httpx.BaseTransport):
+        self._porta = porta
+        self._transporte = transporte
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tabela = _tabela_do_pedido(request)
+        if tabela is None:
+            return self._transporte.handle_request(request)
+
+        libertar = self._porta.entrar(tabela)
+        try:
+            resposta = self._transporte.handle_request(request)
+        except BaseException:
+            libertar()
+            raise
+        return httpx.Response(
+            status_code=resposta.status_code,
+            headers=resposta.headers,
+            stream=_CorpoComVaga(resposta.stream, libertar),
+            extensions=resposta.extensions,
+        )
+
+    def close(self):
+        self._transporte.close()
+
+
+porta_supabase = PortaSaida(LIMITE_GLOBAL, LIMITE_TABELA, ESPERA_MAXIMA, FILA_MAXIMA)
+registar_gauges(porta_supabase.gauges)
+
+
+def criar_cliente_http() -> httpx.Client:
+    """
+    Cliente HTTP partilhado por todas as chamadas ao Supabase do worker
+    (passado ao create_client em main.py).
+    """
+    limites = httpx.Limits(
+        max_connections=LIMITE_GLOBAL,
+        max_keepalive_connections=LIMITE_GLOBAL,
+        keepalive_expiry=KEEPALIVE,
+    )
+    transporte = httpx.HTTPTransport(http2=True, limits=limites)
+    return httpx.Client(
+        transport=TransporteLimitado(porta_supabase, transporte),
+        timeout=TIMEOUT,
+        follow_redirects=True,
+    )
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import pandas as pd
+
+from .metricas import Span, observar_spans, span
+
+# --- TAREFAS EM SEGUNDO PLANO (exportações) ---
+# Uma exportação grande segurava a ligação HTTP e uma thread durante toda a
+# leitura e escrita do Excel. Aqui a exportação é submetida como tarefa: a
+# rota responde logo com o id, o progresso (etapa, páginas lidas do
+# Supabase, linhas escritas) é enviado por Server-Sent Events e o ficheiro
+# fica guardado em disco algum tempo para ser descarregado.
+# O corpo de cada tarefa é uma função síncrona que corre num thread pool só
+# das exportações, com EXPORT_TRABALHADORES threads (as restantes tarefas
+# esperam na fila do pool): várias exportações pesadas não ocupam o thread
+# pool (AnyIO) das rotas interativas. Uma tarefa cancelada (ex: fim do
+# processo) fica no estado final "erro" e o ficheiro parcial é apagado; a
+# thread, que não pode ser interrompida, para no bloco seguinte do Excel.
+# O progresso vem dos spans (core/metricas.py): cada span terminado dentro
+# da tarefa atualiza-a. As tarefas são por processo: com vários workers, o
+# progresso e o ficheiro só existem no worker que recebeu a submissão.
+#   EXPORT_TRABALHADORES=1     tarefas a correr em simultâneo por processo
+#   EXPORT_FILA_MAXIMA=8       tarefas por terminar (a correr + em fila)
+#   EXPORT_TTL=900             segundos que um ficheiro terminado fica disponível
+#   EXPORT_DIR                 pasta dos ficheiros (por defeito, a temporária do sistema)
+
+TRABALHADORES = int(os.environ.get("EXPORT_TRABALHADORES", 1))
+FILA_MAXIMA = int(os.environ.get("EXPORT_FILA_MAXIMA", 8))
+TTL_FICHEIROS = float(os.environ.get("EXPORT_TTL", 900))
+PASTA_FICHEIROS = os.environ.get("EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "exportacoes")
+
+LINHAS_POR_BLOCO = 1000  # linhas escritas no Excel entre atualizações do progresso
+INTERVALO_KEEPALIVE = 15  # segundos sem eventos até enviar um comentário SSE
+
+ESTADOS_FINAIS = ("concluida", "erro")
+
+
+class FilaCheia(Exception):
+    """Já há EXPORT_FILA_MAXIMA tarefas por terminar."""
+
+
+class TarefaCancelada(Exception):
+    """A tarefa foi cancelada enquanto a thread a executava."""
+
+
+class Tarefa:
+    def __init__(self, tipo: str, nome_ficheiro: str):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.nome_ficheiro = nome_ficheiro
+        self.estado = "em_fila"
+        self.etapa = "em_fila"
+        self.paginas = 0
+        self.linhas_lidas = 0
+        self.linhas_total = None
+        self.linhas_escritas = 0
+        self.bytes = None
+        self.erro = None
+        self.caminho = None
+        self.criada_em = time.time()
+        self.terminada_em = None
+        self.cancelada = False
+        self._versao = 0
+        self._loop = asyncio.get_running_loop()
+        self._ouvintes: List[asyncio.Event] = []
+        self._tarefa: Optional[asyncio.Task] = None
+
+    @property
+    def terminada(self) -> bool:
+        return self.estado in ESTADOS_FINAIS
+
+    def atualizar(self, **campos):
+        """Altera o estado e acorda os ouvintes SSE. Pode ser chamada de qualquer thread."""
+        for nome, valor in campos.items():
+            setattr(self, nome, valor)
+        self._versao += 1
+        for evento in list(self._ouvintes):
+            self._loop.call_soon_threadsafe(evento.set)
+
+    def verificar_cancelamento(self):
+        """Chamada pela thread da tarefa entre etapas: para se foi cancelada."""
+        if self.cancelada:
+            raise TarefaCancelada(f"Tarefa {self.id} cancelada")
+
+    def _observar(self, s: Span):
+        if s.nome == "supabase_distribuicao":
+            self.atualizar(paginas=self.paginas + 1, linhas_lidas=self.linhas_lidas + (s.linhas or 0))
+
+    def resumo(self) -> Dict[str, object]:
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "etapa": self.etapa,
+            "paginas": self.paginas,
+            "linhas_lidas": self.linhas_lidas,
+            "linhas_total": self.linhas_total,
+            "linhas_escritas": self.linhas_escritas,
+            "bytes": self.bytes,
+            "erro": self.erro,
+            "expira_em": self.terminada_em + TTL_FICHEIROS if self.terminada_em else None,
+        }
+
+    async def eventos(self):
+        """
+        Gerador SSE: um evento 'progresso' a cada alteração e um evento
+        'fim' com o estado final.
+        """
+        evento = asyncio.Event()
+        self._ouvintes.append(evento)
+        try:
+            vista = -1
+            while True:
+                evento.clear()
+                if self._versao != vista:
+                    vista = self._versao
+                    nome = "fim" if self.terminada else "progresso"
+                    yield f"event: {nome}\ndata: {json.dumps(self.resumo())}\n\n"
+                    if self.terminada:
+                        return
+                try:
+                    await asyncio.wait_for(evento.wait(), INTERVALO_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self._ouvintes.remove(evento)
+
+
+# --- REGISTO DE TAREFAS (por processo) ---
+_tarefas: Dict[str, Tarefa] = {}
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _obter_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, TRABALHADORES), thread_name_prefix="exportacao")
+    return _executor
+
+
+def _apagar(caminho: str):
+    try:
+        os.remove(caminho)
+    except OSError:
+        pass
+
+
+def _limpar_expiradas():
+    agora = time.time()
+    for id_tarefa, tarefa in list(_tarefas.items()):
+        if tarefa.terminada and agora - tarefa.terminada_em > TTL_FICHEIROS:
+            _tarefas.pop(id_tarefa, None)
+            if tarefa.caminho:
+                _apagar(tarefa.caminho)
+
+
+def obter_tarefa(id_tarefa: str) -> Optional[Tarefa]:
+    _limpar_expiradas()
+    return _tarefas.get(id_tarefa)
+
+
+def _executar_na_thread(tarefa: Tarefa, executar: Callable[[Tarefa, str], None], temporario: str):
+    tarefa.verificar_cancelamento()  # cancelada enquanto esperava na fila
+    tarefa.atualizar(estado="a_correr", etapa="a_iniciar")
+    try:
+        with span(f"tarefa_{tarefa.tipo}"):
+            executar(tarefa, temporario)
+    except BaseException:
+        _apagar(temporario)  # o ExcelWriter grava o ficheiro ao sair, mesmo com erro
+        raise
+
+
+async def _correr(tarefa: Tarefa, executar: Callable[[Tarefa, str], None]):
+    observar_spans(tarefa._observar)
+    os.makedirs(PASTA_FICHEIROS, exist_ok=True)
+    caminho = os.path.join(PASTA_FICHEIROS, f"{tarefa.id}_{tarefa.nome_ficheiro}")
+    temporario = os.path.join(PASTA_FICHEIROS, f"{tarefa.id}_parcial_{tarefa.nome_ficheiro}")  # mesma extensão
+    try:
+        # O contexto copiado leva o observador: os spans da thread atualizam a tarefa
+        await asyncio.get_running_loop().run_in_executor(
+            _obter_executor(), contextvars.copy_context().run, _executar_na_thread, tarefa, executar, temporario
+        )
+        os.replace(temporario, caminho)
+        tarefa.atualizar(
+            estado="concluida", etapa="concluida", caminho=caminho,
+            bytes=os.path.getsize(caminho), terminada_em=time.time()
+        )
+    except asyncio.CancelledError:
+        tarefa.cancelada = True
+        _apagar(temporario)
+        tarefa.atualizar(estado="erro", etapa="cancelada", erro="Tarefa cancelada", terminada_em=time.time())
+        raise
+    except Exception as e:
+        print(f"Erro na tarefa {tarefa.tipo} {tarefa.id}: {e}")
+        _apagar(temporario)
+        tarefa.atualizar(estado="erro", etapa="erro", erro=str(e), terminada_em=time.time())
+
+
+def submeter(tipo: str, nome_ficheiro: str, executar: Callable[[Tarefa, str], None]) -> Tarefa:
+    """
+    Cria a tarefa e põe-na na fila. executar(tarefa, caminho) é síncrona
+    (corre no thread pool das exportações): escreve o ficheiro em caminho e
+    vai chamando tarefa.atualizar(etapa=...).
+    Levanta FilaCheia se já houver EXPORT_FILA_MAXIMA tarefas por terminar.
+    """
+    _limpar_expiradas()
+    if sum(1 for t in _tarefas.values() if not t.terminada) >= FILA_MAXIMA:
+        raise FilaCheia(f"{FILA_MAXIMA} exportações em curso")
+    tarefa = Tarefa(tipo, nome_ficheiro)
+    _tarefas[tarefa.id] = tarefa
+    # Contexto vazio: os spans da tarefa não entram no Server-Timing do pedido que a criou
+    tarefa._tarefa = contextvars.Context().run(asyncio.create_task, _correr(tarefa, executar))
+    return tarefa
+
+
+async def encerrar_tarefas():
+    """Cancela as tarefas em curso e apaga os ficheiros (fim do processo)."""
+    global _executor
+    em_curso = []
+    for tarefa in list(_tarefas.values()):
+        if tarefa._tarefa is not None and not tarefa._tarefa.done():
+            tarefa._tarefa.cancel()
+            em_curso.append(tarefa._tarefa)
+        if tarefa.caminho:
+            _apagar(tarefa.caminho)
+    # Deixa cada tarefa chegar ao estado final (e apagar o ficheiro parcial)
+    await asyncio.gather(*em_curso, return_exceptions=True)
+    _tarefas.clear()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# --- ESCRITA DO EXCEL COM PROGRESSO ---
+def escrever_excel(caminho: str, folhas: List[Tuple[str, pd.DataFrame]], tarefa: Optional[Tarefa] = None):
+    """
+    Escreve as folhas em blocos de LINHAS_POR_BLOCO linhas (o mesmo ficheiro
+    que um to_excel por folha), atualizando tarefa.linhas_escritas.
+    """
+    escritas = 0
+    with span("exportar_excel") as s:
+        s.linhas = sum(len(df) for _, df in folhas)
+        with pd.ExcelWriter(caminho, engine="openpyxl") as writer:
+            for nome, df in folhas:
+                for inicio in range(0, max(len(df), 1), LINHAS_POR_BLOCO):
+                    bloco = df.iloc[inicio:inicio + LINHAS_POR_BLOCO]
+                    bloco.to_excel(
+                        writer, sheet_name=nome, index=False,
+                        header=inicio == 0, startrow=0 if inicio == 0 else inicio + 1
+                    )
+                    escritas += len(bloco)
+                    if tarefa is not None:
+                        tarefa.atualizar(linhas_escritas=escritas)
+                        tarefa.verificar_cancelamento()
@@ -0,0 +1,102 @@
+import datetime
+from supabase import Client
+from typing import Dict, List, Optional
+
+from .metricas import span
+from .cache_partilhada import avancar_geracao, ler_geracao
+from .saida import SupabaseOcupado
+
+# --- VERSÕES DOS DADOS (para ETag e chaves de cache) ---
+# Cada fonte de um relatório é o nome de uma tabela, ex: "Distribuição".
+# A versão de cada tabela vem da tabela versoes_dados, mantida por um trigger
+# no Postgres: qualquer INSERT/UPDATE/DELETE (da app ou de fora dela, ex: uma
+# correção feita no painel do Supabase) incrementa a linha da tabela. Todas as
+# versões leem-se num só pedido.
+# Migração:
+#   CREATE TABLE public.versoes_dados (
+#       tabela text PRIMARY KEY, versao bigint NOT NULL DEFAULT 0,
+#       alterado_em timestamptz NOT NULL DEFAULT now());
+#   INSERT INTO public.versoes_dados (tabela) VALUES
+#       ('Distribuição'), ('Cadastro'), ('Caixas'), ('Resultados_Indicadores'), ('Metas');
+#   CREATE FUNCTION public.marcar_versao_dados() RETURNS trigger LANGUAGE plpgsql AS $$
+#   BEGIN
+#       INSERT INTO public.versoes_dados (tabela, versao) VALUES (TG_TABLE_NAME, 1)
+#       ON CONFLICT (tabela) DO UPDATE SET versao = versoes_dados.versao + 1, alterado_em = now();
+#       RETURN NULL;
+#   END $$;
+#   -- uma vez por tabela da lista acima:
+#   CREATE TRIGGER versao_dados AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public."Caixas"
+#       FOR EACH STATEMENT EXECUTE FUNCTION public.marcar_versao_dados();
+#   GRANT SELECT ON public.versoes_dados TO service_role;
+# Sem a tabela versoes_dados não há versão (None): não se enviam ETags e
+# nenhum resultado fica em cache sem prazo.
+# A fonte HOJE junta a data de hoje à versão: para os relatórios que dependem
+# dela (antiguidade calculada a partir do Cadastro), um resultado guardado
+# num dia não serve no dia seguinte.
+TABELA_VERSOES = "versoes_dados"
+HOJE = "hoje"
+Fonte = str
+
+# Última versão de cada tabela lida por este processo (ver versao_vista)
+_vistas: Dict[str, int] = {}
+
+# Geração das alterações feitas pela própria app (ex: salvar metas, importar),
+# guardada no manifesto da cache partilhada: uma escrita feita num worker muda
+# a versão (e o ETag) em todos os workers do servidor, e workers com os mesmos
+# dados dão o mesmo ETag. Se o manifesto não estiver acessível, fica um
+# contador só deste processo.
+_geracao_local = 0
+
+def marcar_alteracao():
+    global _geracao_local
+    _geracao_local += 1
+    avancar_geracao()
+
+
+def _geracao() -> str:
+    geracao = ler_geracao()
+    return f"g{geracao}" if geracao is not None else f"l{_geracao_local}"
+
+
+def versoes_tabelas_sincrono(supabase: Client) -> Dict[str, int]:
+    """
+    {tabela: versão} de versoes_dados (um só pedido). Lança exceção se a
+    tabela não existir.
+    """
+    response = supabase.table(TABELA_VERSOES).select("tabela,versao").execute()
+    return {linha["tabela"]: int(linha["versao"]) for linha in response.data or []}
+
+
+def versao_vista(tabela: str) -> Optional[int]:
+    """
+    Última versão da tabela vista por este processo (None se nenhuma). As
+    cópias em memória de uma tabela (viagens, Cadastro, Metas) registam-na
+    quando são lidas e deixam de servir quando ela muda: um resultado
+    recalculado por a versão ter mudado não usa dados anteriores à alteração.
+    """
+    return _vistas.get(tabela)
+
+
+def versao_fontes_sincrono(supabase: Client, fontes: List[Fonte]) -> Optional[str]:
+    """
+    Versão das fontes de um relatório: a versão de cada tabela (trigger em
+    versoes_dados) + geração das alterações feitas pela app.
+    Retorna None se não for possível (nesse caso não se envia ETag); se o
+    Supabase estiver ocupado, deixa passar o SupabaseOcupado (resposta 503).
+    """
+    try:
+        with span("versao_dados"):
+            versoes = versoes_tabelas_sincrono(supabase)
+        _vistas.update(versoes)
+        partes = [_geracao()]
+        for fonte in fontes:
+            if fonte == HOJE:
+                partes.append(f"{HOJE}:{datetime.date.today().isoformat()}")
+            else:
+                partes.append(f"{fonte}:{versoes.get(fonte, 0)}")
+        return "|".join(partes)
+    except SupabaseOcupado:
+        raise
+    except Exception as e:
+        print(f"Erro ao calcular a versão dos dados: {e}")
+        return None
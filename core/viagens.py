@@ -0,0 +1,239 @@
+import os
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from supabase import Client
+
+from .analysis import _preparar_dataframe_ajudantes
+from .database import get_dados_apurados, NOME_DA_TABELA, NOME_COLUNA_DATA
+from .metricas import span
+from .versoes import versao_vista
+from .cache_partilhada import bloqueio, guardar_frame, ler_frame, listar_chaves, invalidar_partilhada
+
+# --- ARMAZÉM DE VIAGENS (uma estrutura por período, partilhada pelas rotas) ---
+# Xadrez, incentivo, caixas e pagamento buscavam cada um as viagens do mesmo
+# período e cada um fazia o seu drop_duplicates(subset=['MAPA']) e o seu
+# "melt" dos ajudantes. O ArmazemViagens guarda as viagens limpas de um
+# período uma vez, com índices:
+#   - MAPA -> código (pd.factorize), para a vista sem duplicados
+#   - DATA ordenada (argsort), para recortar um sub-período por pesquisa binária
+#   - COD e cada CODJ_n -> linhas (índices invertidos), para as vistas por colaborador
+# As vistas (todas as linhas, sem duplicados, ajudantes em formato longo) são
+# calculadas uma vez por sub-período e partilhadas: quem as recebe não as
+# pode alterar (as funções de cálculo criam sempre DataFrames novos).
+# Um armazém que cubra o período pedido serve também os sub-períodos (ex: o
+# mês inteiro serve a primeira quinzena), sem voltar ao Supabase.
+# Com CACHE_PARTILHADA=1, as viagens limpas de cada leitura ao Supabase ficam
+# também na cache partilhada (core/cache_partilhada.py): outro worker que
+# precise de um período coberto monta o armazém a partir do ficheiro mapeado,
+# sem voltar ao Supabase nem à limpeza do texto.
+# Cada armazém (e cada cópia partilhada) regista a versão da Distribuição
+# vista quando foi lido (core/versoes.py): depois de uma alteração já não
+# serve, mesmo que ainda não tenha expirado.
+#   CACHE_TTL_VIAGENS=60       segundos que um armazém fica em memória (e partilhado)
+#   CACHE_MAX_VIAGENS=8        armazéns em memória por processo
+
+TTL_VIAGENS = float(os.environ.get("CACHE_TTL_VIAGENS", 60))
+MAX_ARMAZENS = int(os.environ.get("CACHE_MAX_VIAGENS", 8))
+
+SEM_DADOS = "Nenhum dado encontrado para o período selecionado."
+_PREFIXO_PARTILHADO = "viagens|"  # chaves "viagens|data_inicio|data_fim" na cache partilhada
+
+
+def _indice_invertido(valores: np.ndarray) -> Dict[int, np.ndarray]:
+    """Valor -> linhas (por ordem) onde aparece; NaN é ignorado."""
+    linhas = np.flatnonzero(~np.isnan(valores))
+    if len(linhas) == 0:
+        return {}
+    chaves = valores[linhas].astype(np.int64)
+    ordem = np.argsort(chaves, kind="stable")
+    unicos, inicios = np.unique(chaves[ordem], return_index=True)
+    return dict(zip(unicos.tolist(), np.split(linhas[ordem], inicios[1:])))
+
+
+class ArmazemViagens:
+    """Viagens limpas de um período (saída de get_dados_apurados) com índices."""
+
+    def __init__(
+        self, df: pd.DataFrame, data_inicio: str, data_fim: str,
+        criado_em: float = None, versao: Optional[int] = None
+    ):
+        # Um índice 0..n-1 fica como está (ex: frame mapeado da cache partilhada, sem cópia)
+        self.df = df if df.index.equals(pd.RangeIndex(len(df))) else df.reset_index(drop=True)
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+        self.criado_em = criado_em or time.time()
+        self.versao = versao
+
+        with span("indexar_viagens") as s:
+            s.linhas = len(self.df)
+            datas = self.df[NOME_COLUNA_DATA].astype(str).to_numpy() if NOME_COLUNA_DATA in self.df else None
+            self._ordem_datas = np.argsort(datas, kind="stable") if datas is not None else None
+            self._datas_ordenadas = datas[self._ordem_datas] if datas is not None else None
+
+            # NaN conta como um valor (como no drop_duplicates)
+            self._codigos_mapa = pd.factorize(self.df["MAPA"], use_na_sentinel=False)[0] if "MAPA" in self.df else None
+
+            self._indice_motoristas = _indice_invertido(self.df["COD"].to_numpy(dtype=float))
+            self._indices_ajudantes = {
+                col: _indice_invertido(pd.to_numeric(self.df[col], errors="coerce").to_numpy(dtype=float))
+                for col in sorted(self.df.filter(regex=r"^CODJ_\d+$").columns)
+            }
+
+        self._vistas: Dict[tuple, object] = {}
+        self._lock = threading.RLock()  # a vista de ajudantes pede a sem duplicados
+
+    def cobre(self, data_inicio: str, data_fim: str) -> bool:
+        return self.data_inicio <= data_inicio and data_fim <= self.data_fim
+
+    # --- Linhas ---
+    def linhas(self, data_inicio: str = None, data_fim: str = None) -> np.ndarray:
+        """Linhas do sub-período, pela ordem original."""
+        if self._ordem_datas is None or (
+            (data_inicio is None or data_inicio <= self.data_inicio) and (data_fim is None or data_fim >= self.data_fim)
+        ):
+            return np.arange(len(self.df))
+        inicio = np.searchsorted(self._datas_ordenadas, data_inicio, side="left") if data_inicio else 0
+        fim = np.searchsorted(self._datas_ordenadas, data_fim, side="right") if data_fim else len(self.df)
+        return np.sort(self._ordem_datas[inicio:fim])
+
+    def linhas_motorista(self, cod: int) -> np.ndarray:
+        return self._indice_motoristas.get(int(cod), np.empty(0, dtype=np.int64))
+
+    def linhas_ajudante(self, cod: int) -> np.ndarray:
+        """Linhas em que o ajudante aparece, em qualquer posição (CODJ_n)."""
+        partes = [indice[int(cod)] for indice in self._indices_ajudantes.values() if int(cod) in indice]
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(partes))
+
+    # --- Vistas (calculadas uma vez por sub-período) ---
+    def vista(self, tipo, data_inicio: Optional[str], data_fim: Optional[str], calcular):
+        """
+        Resultado de calcular() guardado no armazém por (tipo, sub-período);
+        serve também estruturas derivadas de outros módulos (ex: core/nomes.py).
+        """
+        if (data_inicio or self.data_inicio) <= self.data_inicio and (data_fim or self.data_fim) >= self.data_fim:
+            data_inicio = data_fim = None  # período inteiro: a mesma vista com ou sem datas
+        chave = (tipo, data_inicio, data_fim)
+        with self._lock:
+            vista = self._vistas.get(chave)
+            if vista is None:
+                vista = calcular()
+                self._vistas[chave] = vista
+            return vista
+
+    def _linhas_sem_duplicados(self, linhas: np.ndarray) -> np.ndarray:
+        if self._codigos_mapa is None:
+            return linhas[~self.df.iloc[linhas].duplicated().to_numpy()]
+        _, primeiras = np.unique(self._codigos_mapa[linhas], return_index=True)
+        return linhas[np.sort(primeiras)]
+
+    def _recortar(self, linhas: np.ndarray) -> pd.DataFrame:
+        if len(linhas) == len(self.df):
+            return self.df  # período inteiro: o próprio DataFrame, sem cópia
+        return self.df.iloc[linhas]
+
+    def viagens(self, data_inicio: str = None, data_fim: str = None) -> pd.DataFrame:
+        """Todas as linhas do sub-período (com duplicados; ex: caixas)."""
+        return self.vista("viagens", data_inicio, data_fim, lambda: self._recortar(self.linhas(data_inicio, data_fim)))
+
+    def sem_duplicados(self, data_inicio: str = None, data_fim: str = None) -> pd.DataFrame:
+        """Uma linha por MAPA (a primeira), como drop_duplicates(subset=['MAPA'])."""
+        def calcular():
+            with span("vista_sem_duplicados"):
+                return self._recortar(self._linhas_sem_duplicados(self.linhas(data_inicio, data_fim)))
+        return self.vista("sem_duplicados", data_inicio, data_fim, calcular)
+
+    def ajudantes(self, data_inicio: str = None, data_fim: str = None) -> pd.DataFrame:
+        """Ajudantes em formato longo (uma linha por viagem e posição), das viagens sem duplicados."""
+        def calcular():
+            with span("vista_ajudantes"):
+                return _preparar_dataframe_ajudantes(self.sem_duplicados(data_inicio, data_fim))
+        return self.vista("ajudantes", data_inicio, data_fim, calcular)
+
+
+# --- ARMAZÉNS EM MEMÓRIA (por processo) ---
+_armazens: List[ArmazemViagens] = []
+_lock_armazens = threading.Lock()
+_locks_periodos: Dict[Tuple[str, str], threading.Lock] = {}
+
+
+def _procurar(data_inicio: str, data_fim: str, versao: Optional[int]) -> Optional[ArmazemViagens]:
+    agora = time.time()
+    with _lock_armazens:
+        _armazens[:] = [a for a in _armazens if agora - a.criado_em < TTL_VIAGENS and a.versao == versao]
+        candidatos = [a for a in _armazens if a.cobre(data_inicio, data_fim)]
+    # O mais recente entre os que cobrem o período
+    return max(candidatos, key=lambda a: a.criado_em) if candidatos else None
+
+
+def _guardar(armazem: ArmazemViagens):
+    with _lock_armazens:
+        _armazens.append(armazem)
+        if len(_armazens) > MAX_ARMAZENS:
+            _armazens.remove(min(_armazens, key=lambda a: a.criado_em))
+
+
+def invalidar_viagens():
+    with _lock_armazens:
+        _armazens.clear()
+    invalidar_partilhada(_PREFIXO_PARTILHADO)
+
+
+# --- Cache partilhada entre workers ---
+def _texto_versao(versao: Optional[int]) -> Optional[str]:
+    return None if versao is None else str(versao)
+
+
+def _procurar_partilhado(data_inicio: str, data_fim: str, versao: Optional[int]) -> Optional[ArmazemViagens]:
+    """Armazém montado a partir das viagens que outro worker partilhou (o mais recente que cobre o período)."""
+    candidatos = []
+    for chave, guardado_em in listar_chaves(_PREFIXO_PARTILHADO):
+        _, inicio, fim = chave.split("|")
+        if inicio <= data_inicio and data_fim <= fim:
+            candidatos.append((guardado_em, chave, inicio, fim))
+    for guardado_em, chave, inicio, fim in sorted(candidatos, reverse=True):
+        partilhado = ler_frame(chave, _texto_versao(versao))
+        if partilhado is not None:
+            df, guardado_em = partilhado
+            return ArmazemViagens(df, inicio, fim, criado_em=guardado_em, versao=versao)
+    return None
+
+
+def obter_viagens(
+    supabase: Client,
+    data_inicio: str,
+    data_fim: str
+) -> Tuple[Optional[ArmazemViagens], Optional[str]]:
+    """
+    Armazém que cobre o período (em memória, partilhado por outro worker ou
+    buscado agora ao Supabase), ou (None, error_message) como get_dados_apurados. Pedidos simultâneos
+    para o mesmo período fazem uma só leitura.
+    """
+    # Versão vista antes de ler: uma alteração durante a leitura não fica com a versão nova
+    versao = versao_vista(NOME_DA_TABELA)
+    armazem = _procurar(data_inicio, data_fim, versao)
+    if armazem is None:
+        with _lock_armazens:
+            lock = _locks_periodos.setdefault((data_inicio, data_fim), threading.Lock())
+        with lock:
+            armazem = _procurar(data_inicio, data_fim, versao)
+            if armazem is None:
+                chave = f"{_PREFIXO_PARTILHADO}{data_inicio}|{data_fim}"
+                # Entre workers: um busca, os outros esperam e leem o que ele partilhou
+                with bloqueio(chave):
+                    armazem = _procurar_partilhado(data_inicio, data_fim, versao)
+                    if armazem is None:
+                        df, error_message = get_dados_apurados(supabase, data_inicio, data_fim, "")
+                        if error_message is not None:
+                            return None, error_message
+                        armazem = ArmazemViagens(df, data_inicio, data_fim, versao=versao)
+                        guardar_frame(chave, armazem.df, TTL_VIAGENS, _texto_versao(versao))
+                _guardar(armazem)
+
+    if len(armazem.linhas(data_inicio, data_fim)) == 0:
+        return None, SEM_DADOS
+    return armazem, None
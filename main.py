@@ -1,37 +1,138 @@
 import os
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import Response
+from fastapi.responses import Response, JSONResponse, PlainTextResponse, HTMLResponse
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv # <-- ESTA LINHA ESTAVA EM FALTA
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 
 # Importa os nossos routers
 from routers import xadrez, incentivo, metas, caixas
 from routers import pagamento 
+from routers import tarefas, tendencia, simulacao, importacao
+from core.compressao import CompressaoMiddleware
+from core.metricas import iniciar_pedido, server_timing, formatar_prometheus, instrumentar_cliente
+from core.perfil import perfil_pedido, executar_com_perfil
+from core.processos import aquecer_pool, encerrar_pool
+from core.tarefas import encerrar_tarefas
+from core.saida import SupabaseOcupado, criar_cliente_http
+from core.database import get_cadastro_sincrono
+from core.periodo import resolver_datas_filtro, calcular_periodo_pagamento
 
 load_dotenv() # <--- Esta linha agora funcionará
 
-app = FastAPI()
+# --- AQUECIMENTO NO ARRANQUE (opcional) ---
+# Com AQUECER_NO_ARRANQUE=1, depois de cada deploy/restart a app calcula em
+# segundo plano o período atual, para que os primeiros pedidos já o encontrem
+# em cache. O /health/ready só responde 200 quando o aquecimento termina.
+AQUECER_NO_ARRANQUE = os.environ.get("AQUECER_NO_ARRANQUE", "0") == "1"
+estado_aquecimento = {"pronto": not AQUECER_NO_ARRANQUE, "erro": None}
+
+async def _aquecer_periodo_atual():
+    try:
+        # 1. Metas e Cadastro
+        await run_in_threadpool(metas._get_metas_sincrono, supabase)
+        await run_in_threadpool(get_cadastro_sincrono, supabase)
+
+        # 2. Período por defeito das rotas (início do mês até hoje) e período
+        #    de pagamento atual (dia 26 a dia 25)
+        periodos = [resolver_datas_filtro(None, None)]
+        periodo_pagamento = calcular_periodo_pagamento(datetime.date.today().isoformat())
+        if periodo_pagamento not in periodos:
+            periodos.append(periodo_pagamento)
+
+        for data_inicio, data_fim in periodos:
+            await xadrez.aquecer(supabase, data_inicio, data_fim)
+            await incentivo.aquecer(supabase, data_inicio, data_fim)
+            await caixas.aquecer(supabase, data_inicio, data_fim)
+            await pagamento.aquecer(supabase, data_inicio, data_fim)
+        print(f"--- AQUECIMENTO CONCLUÍDO: {periodos} ---")
+    except Exception as e:
+        # Um aquecimento falhado não pode deixar o worker fora do balanceador
+        print(f"Erro no aquecimento: {e}")
+        estado_aquecimento["erro"] = str(e)
+    finally:
+        estado_aquecimento["pronto"] = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tarefa = None
+    aquecer_pool()
+    if AQUECER_NO_ARRANQUE:
+        # Não bloqueia o arranque: o servidor aceita ligações enquanto aquece
+        tarefa = asyncio.create_task(_aquecer_periodo_atual())
+    yield
+    if tarefa is not None and not tarefa.done():
+        tarefa.cancel()
+    await encerrar_tarefas()
+    encerrar_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configuração global do Supabase (pode ser partilhada)
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Todas as chamadas ao Supabase passam pelo mesmo cliente HTTP/2 com limites
+# de concorrência (ver core/saida.py)
+supabase: Client = create_client(url, key, options=ClientOptions(httpx_client=criar_cliente_http()))
+# Bytes recebidos do Supabase contam para a etapa (span) em curso
+instrumentar_cliente(supabase)
 
 # "Monta" as nossas abas na aplicação principal
 # Adiciona o estado da app a cada request para que os routers possam usar
 @app.middleware("http")
 async def db_session_middleware(request: Request, call_next):
     request.state.supabase = supabase
+    # Profiling a pedido (?__profile=1 + token de admin, ver core/perfil.py)
+    formato_perfil = perfil_pedido(request)
+    if formato_perfil:
+        return await executar_com_perfil(request, call_next, formato_perfil)
+    spans = iniciar_pedido()
     response = await call_next(request)
+    # Etapas concluídas antes da resposta começar (o render em streaming
+    # acontece depois e só aparece no /metrics)
+    if spans:
+        response.headers["Server-Timing"] = server_timing(spans)
     return response
 
+# Sem vaga para chamar o Supabase a tempo: resposta rápida em vez de fila
+@app.exception_handler(SupabaseOcupado)
+async def supabase_ocupado_handler(request: Request, exc: SupabaseOcupado):
+    print(f"Pedido recusado ({request.url.path}): {exc}")
+    return HTMLResponse(
+        "<h1>Servidor ocupado</h1><p>Demasiados pedidos em simultâneo. Tente novamente dentro de alguns segundos.</p>",
+        status_code=503,
+        headers={"Retry-After": "2", "Cache-Control": "no-store"},
+    )
+
+# Compressão brotli/gzip das respostas (HTML das tabelas comprime muito bem)
+app.add_middleware(CompressaoMiddleware)
+
 app.include_router(xadrez.router)
 app.include_router(incentivo.router)
 app.include_router(metas.router)
 app.include_router(caixas.router)
 app.include_router(pagamento.router)
+app.include_router(tendencia.router)
+app.include_router(simulacao.router)
+app.include_router(importacao.router)
+app.include_router(tarefas.router)
 
 # Rota do Favicon (continua aqui)
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon_route():
-    return Response(status_code=204)
\ No newline at end of file
+    return Response(status_code=204)
+
+# Readiness para o balanceador de carga
+@app.get("/health/ready", include_in_schema=False)
+async def health_ready():
+    if not estado_aquecimento["pronto"]:
+        return JSONResponse({"status": "a aquecer"}, status_code=503)
+    return JSONResponse({"status": "pronto", "erro_aquecimento": estado_aquecimento["erro"]})
+
+# Histogramas por etapa (duração, linhas, bytes) em formato Prometheus
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(formatar_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1,22 +1,32 @@
 import datetime
 import pandas as pd
 from fastapi import APIRouter, Request, Depends
-from fastapi.templating import Jinja2Templates
 from typing import Optional, Dict, Any
 from fastapi.concurrency import run_in_threadpool
 from supabase import Client
 
 # Importa as funções de base de dados
 from core.database import (
-    get_dados_apurados, 
     get_cadastro_sincrono, 
     get_caixas_sincrono
 )
+from core.viagens import obter_viagens
+from core.render import render_pagina
+from core.cache import CacheResultados
+from core.periodo import resolver_datas_filtro, periodo_fechado
+from core.http_cache import validar_pedido, validar_versao
+from core.processos import executar_calculo
+from core.metricas import medir
+from core.versoes import versao_fontes_sincrono, HOJE
+from core.motor_sql import duckdb_ativo, snapshots_viagens, abrir_viagens
 # Importa a função que busca as metas
 from .metas import _get_metas_sincrono
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+
+# Resultados por período (data_inicio, data_fim, versão das metas), partilhados entre página e fragmentos
+# (TTLs configuráveis em CACHE_TTL_CAIXAS)
+cache_caixas = CacheResultados("caixas")
 
 def get_supabase(request: Request) -> Client:
     return request.state.supabase
@@ -43,18 +53,11 @@ def _get_valor_por_caixa(dias_antiguidade: int, metas_colaborador: Dict[str, Any
     except Exception:
         return 0.0
 
-# --- Função Principal de Processamento (Inalterada) ---
-def processar_caixas_sincrono(
-    df_viagens: Optional[pd.DataFrame], 
-    df_cadastro: Optional[pd.DataFrame], 
-    df_caixas: Optional[pd.DataFrame], 
-    metas: Dict[str, Any]
-):
-    
-    metas_motorista = metas.get("motorista", {})
-    metas_ajudante = metas.get("ajudante", {})
-    hoje = datetime.date.today()
-    
+def _mapas_cadastro(df_cadastro: Optional[pd.DataFrame], hoje: datetime.date):
+    """
+    Antiguidade (dias) e nome/CPF de cada motorista e ajudante do Cadastro.
+    Retorna (antiguidade_motoristas, info_motoristas, antiguidade_ajudantes, info_ajudantes).
+    """
     # --- 1. Criar Mapa de Antiguidade (Motoristas) ---
     motorista_antiguidade_map = {}
     motorista_info_map = {} 
@@ -95,6 +98,57 @@ def processar_caixas_sincrono(
                 "cpf": str(row.get('CPF_J', '')).strip()
             }
 
+    return motorista_antiguidade_map, motorista_info_map, ajudante_antiguidade_map, ajudante_info_map
+
+def _montar_resultados(
+    caixas_acumuladas: Dict[int, float],
+    info_map: Dict[int, Dict[str, str]],
+    antiguidade_map: Dict[int, int],
+    metas_colaborador: Dict[str, Any]
+) -> list:
+    """
+    Uma linha por colaborador com caixas no período, ordenada por nome.
+    Partilhado pelo cálculo em pandas e em DuckDB (processar_caixas_duckdb).
+    """
+    resultado = []
+    for cod, total_caixas in caixas_acumuladas.items():
+        if total_caixas == 0:
+            continue
+            
+        info = info_map.get(cod, {"cpf": "N/A", "nome": f"COD {cod}"})
+        dias = antiguidade_map.get(cod, 0)
+        valor_cx = _get_valor_por_caixa(dias, metas_colaborador)
+        total_bonus = total_caixas * valor_cx
+        
+        resultado.append({
+            "cpf": info["cpf"],
+            "cod": cod,
+            "nome": info["nome"],
+            "total_caixas": total_caixas,
+            "valor_por_caixa": valor_cx,
+            "total_premio": total_bonus
+        })
+
+    # Ordenar por nome
+    return sorted(resultado, key=lambda x: x['nome'])
+
+# --- Função Principal de Processamento (Inalterada) ---
+@medir("processar_caixas")
+def processar_caixas_sincrono(
+    df_viagens: Optional[pd.DataFrame], 
+    df_cadastro: Optional[pd.DataFrame], 
+    df_caixas: Optional[pd.DataFrame], 
+    metas: Dict[str, Any]
+):
+    
+    metas_motorista = metas.get("motorista", {})
+    metas_ajudante = metas.get("ajudante", {})
+    hoje = datetime.date.today()
+    
+    # --- 1. e 2. Mapas de Antiguidade (Motoristas e Ajudantes) ---
+    (motorista_antiguidade_map, motorista_info_map,
+     ajudante_antiguidade_map, ajudante_info_map) = _mapas_cadastro(df_cadastro, hoje)
+
     # --- 3. Criar Mapa de Caixas ---
     mapa_caixas_total = {}
     if df_caixas is not None and not df_caixas.empty:
@@ -129,76 +183,114 @@ def processar_caixas_sincrono(
                         ajudante_caixas_acumuladas[cod_ajudante_int] = ajudante_caixas_acumuladas.get(cod_ajudante_int, 0) + caixas_do_mapa
 
     # --- 5. Montar Resultados Finais ---
-    resultado_motoristas = []
-    for cod, total_caixas in motorista_caixas_acumuladas.items():
-        if total_caixas == 0:
-            continue
-            
-        info = motorista_info_map.get(cod, {"cpf": "N/A", "nome": f"COD {cod}"})
-        dias = motorista_antiguidade_map.get(cod, 0)
-        valor_cx = _get_valor_por_caixa(dias, metas_motorista)
-        total_bonus = total_caixas * valor_cx
-        
-        resultado_motoristas.append({
-            "cpf": info["cpf"],
-            "cod": cod,
-            "nome": info["nome"],
-            "total_caixas": total_caixas,
-            "valor_por_caixa": valor_cx,
-            "total_premio": total_bonus
-        })
-
-    resultado_ajudantes = []
-    for cod, total_caixas in ajudante_caixas_acumuladas.items():
-        if total_caixas == 0:
-            continue
-
-        info = ajudante_info_map.get(cod, {"cpf": "N/A", "nome": f"COD {cod}"})
-        dias = ajudante_antiguidade_map.get(cod, 0)
-        valor_cx = _get_valor_por_caixa(dias, metas_ajudante)
-        total_bonus = total_caixas * valor_cx
-        
-        resultado_ajudantes.append({
-            "cpf": info["cpf"],
-            "cod": cod,
-            "nome": info["nome"],
-            "total_caixas": total_caixas,
-            "valor_por_caixa": valor_cx,
-            "total_premio": total_bonus
-        })
-
-    # Ordenar por nome
-    resultado_motoristas = sorted(resultado_motoristas, key=lambda x: x['nome'])
-    resultado_ajudantes = sorted(resultado_ajudantes, key=lambda x: x['nome'])
+    resultado_motoristas = _montar_resultados(motorista_caixas_acumuladas, motorista_info_map, motorista_antiguidade_map, metas_motorista)
+    resultado_ajudantes = _montar_resultados(ajudante_caixas_acumuladas, ajudante_info_map, ajudante_antiguidade_map, metas_ajudante)
     
     return resultado_motoristas, resultado_ajudantes
 
 
-# --- A Rota FastAPI (Endpoint) ---
-@router.get("/caixas")
-async def ler_relatorio_caixas(
-    request: Request, 
-    data_inicio: Optional[str] = None,
-    data_fim: Optional[str] = None,
-    caixas_tab: str = "motoristas", # <-- NOVO PARÂMETRO
-    supabase: Client = Depends(get_supabase)
+@medir("processar_caixas_duckdb")
+def processar_caixas_duckdb(
+    con,
+    df_cadastro: Optional[pd.DataFrame],
+    df_caixas: Optional[pd.DataFrame],
+    metas: Dict[str, Any]
 ):
-    
+    """
+    Mesmo resultado que processar_caixas_sincrono, com a acumulação (passo 4)
+    feita em SQL sobre a vista 'viagens' de core.motor_sql.abrir_viagens.
+    As somas seguem a ordem das viagens (sum ... ORDER BY), como o ciclo em Python.
+    """
     hoje = datetime.date.today()
-    data_inicio_filtro = data_inicio or hoje.replace(day=1).isoformat()
-    data_fim_filtro = data_fim or hoje.isoformat()
-    
-    # --- 1. Buscar Metas (já inclui as metas de caixas) ---
-    metas = await run_in_threadpool(_get_metas_sincrono, supabase)
+    (motorista_antiguidade_map, motorista_info_map,
+     ajudante_antiguidade_map, ajudante_info_map) = _mapas_cadastro(df_cadastro, hoje)
+
+    motorista_caixas_acumuladas = {}
+    ajudante_caixas_acumuladas = {}
+    if df_caixas is not None and not df_caixas.empty:
+        colunas = {nome: tipo for nome, tipo, *_ in con.execute("DESCRIBE viagens").fetchall()}
+        # str(viagem.get('MAPA', '')) do ciclo em Python: None -> 'None', NaN -> 'nan'
+        if "MAPA" not in colunas:
+            mapa_texto = "''"
+        elif colunas["MAPA"] == "VARCHAR":
+            mapa_texto = "COALESCE(viagens.\"MAPA\", 'None')"
+        else:
+            mapa_texto = "COALESCE(CAST(viagens.\"MAPA\" AS VARCHAR), 'nan')"
+
+        colunas_ajudantes = [col for col in colunas if col.startswith('CODJ_')]
+        usadas = ", ".join(f'viagens."{col}"' for col in ["COD", *colunas_ajudantes, "_ordem"])
+
+        con.register("caixas_df", df_caixas[["mapa", "caixas"]].assign(ordem=range(len(df_caixas))))
+        con.register("cad_motoristas", pd.DataFrame({"cod": list(motorista_info_map)}, dtype="int64"))
+        con.register("cad_ajudantes", pd.DataFrame({"cod": list(ajudante_info_map)}, dtype="int64"))
+        con.execute(f"""
+            CREATE TEMP TABLE t AS
+            WITH cx AS (
+                SELECT mapa AS _mapa, caixas AS _caixas FROM caixas_df
+                QUALIFY row_number() OVER (PARTITION BY mapa ORDER BY ordem) = 1
+            )
+            SELECT {usadas}, CAST(cx._caixas AS DOUBLE) AS _caixas
+            FROM viagens JOIN cx ON {mapa_texto} = cx._mapa
+            WHERE cx._caixas <> 0
+        """)
+
+        # Ordem de primeira ocorrência, como a inserção no dicionário em Python
+        motorista_caixas_acumuladas = dict(con.execute("""
+            SELECT "COD", sum(_caixas ORDER BY _ordem) FROM t
+            WHERE "COD" IN (SELECT cod FROM cad_motoristas)
+            GROUP BY "COD" ORDER BY min(_ordem)
+        """).fetchall())
+
+        if colunas_ajudantes:
+            partes = " UNION ALL ".join(
+                f"SELECT TRY_CAST(trunc(TRY_CAST(\"{col}\" AS DOUBLE)) AS BIGINT) AS cod, _caixas, "
+                f"_ordem * {len(colunas_ajudantes)} + {i} AS ordem FROM t"
+                for i, col in enumerate(colunas_ajudantes)
+            )
+            ajudante_caixas_acumuladas = dict(con.execute(f"""
+                SELECT cod, sum(_caixas ORDER BY ordem) FROM ({partes})
+                WHERE cod IN (SELECT cod FROM cad_ajudantes)
+                GROUP BY cod ORDER BY min(ordem)
+            """).fetchall())
+
+    resultado_motoristas = _montar_resultados(motorista_caixas_acumuladas, motorista_info_map, motorista_antiguidade_map, metas.get("motorista", {}))
+    resultado_ajudantes = _montar_resultados(ajudante_caixas_acumuladas, ajudante_info_map, ajudante_antiguidade_map, metas.get("ajudante", {}))
+    return resultado_motoristas, resultado_ajudantes
+
+
+def _processar_caixas_periodo_duckdb(ficheiros, data_inicio, data_fim, df_cadastro, df_caixas, metas):
+    con = abrir_viagens(ficheiros, data_inicio, data_fim)
+    try:
+        return processar_caixas_duckdb(con, df_cadastro, df_caixas, metas)
+    finally:
+        con.close()
+
+
+async def _calcular_caixas(
+    supabase: Client, data_inicio_filtro: str, data_fim_filtro: str, metas: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Busca os dados do período e calcula o bónus de caixas das duas
+    sub-abas (motoristas e ajudantes) de uma só vez.
+    """
+    # --- 1. Metas (já incluem as metas de caixas): vêm resolvidas para o período ---
     
     # --- 2. Buscar Viagens (Quem trabalhou em que mapa) ---
-    df_viagens, error_message = await run_in_threadpool(
-        get_dados_apurados,
-        supabase,
-        data_inicio_filtro,
-        data_fim_filtro,
-        search_str="" 
-    )
+    # Com MOTOR_CALCULO=duckdb as viagens ficam nas cópias Parquet e o cálculo corre em SQL
+    usar_duckdb = duckdb_ativo()
+    if usar_duckdb:
+        ficheiros, error_message = await run_in_threadpool(
+            snapshots_viagens, supabase, data_inicio_filtro, data_fim_filtro
+        )
+    else:
+        armazem, error_message = await run_in_threadpool(
+            obter_viagens,
+            supabase,
+            data_inicio_filtro,
+            data_fim_filtro
+        )
+        # Todas as linhas do período (com duplicados), do armazém partilhado
+        df_viagens = armazem.viagens(data_inicio_filtro, data_fim_filtro) if armazem is not None else None
     
     # --- 3. Buscar Cadastro (Para Antiguidade e Nomes) ---
     df_cadastro, error_cadastro = await run_in_threadpool(get_cadastro_sincrono, supabase)
@@ -217,8 +309,19 @@ async def ler_relatorio_caixas(
             
     # --- 5. Processar os dados ---
     resultado_motoristas, resultado_ajudantes = [], []
-    if error_message is None:
+    if error_message is None and usar_duckdb:
+        # O DuckDB usa as suas próprias threads e liberta o GIL: basta o thread pool
         resultado_motoristas, resultado_ajudantes = await run_in_threadpool(
+            _processar_caixas_periodo_duckdb,
+            ficheiros,
+            data_inicio_filtro,
+            data_fim_filtro,
+            df_cadastro,
+            df_caixas,
+            metas
+        )
+    elif error_message is None:
+        resultado_motoristas, resultado_ajudantes = await executar_calculo(
             processar_caixas_sincrono,
             df_viagens,
             df_cadastro,
@@ -226,22 +329,97 @@ async def ler_relatorio_caixas(
             metas
         )
 
-    return templates.TemplateResponse("index.html", {
-        "request": request, 
+    return {
+        "caixas_motoristas": resultado_motoristas,
+        "caixas_ajudantes": resultado_ajudantes,
+        "metas": metas,
+        "error_message": error_message,
+    }
+
+
+async def _obter_caixas(
+    supabase: Client, data_inicio_filtro: str, data_fim_filtro: str, versao: Optional[str] = None
+) -> Dict[str, Any]:
+    # Chave com a versão das metas vigentes no período (como no pagamento)
+    metas = await run_in_threadpool(_get_metas_sincrono, supabase, data_inicio_filtro)
+    return await cache_caixas.obter_ou_calcular(
+        (data_inicio_filtro, data_fim_filtro, metas["versao"]),
+        lambda: _calcular_caixas(supabase, data_inicio_filtro, data_fim_filtro, metas),
+        versao=versao,
+        permanente=periodo_fechado(data_fim_filtro)
+    )
+
+# Tabelas de que o relatório depende (versão para o ETag, ver core/versoes.py);
+# a antiguidade é contada até hoje
+FONTES_CAIXAS = ["Distribuição", "Cadastro", "Caixas", "Metas", HOJE]
+
+
+# --- A Rota FastAPI (Endpoint) ---
+@router.get("/caixas")
+async def ler_relatorio_caixas(
+    request: Request, 
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    caixas_tab: str = "motoristas", # <-- NOVO PARÂMETRO
+    supabase: Client = Depends(get_supabase)
+):
+    data_inicio_filtro, data_fim_filtro = resolver_datas_filtro(data_inicio, data_fim)
+
+    validacao = await validar_pedido(request, supabase, FONTES_CAIXAS)
+    if validacao.resposta_304 is not None:
+        return validacao.resposta_304
+
+    resultado = await _obter_caixas(supabase, data_inicio_filtro, data_fim_filtro, validacao.versao)
+
+    return render_pagina(request, {
         "main_tab": "caixas",
         "caixas_tab": caixas_tab, # <-- PASSA A NOVA VARIÁVEL
         "data_inicio_selecionada": data_inicio_filtro,
         "data_fim_selecionada": data_fim_filtro,
-        "error_message": error_message,
-        "caixas_motoristas": resultado_motoristas, 
-        "caixas_ajudantes": resultado_ajudantes,   
-        
-        "metas": metas,
-        "incentivo_tab": "motoristas", # <-- Valor default para o template
-        "view_mode": "equipas_fixas", 
-        "search_query": "",
-        "resumo_viagens": [],
-        "dashboard_equipas": [],
-        "incentivo_motoristas": [],
-        "incentivo_ajudantes": [],
-    })
\ No newline at end of file
+        **resultado,
+    }, headers=validacao.cabecalhos(resultado))
+
+# --- Fragmento: só a tabela da sub-aba (troca motoristas/ajudantes sem recarregar) ---
+@router.get("/caixas/fragmento")
+async def ler_fragmento_caixas(
+    request: Request, 
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    caixas_tab: str = "motoristas",
+    v: Optional[str] = None,
+    supabase: Client = Depends(get_supabase)
+):
+    data_inicio_filtro, data_fim_filtro = resolver_datas_filtro(data_inicio, data_fim)
+
+    # v: versão dos dados da página. Com esse resultado em cache, responde já,
+    # sem ler as versões nem as metas no Supabase
+    resultado = cache_caixas.obter_da_versao((data_inicio_filtro, data_fim_filtro), v)
+    if resultado is not None:
+        validacao = validar_versao(request, v)
+    else:
+        validacao = await validar_pedido(request, supabase, FONTES_CAIXAS)
+    if validacao.resposta_304 is not None:
+        return validacao.resposta_304
+
+    if resultado is None:
+        resultado = await _obter_caixas(supabase, data_inicio_filtro, data_fim_filtro, validacao.versao)
+
+    sub_aba = 'ajudantes' if caixas_tab == 'ajudantes' else 'motoristas'
+    return render_pagina(request, {
+        "caixas_tab": caixas_tab,
+        "data_inicio_selecionada": data_inicio_filtro,
+        "data_fim_selecionada": data_fim_filtro,
+        **resultado,
+    },
+        nome_template=f"abas/caixas_{sub_aba}.html",
+        headers=validacao.cabecalhos(resultado)
+    )
+
+# --- Aquecimento (chamado no arranque da app, ver main.py) ---
+async def aquecer(supabase: Client, data_inicio_filtro: str, data_fim_filtro: str):
+    """
+    Calcula e guarda na cache o resultado do período, com a mesma chave e
+    versão que a rota usaria.
+    """
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, FONTES_CAIXAS)
+    await _obter_caixas(supabase, data_inicio_filtro, data_fim_filtro, versao)
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Request, Depends, File, Form, UploadFile
+from fastapi.responses import JSONResponse
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from supabase import Client
+
+from core.cache import invalidar_todas
+from core.database import NOME_DA_TABELA
+from core.importacao import importar_sincrono
+from core.motor_sql import apagar_snapshots
+from core.versoes import marcar_alteracao
+from core.viagens import invalidar_viagens
+
+router = APIRouter()
+
+# --- IMPORTAÇÃO DE FICHEIROS (ver core/importacao.py) ---
+#   POST /importar/caixas        colunas data, mapa, caixas
+#   POST /importar/indicadores   colunas Codigo_M, dev_pdv, Rating_tx, refugo,
+#                                data_inicio_periodo, data_fim_periodo
+#   POST /importar/viagens       colunas MAPA, DATA, COD, MOTORISTA, MOTORISTA_2, COD_2,
+#                                AJUDANTE_1..3, CODJ_1..3 (gravadas já normalizadas)
+# Campos do formulário: ficheiro (.xlsx ou .csv), data_periodo (opcional: uma
+# data do período de pagamento, para ficheiros de indicadores sem as colunas
+# do período) e simular=1 (só valida, não grava).
+TABELAS = {"caixas": "Caixas", "indicadores": "Resultados_Indicadores", "viagens": NOME_DA_TABELA}
+
+def get_supabase(request: Request) -> Client:
+    return request.state.supabase
+
+@router.post("/importar/{nome}")
+async def importar(
+    nome: str,
+    ficheiro: UploadFile = File(...),
+    data_periodo: Optional[str] = Form(None),
+    simular: bool = Form(False),
+    supabase: Client = Depends(get_supabase)
+):
+    tabela = TABELAS.get(nome)
+    if tabela is None:
+        return JSONResponse({"erro": f"Tabela desconhecida: '{nome}' (use {', '.join(TABELAS)})"}, status_code=404)
+
+    # O ficheiro já está no disco (UploadFile); é lido aos blocos no thread pool
+    resumo, error_message = await run_in_threadpool(
+        importar_sincrono, supabase, tabela, ficheiro.file, ficheiro.filename, data_periodo or None, simular
+    )
+    await ficheiro.close()
+
+    if resumo is not None and resumo["linhas_gravadas"]:
+        # Os dados importados entram nos resultados de períodos já fechados
+        # (entradas permanentes): este worker apaga as suas caches e a geração
+        # partilhada muda a versão dos dados (e os ETags) em todos os workers.
+        # As cópias Parquet dos meses importados (partilhadas pelos workers)
+        # são apagadas já, em vez de ficarem no disco até à próxima leitura.
+        if tabela == NOME_DA_TABELA:
+            invalidar_viagens()
+            await run_in_threadpool(apagar_snapshots, resumo["meses"])
+        invalidar_todas()
+        marcar_alteracao()
+        print(f"--- {resumo['linhas_gravadas']} LINHAS IMPORTADAS PARA {tabela} EM {resumo['segundos']}s ---")
+
+    if error_message:
+        status = 400 if resumo is None else 502
+        return JSONResponse({"erro": error_message, **(resumo or {})}, status_code=status, headers={"Cache-Control": "no-store"})
+    return JSONResponse(resumo, headers={"Cache-Control": "no-store"})
@@ -1,28 +1,39 @@
-import datetime
 import pandas as pd
 from fastapi import APIRouter, Request, Depends
-from fastapi.templating import Jinja2Templates
 from typing import Optional, Dict, Any
 from fastapi.concurrency import run_in_threadpool
 from supabase import Client
 
 # --- ALTERAÇÃO: Importa a nova função ---
-from core.database import get_dados_apurados, get_cadastro_sincrono, get_indicadores_sincrono
+from core.database import get_cadastro_sincrono, get_indicadores_sincrono
+from core.viagens import obter_viagens
 from core.analysis import gerar_dashboard_e_mapas
+from core.processos import executar_calculo
+from core.metricas import medir
+from core.render import render_pagina
+from core.cache import CacheResultados
+from core.periodo import resolver_datas_filtro, calcular_periodo_pagamento, periodo_fechado
+from core.http_cache import validar_pedido, validar_versao
+from core.versoes import versao_fontes_sincrono
 from .metas import _get_metas_sincrono
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+
+# Resultados por período (data_inicio, data_fim, versão das metas), partilhados entre página e fragmentos
+# (TTLs configuráveis em CACHE_TTL_INCENTIVO)
+cache_incentivo = CacheResultados("incentivo")
 
 def get_supabase(request: Request) -> Client:
     return request.state.supabase
 
 # Função de processamento síncrono (para o thread pool)
+@medir("processar_incentivo")
 def processar_incentivos_sincrono(
     df_viagens: Optional[pd.DataFrame], 
     df_cadastro: Optional[pd.DataFrame], 
     df_indicadores: Optional[pd.DataFrame], # <-- DADOS REAIS
-    metas: Dict[str, Any]
+    metas: Dict[str, Any],
+    df_melted: Optional[pd.DataFrame] = None # ajudantes em formato longo (ArmazemViagens.ajudantes)
 ):
     
     incentivo_motoristas = []
@@ -116,6 +127,8 @@ def processar_incentivos_sincrono(
             linha["refugo_premio_val"] = metas_motorista.get("refugo_premio", 0) if refugo_passou else 0.0
 
             linha["total_premio"] = linha["dev_pdv_premio_val"] + linha["rating_premio_val"] + linha["refugo_premio_val"]
+            # Resultado de cada KPI (o prémio pode ser 0 mesmo quando passou; usado pelo histórico)
+            linha["dev_pdv_passou"], linha["rating_passou"], linha["refugo_passou"] = dev_passou, rating_passou, refugo_passou
             incentivo_motoristas.append(linha)
             
             # Salva o RESULTADO (pass/fail) e os VALORES ATINGIDOS no mapa
@@ -127,7 +140,7 @@ def processar_incentivos_sincrono(
                 }
 
         # --- LÓGICA DOS AJUDANTES (Inalterada) ---
-        resultado_xadrez = gerar_dashboard_e_mapas(df_viagens)
+        resultado_xadrez = gerar_dashboard_e_mapas(df_viagens, df_melted)
         mapas = resultado_xadrez["mapas"]
         df_melted = resultado_xadrez["df_melted"]
         
@@ -157,7 +170,11 @@ def processar_incentivos_sincrono(
                 "rating_premio_val": premio_rating_ajudante,
                 "refugo_val": performance_herdada["refugo_val"],
                 "refugo_premio_val": premio_refugo_ajudante,
-                "total_premio": premio_dev_ajudante + premio_rating_ajudante + premio_refugo_ajudante
+                "total_premio": premio_dev_ajudante + premio_rating_ajudante + premio_refugo_ajudante,
+                "dev_pdv_passou": performance_herdada["dev_pdv_passou"],
+                "rating_passou": performance_herdada["rating_passou"],
+                "refugo_passou": performance_herdada["refugo_passou"],
+                "motorista_fixo": cod_motorista_fixo,
             }
             incentivo_ajudantes.append(ajudante_data)
             
@@ -167,37 +184,18 @@ def processar_incentivos_sincrono(
         
     return incentivo_motoristas, incentivo_ajudantes
 
-@router.get("/incentivo")
-async def ler_relatorio_incentivo(
-    request: Request, 
-    incentivo_tab: str = "motoristas",
-    data_inicio: Optional[str] = None,
-    data_fim: Optional[str] = None,
-    supabase: Client = Depends(get_supabase)
-):
-    
-    hoje = datetime.date.today()
-    data_inicio_filtro = data_inicio or hoje.replace(day=1).isoformat()
-    data_fim_filtro = data_fim or hoje.isoformat()
-    
+async def _calcular_incentivo(
+    supabase: Client, data_inicio_filtro: str, data_fim_filtro: str, metas: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Busca os dados do período e calcula os incentivos das duas sub-abas
+    (motoristas e ajudantes) de uma só vez.
+    """
     incentivo_motoristas, incentivo_ajudantes = [], []
-    metas = await run_in_threadpool(_get_metas_sincrono, supabase)
 
     # --- LÓGICA DE PERÍODO (Inalterada) ---
     try:
-        user_date_obj = datetime.date.fromisoformat(data_inicio_filtro)
-        dia_corte = 26
-        
-        if user_date_obj.day < dia_corte:
-            data_fim_periodo = user_date_obj.replace(day=25)
-            data_inicio_periodo = (user_date_obj.replace(day=1) - datetime.timedelta(days=1)).replace(day=dia_corte)
-        else:
-            data_inicio_periodo = user_date_obj.replace(day=dia_corte)
-            data_fim_periodo = (data_inicio_periodo + datetime.timedelta(days=32)).replace(day=25)
-
-        data_inicio_periodo_str = data_inicio_periodo.isoformat()
-        data_fim_periodo_str = data_fim_periodo.isoformat()
-    
+        data_inicio_periodo_str, data_fim_periodo_str = calcular_periodo_pagamento(data_inicio_filtro)
     except ValueError:
         error_message = "Formato de data inválido."
         data_inicio_periodo_str = data_inicio_filtro
@@ -206,12 +204,11 @@ async def ler_relatorio_incentivo(
 
 
     # 1. Buscar dados de VIAGENS (usa o filtro do utilizador)
-    df_viagens, error_message = await run_in_threadpool(
-        get_dados_apurados,
+    armazem, error_message = await run_in_threadpool(
+        obter_viagens,
         supabase,
         data_inicio_filtro,
-        data_fim_filtro,
-        search_str=""
+        data_fim_filtro
     )
     
     # 2. Buscar dados de CADASTRO (CPFs)
@@ -230,43 +227,119 @@ async def ler_relatorio_incentivo(
         error_message = error_indicadores
     # --- FIM DA ALTERAÇÃO ---
     
-    if error_message is None and df_viagens is not None:
-        if 'MAPA' in df_viagens.columns:
-            df_viagens = df_viagens.drop_duplicates(subset=['MAPA'])
-        else:
-            df_viagens = df_viagens.drop_duplicates()
+    # Viagens sem duplicados e ajudantes em formato longo, do armazém partilhado
+    df_viagens, df_melted = None, None
+    if armazem is not None:
+        df_viagens = await run_in_threadpool(armazem.sem_duplicados, data_inicio_filtro, data_fim_filtro)
+        df_melted = await run_in_threadpool(armazem.ajudantes, data_inicio_filtro, data_fim_filtro)
     
     # 4. Processar incentivos
     if error_message is None:
-        incentivo_motoristas, incentivo_ajudantes = await run_in_threadpool(
+        incentivo_motoristas, incentivo_ajudantes = await executar_calculo(
             processar_incentivos_sincrono,
             df_viagens,
             df_cadastro,
             df_indicadores, 
-            metas
+            metas,
+            df_melted
         )
     else:
-        incentivo_motoristas, incentivo_ajudantes = await run_in_threadpool(
+        incentivo_motoristas, incentivo_ajudantes = await executar_calculo(
             processar_incentivos_sincrono,
             df_viagens,
             df_cadastro,
             df_indicadores,
-            metas
+            metas,
+            df_melted
         )
 
-    return templates.TemplateResponse("index.html", {
-        "request": request, 
+    return {
+        "incentivo_motoristas": incentivo_motoristas,
+        "incentivo_ajudantes": incentivo_ajudantes,
+        "metas": metas,
+        "error_message": error_message,
+    }
+
+async def _obter_incentivo(
+    supabase: Client, data_inicio_filtro: str, data_fim_filtro: str, versao: Optional[str] = None
+) -> Dict[str, Any]:
+    # Chave com a versão das metas vigentes no período (como no pagamento)
+    metas = await run_in_threadpool(_get_metas_sincrono, supabase, data_inicio_filtro)
+    return await cache_incentivo.obter_ou_calcular(
+        (data_inicio_filtro, data_fim_filtro, metas["versao"]),
+        lambda: _calcular_incentivo(supabase, data_inicio_filtro, data_fim_filtro, metas),
+        versao=versao,
+        permanente=periodo_fechado(data_fim_filtro)
+    )
+
+# Tabelas de que o relatório depende (versão para o ETag, ver core/versoes.py)
+FONTES_INCENTIVO = ["Distribuição", "Cadastro", "Resultados_Indicadores", "Metas"]
+
+@router.get("/incentivo")
+async def ler_relatorio_incentivo(
+    request: Request, 
+    incentivo_tab: str = "motoristas",
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    supabase: Client = Depends(get_supabase)
+):
+    data_inicio_filtro, data_fim_filtro = resolver_datas_filtro(data_inicio, data_fim)
+
+    validacao = await validar_pedido(request, supabase, FONTES_INCENTIVO)
+    if validacao.resposta_304 is not None:
+        return validacao.resposta_304
+
+    resultado = await _obter_incentivo(supabase, data_inicio_filtro, data_fim_filtro, validacao.versao)
+
+    return render_pagina(request, {
         "main_tab": "incentivo",
         "incentivo_tab": incentivo_tab,
         "data_inicio_selecionada": data_inicio_filtro,
         "data_fim_selecionada": data_fim_filtro,
-        "error_message": error_message,
-        "incentivo_motoristas": incentivo_motoristas,
-        "incentivo_ajudantes": incentivo_ajudantes,
-        "metas": metas,
-        "view_mode": "equipas_fixas", 
-        "search_query": "",
-        "resumo_viagens": [],
-        "dashboard_equipas": [],
-        "caixas_tab": "motoristas",
-    })
\ No newline at end of file
+        **resultado,
+    }, headers=validacao.cabecalhos(resultado))
+
+# --- Fragmento: só a tabela da sub-aba (troca motoristas/ajudantes sem recarregar) ---
+@router.get("/incentivo/fragmento")
+async def ler_fragmento_incentivo(
+    request: Request, 
+    incentivo_tab: str = "motoristas",
+    v: Optional[str] = None,
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    supabase: Client = Depends(get_supabase)
+):
+    data_inicio_filtro, data_fim_filtro = resolver_datas_filtro(data_inicio, data_fim)
+
+    # v: versão dos dados da página. Com esse resultado em cache, responde já,
+    # sem ler as versões nem as metas no Supabase
+    resultado = cache_incentivo.obter_da_versao((data_inicio_filtro, data_fim_filtro), v)
+    if resultado is not None:
+        validacao = validar_versao(request, v)
+    else:
+        validacao = await validar_pedido(request, supabase, FONTES_INCENTIVO)
+    if validacao.resposta_304 is not None:
+        return validacao.resposta_304
+
+    if resultado is None:
+        resultado = await _obter_incentivo(supabase, data_inicio_filtro, data_fim_filtro, validacao.versao)
+
+    sub_aba = 'ajudantes' if incentivo_tab == 'ajudantes' else 'motoristas'
+    return render_pagina(request, {
+        "incentivo_tab": incentivo_tab,
+        "data_inicio_selecionada": data_inicio_filtro,
+        "data_fim_selecionada": data_fim_filtro,
+        **resultado,
+    },
+        nome_template=f"abas/incentivo_{sub_aba}.html",
+        headers=validacao.cabecalhos(resultado)
+    )
+
+# --- Aquecimento (chamado no arranque da app, ver main.py) ---
+async def aquecer(supabase: Client, data_inicio_filtro: str, data_fim_filtro: str):
+    """
+    Calcula e guarda na cache o resultado do período, com a mesma chave e
+    versão que a rota usaria.
+    """
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, FONTES_INCENTIVO)
+    await _obter_incentivo(supabase, data_inicio_filtro, data_fim_filtro, versao)
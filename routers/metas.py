@@ -1,13 +1,22 @@
+import os
+import json
+import time
+import hashlib
 import datetime
+import pandas as pd
 from fastapi import APIRouter, Request, Form, Depends
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from supabase import Client # Importar o Client
 from fastapi.concurrency import run_in_threadpool # Importar o run_in_threadpool
+from core.render import render_pagina
+from core.periodo import calcular_periodo_pagamento, periodo_fechado
+from core.cache_partilhada import guardar_frame, ler_frame, invalidar_partilhada
+from core.versoes import marcar_alteracao, versao_vista
+from core.metricas import span
+from core.saida import SupabaseOcupado
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
 # Função para obter o cliente Supabase do estado da request
 def get_supabase(request: Request) -> Client:
@@ -43,103 +52,195 @@ def _get_default_metas() -> Dict[str, Any]:
 # --- FIM DA FUNÇÃO ---
 
 
-# --- ALTERAÇÃO: Metas agora vêm do Supabase ---
-def _get_metas_sincrono(supabase: Client) -> Dict[str, Any]:
+def _formatar_metas_colaborador(dados: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Busca as metas reais da tabela Variavel.Metas no Supabase.
+    Converte uma linha da tabela Metas no formato usado pelos cálculos e
+    pelo template (percentagens formatadas, metas de caixa com defaults).
+    """
+    return {
+        "dev_pdv_meta_perc": float(dados["dev_pdv_meta_perc"]),
+        "dev_pdv_meta": f"{float(dados['dev_pdv_meta_perc']):.2f}%", 
+        "dev_pdv_premio": float(dados["dev_pdv_premio"]),
+        
+        "rating_meta_perc": float(dados["rating_meta_perc"]),
+        "rating_meta": f"{float(dados['rating_meta_perc']):.2f}%", 
+        "rating_premio": float(dados["rating_premio"]),
+        
+        "refugo_meta_perc": float(dados["refugo_meta_perc"]),
+        "refugo_meta": f"{float(dados['refugo_meta_perc']):.1f}%", 
+        "refugo_premio": float(dados["refugo_premio"]),
+        
+        # --- CORRIGIDO: Lê as metas de caixa (nomes genéricos) ---
+        "meta_cx_dias_n1": int(dados.get("meta_cx_dias_n1", 365)),
+        "meta_cx_valor_n1": float(dados.get("meta_cx_valor_n1", 0)),
+        "meta_cx_dias_n2": int(dados.get("meta_cx_dias_n2", 730)),
+        "meta_cx_valor_n2": float(dados.get("meta_cx_valor_n2", 0)),
+        "meta_cx_dias_n3": int(dados.get("meta_cx_dias_n3", 1825)),
+        "meta_cx_valor_n3": float(dados.get("meta_cx_valor_n3", 0)),
+        "meta_cx_dias_n4": int(dados.get("meta_cx_dias_n4", 9999)), 
+        "meta_cx_valor_n4": float(dados.get("meta_cx_valor_n4", 0)), 
+    }
+
+def _formatar_metas(m_data: Dict[str, Any], a_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "motorista": _formatar_metas_colaborador(m_data),
+        "ajudante": _formatar_metas_colaborador(a_data),
+    }
+
+# --- VERSÕES DAS METAS (vigentes a partir de uma data) ---
+# Salvar as metas reescrevia as linhas MOTORISTA/AJUDANTE: os períodos já
+# fechados passavam a ser recalculados com as metas de hoje e nenhum
+# resultado podia ficar em cache de vez. Agora cada gravação é uma versão com
+# 'vigente_desde' (início do período de pagamento a partir do qual vale); cada
+# período usa, por tipo de colaborador, a linha com o maior vigente_desde que
+# não passe do início do período. Linhas sem vigente_desde (as antigas) valem
+# desde sempre. Migração da tabela:
+#   ALTER TABLE "Metas" ADD COLUMN vigente_desde date;
+#   (uma restrição única em tipo_colaborador passa a ser em (tipo_colaborador, vigente_desde))
+# A 'versao' das metas de um período é um hash do conteúdo: entra nas chaves
+# das caches de resultados, por isso uma gravação nunca serve resultados
+# calculados com outras metas e os períodos fechados podem ficar em cache.
+# Por isso também só se gravam versões vigentes desde um período ainda aberto
+# (periodo_fechado): as metas de um período fechado não mudam.
+#   METAS_TTL=30    segundos que a tabela Metas lida fica em memória (por processo
+#                   e, com CACHE_PARTILHADA=1, na cache partilhada entre workers),
+#                   enquanto a versão da tabela vista por este processo não mudar
+
+METAS_TTL = float(os.environ.get("METAS_TTL", 30))
+
+# (lida_em, versão da tabela, linhas da tabela Metas)
+_linhas_metas: Optional[Tuple[float, Optional[int], List[Dict[str, Any]]]] = None
+
+def _esquecer_metas():
+    """Depois de gravar: os outros workers também voltam a ler a tabela."""
+    global _linhas_metas
+    _linhas_metas = None
+    invalidar_partilhada("metas")
+
+def _ler_linhas_metas(supabase: Client) -> List[Dict[str, Any]]:
+    global _linhas_metas
+    versao = versao_vista("Metas")
+    texto_versao = None if versao is None else str(versao)
+    if _linhas_metas is not None and _linhas_metas[1] == versao and time.time() - _linhas_metas[0] < METAS_TTL:
+        return _linhas_metas[2]
+
+    # Lida há pouco por outro worker (CACHE_PARTILHADA=1)?
+    partilhado = ler_frame("metas", texto_versao)
+    if partilhado is not None:
+        df, guardado_em = partilhado
+        linhas = df.astype(object).where(df.notna(), None).to_dict("records")
+        _linhas_metas = (guardado_em, versao, linhas)
+        return linhas
+
+    with span("supabase_metas"):
+        response = supabase.table("Metas").select("*").execute()
+    if not response.data:
+        raise Exception("Metas não encontradas no Supabase (tabela 'Metas' está vazia?)")
+    _linhas_metas = (time.time(), versao, response.data)
+    guardar_frame("metas", pd.DataFrame(response.data), METAS_TTL, texto_versao)
+    return response.data
+
+def _inicio_vigencia(data: Optional[str]) -> str:
+    """Início do período de pagamento (26 a 25) que contém a data (por defeito, hoje)."""
+    return calcular_periodo_pagamento(data or datetime.date.today().isoformat())[0]
+
+def _linha_vigente(linhas: List[Dict[str, Any]], tipo_colaborador: str, inicio_periodo: str) -> Optional[Dict[str, Any]]:
+    candidatas = [
+        linha for linha in linhas
+        if linha.get("tipo_colaborador") == tipo_colaborador and (linha.get("vigente_desde") or "") <= inicio_periodo
+    ]
+    if not candidatas:
+        return None
+    # Mais recente; no mesmo vigente_desde, a última inserida
+    return max(candidatas, key=lambda linha: (linha.get("vigente_desde") or "", linha.get("id") or 0))
+
+def _resolver_metas(linhas: List[Dict[str, Any]], inicio_periodo: str) -> Dict[str, Any]:
+    m_data = _linha_vigente(linhas, "MOTORISTA", inicio_periodo)
+    a_data = _linha_vigente(linhas, "AJUDANTE", inicio_periodo)
+    if m_data is None or a_data is None:
+        raise Exception(f"Sem metas vigentes em {inicio_periodo}")
+    metas = _formatar_metas(m_data, a_data)
+    conteudo = json.dumps(metas, sort_keys=True)
+    metas["versao"] = hashlib.sha1(conteudo.encode("utf-8")).hexdigest()[:12]
+    metas["vigente_desde"] = max(m_data.get("vigente_desde") or "", a_data.get("vigente_desde") or "") or None
+    return metas
+
+def _get_metas_sincrono(supabase: Client, data: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Metas vigentes no período de pagamento que contém a data (por defeito,
+    hoje), com a 'versao' (para as chaves de cache) e o 'vigente_desde'.
+    Uma data inválida conta como hoje.
     """
     try:
-        # 1. Busca os dados
-        response_motorista = supabase.table("Metas").select("*").eq("tipo_colaborador", "MOTORISTA").execute()
-        response_ajudante = supabase.table("Metas").select("*").eq("tipo_colaborador", "AJUDANTE").execute()
-
-        if not response_motorista.data or not response_ajudante.data:
-            raise Exception("Metas não encontradas no Supabase (tabela 'Metas' está vazia?)")
-
-        m_data = response_motorista.data[0]
-        a_data = response_ajudante.data[0]
-
-        # 2. Formata os dados para o template
-        metas = {
-            "motorista": {
-                "dev_pdv_meta_perc": float(m_data["dev_pdv_meta_perc"]),
-                "dev_pdv_meta": f"{float(m_data['dev_pdv_meta_perc']):.2f}%", 
-                "dev_pdv_premio": float(m_data["dev_pdv_premio"]),
-                
-                "rating_meta_perc": float(m_data["rating_meta_perc"]),
-                "rating_meta": f"{float(m_data['rating_meta_perc']):.2f}%", 
-                "rating_premio": float(m_data["rating_premio"]),
-                
-                "refugo_meta_perc": float(m_data["refugo_meta_perc"]),
-                "refugo_meta": f"{float(m_data['refugo_meta_perc']):.1f}%", 
-                "refugo_premio": float(m_data["refugo_premio"]),
-                
-                # --- CORRIGIDO: Lê as metas de caixa (nomes genéricos) ---
-                # Vamos ler do motorista, assumindo que são iguais
-                "meta_cx_dias_n1": int(m_data.get("meta_cx_dias_n1", 365)),
-                "meta_cx_valor_n1": float(m_data.get("meta_cx_valor_n1", 0)),
-                "meta_cx_dias_n2": int(m_data.get("meta_cx_dias_n2", 730)),
-                "meta_cx_valor_n2": float(m_data.get("meta_cx_valor_n2", 0)),
-                "meta_cx_dias_n3": int(m_data.get("meta_cx_dias_n3", 1825)),
-                "meta_cx_valor_n3": float(m_data.get("meta_cx_valor_n3", 0)),
-                "meta_cx_dias_n4": int(m_data.get("meta_cx_dias_n4", 9999)), 
-                "meta_cx_valor_n4": float(m_data.get("meta_cx_valor_n4", 0)), 
-            },
-            "ajudante": {
-                "dev_pdv_meta_perc": float(a_data["dev_pdv_meta_perc"]),
-                "dev_pdv_meta": f"{float(a_data['dev_pdv_meta_perc']):.2f}%", 
-                "dev_pdv_premio": float(a_data["dev_pdv_premio"]),
-                
-                "rating_meta_perc": float(a_data["rating_meta_perc"]),
-                "rating_meta": f"{float(a_data['rating_meta_perc']):.2f}%", 
-                "rating_premio": float(a_data["rating_premio"]),
-                
-                "refugo_meta_perc": float(a_data["refugo_meta_perc"]),
-                "refugo_meta": f"{float(a_data['refugo_meta_perc']):.1f}%", 
-                "refugo_premio": float(a_data["refugo_premio"]),
-                
-                # --- CORRIGIDO: Lê as metas de caixa (nomes genéricos) ---
-                "meta_cx_dias_n1": int(a_data.get("meta_cx_dias_n1", 365)),
-                "meta_cx_valor_n1": float(a_data.get("meta_cx_valor_n1", 0)),
-                "meta_cx_dias_n2": int(a_data.get("meta_cx_dias_n2", 730)),
-                "meta_cx_valor_n2": float(a_data.get("meta_cx_valor_n2", 0)),
-                "meta_cx_dias_n3": int(a_data.get("meta_cx_dias_n3", 1825)),
-                "meta_cx_valor_n3": float(a_data.get("meta_cx_valor_n3", 0)),
-                "meta_cx_dias_n4": int(a_data.get("meta_cx_dias_n4", 9999)), 
-                "meta_cx_valor_n4": float(a_data.get("meta_cx_valor_n4", 0)), 
-            }
-        }
-        return metas
+        inicio_periodo = _inicio_vigencia(data)
+    except ValueError:
+        inicio_periodo = _inicio_vigencia(None)
+    try:
+        return _resolver_metas(_ler_linhas_metas(supabase), inicio_periodo)
+    except SupabaseOcupado:
+        raise
+    except Exception as e:
+        print(f"Erro ao buscar metas: {e}")
+        return {**_get_default_metas(), "versao": "padrao", "vigente_desde": None}
 
+def versoes_metas_sincrono(supabase: Client) -> List[str]:
+    """Datas (vigente_desde) das versões gravadas, da mais recente para a mais antiga."""
+    try:
+        linhas = _ler_linhas_metas(supabase)
+    except SupabaseOcupado:
+        raise
     except Exception as e:
         print(f"Erro ao buscar metas: {e}")
-        return _get_default_metas()
+        return []
+    return sorted({linha.get("vigente_desde") or "" for linha in linhas}, reverse=True)
 
+def _gravar_versao_sincrono(supabase: Client, tipo_colaborador: str, vigente_desde: str, dados: Dict[str, Any]):
+    """
+    Grava a versão (tipo_colaborador, vigente_desde): atualiza-a se já
+    existir, senão insere uma linha nova. As outras versões não mudam.
+    """
+    response = (
+        supabase.table("Metas")
+        .update(dados)
+        .eq("tipo_colaborador", tipo_colaborador)
+        .eq("vigente_desde", vigente_desde)
+        .execute()
+    )
+    if not response.data:
+        supabase.table("Metas").insert({
+            "tipo_colaborador": tipo_colaborador, "vigente_desde": vigente_desde, **dados
+        }).execute()
 
-@router.get("/metas", response_class=HTMLResponse)
-async def ler_relatorio_metas(
-    request: Request,
-    supabase: Client = Depends(get_supabase) # Injeta o Supabase
+
+async def _pagina_metas(
+    request: Request, supabase: Client, data: Optional[str],
+    error_message: Optional[str] = None, status_code: int = 200
 ):
-    
-    metas = await run_in_threadpool(_get_metas_sincrono, supabase)
+    try:
+        vigente_desde = _inicio_vigencia(data)
+    except ValueError:
+        vigente_desde, data = _inicio_vigencia(None), None
+
+    metas = await run_in_threadpool(_get_metas_sincrono, supabase, data)
+    versoes = await run_in_threadpool(versoes_metas_sincrono, supabase)
 
-    return templates.TemplateResponse("index.html", {
-        "request": request, 
+    return render_pagina(request, {
         "main_tab": "metas",
         "metas": metas,
+        "metas_vigente_desde": vigente_desde,
+        "metas_versoes": versoes,
         "data_inicio_selecionada": datetime.date.today().isoformat(),
         "data_fim_selecionada": datetime.date.today().isoformat(),
-        "view_mode": "equipas_fixas",
-        "incentivo_tab": "motoristas",
-        "search_query": "",
-        "error_message": None,
-        "resumo_viagens": [],
-        "dashboard_equipas": [],
-        "incentivo_motoristas": [],
-        "incentivo_ajudantes": [],
-        "caixas_tab": "motoristas",
-    })
+        "error_message": error_message,
+    }, status_code=status_code)
+
+@router.get("/metas", response_class=HTMLResponse)
+async def ler_relatorio_metas(
+    request: Request,
+    data: Optional[str] = None,
+    supabase: Client = Depends(get_supabase) # Injeta o Supabase
+):
+    return await _pagina_metas(request, supabase, data)
 
 # --- ALTERAÇÃO: Rota POST agora salva no Supabase ---
 @router.post("/metas")
@@ -169,9 +270,27 @@ async def salvar_metas(
     meta_cx_dias_n3: int = Form(...),
     meta_cx_valor_n3: float = Form(...),
     meta_cx_dias_n4: int = Form(...),
-    meta_cx_valor_n4: float = Form(...)
+    meta_cx_valor_n4: float = Form(...),
+
+    # Período a partir do qual as metas valem (por defeito, o atual)
+    vigente_desde: Optional[str] = Form(None)
 ):
     
+    try:
+        vigente_desde = _inicio_vigencia(vigente_desde)
+    except ValueError:
+        print(f"Data de vigência inválida: '{vigente_desde}'")
+        return RedirectResponse(url="/metas", status_code=303)
+
+    # Os resultados dos períodos fechados já não mudam (e ficam em cache sem prazo)
+    if periodo_fechado(calcular_periodo_pagamento(vigente_desde)[1]):
+        print(f"Metas vigentes desde {vigente_desde} recusadas: o período já fechou")
+        return await _pagina_metas(
+            request, supabase, vigente_desde,
+            f"O período que começa em {vigente_desde} já fechou: as metas só podem valer a partir de um período aberto.",
+            status_code=409
+        )
+
     try:
         # 1. Monta os dados para o UPDATE
         
@@ -209,25 +328,22 @@ async def salvar_metas(
         }
         dados_ajudante.update(dados_caixas_comuns) # Adiciona os valores comuns
 
-        # 4. Executa o UPDATE no Supabase
-        await run_in_threadpool(
-            supabase.table("Metas")
-            .update(dados_motorista)
-            .eq("tipo_colaborador", "MOTORISTA")
-            .execute
-        )
+        # 4. Grava a versão no Supabase (as versões anteriores ficam intactas)
+        for tipo, dados in (("MOTORISTA", dados_motorista), ("AJUDANTE", dados_ajudante)):
+            await run_in_threadpool(_gravar_versao_sincrono, supabase, tipo, vigente_desde, dados)
         
-        await run_in_threadpool(
-            supabase.table("Metas")
-            .update(dados_ajudante)
-            .eq("tipo_colaborador", "AJUDANTE")
-            .execute
-        )
+        print(f"--- METAS VIGENTES DESDE {vigente_desde} SALVAS NO SUPABASE COM SUCESSO ---")
         
-        print("--- METAS (COMUNS E INDICADORES) SALVAS NO SUPABASE COM SUCESSO ---")
+        # Os ETags mudam; os resultados em cache não precisam de ser apagados,
+        # porque as chaves incluem a versão das metas de cada período
+        marcar_alteracao()
 
+    except SupabaseOcupado:
+        raise
     except Exception as e:
         print(f"Erro ao salvar metas: {e}")
+    finally:
+        _esquecer_metas()
     
     # Redireciona de volta para a página de metas
-    return RedirectResponse(url="/metas", status_code=303)
+    return RedirectResponse(url=f"/metas?data={vigente_desde}", status_code=303)
@@ -1,16 +1,19 @@
+import os
+import time
+import asyncio
+import functools
 import datetime
 import pandas as pd
 import io
+from collections import defaultdict
 from fastapi import APIRouter, Request, Depends
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import StreamingResponse
-from typing import Optional, Dict, Any
+from fastapi.responses import StreamingResponse, JSONResponse
+from typing import Optional, Dict, Any, List, Tuple
 from fastapi.concurrency import run_in_threadpool
 from supabase import Client
 
 # Importa as funções de base de dados
 from core.database import (
-    get_dados_apurados, 
     get_cadastro_sincrono, 
     get_caixas_sincrono,
     get_indicadores_sincrono # <--- Importar esta
@@ -20,81 +23,85 @@ from .incentivo import processar_incentivos_sincrono
 from .caixas import processar_caixas_sincrono
 # Importa a função que busca as metas
 from .metas import _get_metas_sincrono
+from core.render import render_pagina
+from core.cache import CacheResultados
+from core.periodo import resolver_datas_filtro, calcular_periodo_pagamento, periodos_pagamento, periodo_fechado
+from core.http_cache import validar_pedido, validar_versao
+from core.processos import executar_calculo
+from core.metricas import medir, span
+from core.versoes import versao_fontes_sincrono, HOJE
+from core.viagens import obter_viagens
+from core.tarefas import submeter, escrever_excel, FilaCheia
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+
+# Resultados por período (data_inicio, data_fim, versão das metas), partilhados entre página, fragmentos e exportação
+# (TTLs configuráveis em CACHE_TTL_PAGAMENTO)
+cache_pagamento = CacheResultados("pagamento")
+
+# Histórico por colaborador (/pagamento/historico): períodos de pagamento
+# calculados em simultâneo e número máximo de períodos por pedido
+CALCULOS_HISTORICO = int(os.environ.get("CALCULOS_HISTORICO", 3))
+MAX_PERIODOS_HISTORICO = 24
 
 def get_supabase(request: Request) -> Client:
     return request.state.supabase
 
 # --- NOVA FUNÇÃO HELPER: BUSCAR TODOS OS DADOS ---
 # (Para evitar repetir código nas duas rotas)
-async def _get_dados_completos(data_inicio: str, data_fim: str, supabase: Client) -> Dict[str, Any]:
+def _get_dados_completos_sincrono(data_inicio: str, data_fim: str, supabase: Client, metas: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Busca todos os DataFrames necessários para os cálculos.
+    Busca todos os DataFrames necessários para os cálculos (as metas
+    vigentes no período já vêm resolvidas).
     """
     hoje = datetime.date.today()
     
-    # Lógica de período de pagamento (copiada de incentivo.py)
+    # Lógica de período de pagamento (26 a 25)
     try:
-        user_date_obj = datetime.date.fromisoformat(data_inicio)
-        dia_corte = 26
-        if user_date_obj.day < dia_corte:
-            data_fim_periodo = user_date_obj.replace(day=25)
-            data_inicio_periodo = (user_date_obj.replace(day=1) - datetime.timedelta(days=1)).replace(day=dia_corte)
-        else:
-            data_inicio_periodo = user_date_obj.replace(day=dia_corte)
-            data_fim_periodo = (data_inicio_periodo + datetime.timedelta(days=32)).replace(day=25)
-        data_inicio_periodo_str = data_inicio_periodo.isoformat()
-        data_fim_periodo_str = data_fim_periodo.isoformat()
+        data_inicio_periodo_str, data_fim_periodo_str = calcular_periodo_pagamento(data_inicio)
     except ValueError:
         data_inicio_periodo_str = data_inicio
         data_fim_periodo_str = data_fim
 
-    # 1. Buscar Metas
-    metas = await run_in_threadpool(_get_metas_sincrono, supabase)
-    
     # 2. Buscar Viagens (Tabela Distribuição)
-    df_viagens, error_viagens = await run_in_threadpool(
-        get_dados_apurados, supabase, data_inicio, data_fim, ""
-    )
+    armazem, error_viagens = obter_viagens(supabase, data_inicio, data_fim)
     
     # 3. Buscar Cadastro (Nomes, CPFs, Datas Admissão)
-    df_cadastro, error_cadastro = await run_in_threadpool(get_cadastro_sincrono, supabase)
+    df_cadastro, error_cadastro = get_cadastro_sincrono(supabase)
     
     # 4. Buscar Indicadores (KPIs)
-    df_indicadores, error_kpis = await run_in_threadpool(
-        get_indicadores_sincrono, supabase, data_inicio_periodo_str, data_fim_periodo_str
-    )
+    df_indicadores, error_kpis = get_indicadores_sincrono(supabase, data_inicio_periodo_str, data_fim_periodo_str)
     
     # 5. Buscar Caixas
-    df_caixas, error_caixas = await run_in_threadpool(
-        get_caixas_sincrono, supabase, data_inicio, data_fim
-    )
+    df_caixas, error_caixas = get_caixas_sincrono(supabase, data_inicio, data_fim)
     
     # Verifica o primeiro erro encontrado
     error_message = error_viagens or error_cadastro or error_kpis or error_caixas
 
-    # IMPORTANTE: Remover duplicados de df_viagens (para Incentivo/Xadrez)
-    # Criamos uma cópia para não afetar o cálculo de caixas
-    df_viagens_dedup = None
-    if df_viagens is not None:
-        if 'MAPA' in df_viagens.columns:
-            df_viagens_dedup = df_viagens.drop_duplicates(subset=['MAPA'])
-        else:
-            df_viagens_dedup = df_viagens.drop_duplicates()
+    # Vistas do armazém partilhado: todas as linhas (para Caixas), sem
+    # duplicados por MAPA e ajudantes em formato longo (para Incentivo/Xadrez)
+    df_viagens, df_viagens_dedup, df_melted = None, None, None
+    if armazem is not None:
+        df_viagens = armazem.viagens(data_inicio, data_fim)
+        df_viagens_dedup = armazem.sem_duplicados(data_inicio, data_fim)
+        df_melted = armazem.ajudantes(data_inicio, data_fim)
 
     return {
         "metas": metas,
         "df_viagens_bruto": df_viagens, # Para Caixas
         "df_viagens_dedup": df_viagens_dedup, # Para KPIs
+        "df_melted": df_melted,
         "df_cadastro": df_cadastro,
         "df_indicadores": df_indicadores,
         "df_caixas": df_caixas,
         "error_message": error_message
     }
 
+async def _get_dados_completos(data_inicio: str, data_fim: str, supabase: Client, metas: Dict[str, Any]) -> Dict[str, Any]:
+    return await run_in_threadpool(_get_dados_completos_sincrono, data_inicio, data_fim, supabase, metas)
+
 # --- NOVA FUNÇÃO HELPER: FUNDIR OS RESULTADOS ---
+@medir("merge_pagamento")
 def _merge_resultados(
     motoristas_kpi: list, ajudantes_kpi: list,
     motoristas_caixas: list, ajudantes_caixas: list
@@ -139,6 +146,239 @@ def _merge_resultados(
 
     return df_motoristas_final, df_ajudantes_final
 
+# --- ÍNDICE POR COLABORADOR (para o histórico) ---
+_KPIS = ("dev_pdv", "rating", "refugo")
+
+def _texto(valor) -> str:
+    return "" if valor is None or (isinstance(valor, float) and pd.isna(valor)) else str(valor)
+
+@medir("indexar_pagamento")
+def _indexar_colaboradores(
+    motoristas_kpi: list, ajudantes_kpi: list,
+    motoristas_caixas: list, ajudantes_caixas: list,
+    df_viagens_dedup: Optional[pd.DataFrame], df_melted: Optional[pd.DataFrame]
+) -> Dict[str, Dict[int, Dict[str, Any]]]:
+    """
+    Ficha de cada colaborador no período (viagens, equipa fixa, KPIs,
+    caixas e total a pagar), por tipo e código. Guardada com o resultado do
+    período, para que o histórico de um colaborador leia só a sua ficha.
+    """
+    viagens = {
+        "motorista": df_viagens_dedup['COD'].value_counts().to_dict() if df_viagens_dedup is not None else {},
+        "ajudante": df_melted['AJUDANTE_COD'].value_counts().to_dict() if df_melted is not None else {},
+    }
+    nomes_motoristas = {int(m["cod"]): m["nome"] for m in motoristas_kpi}
+    ajudantes_fixos = defaultdict(list)
+    for ajudante in ajudantes_kpi:
+        if ajudante.get("motorista_fixo") is not None:
+            ajudantes_fixos[int(ajudante["motorista_fixo"])].append({"cod": int(ajudante["cod"]), "nome": ajudante["nome"]})
+
+    def equipa(tipo: str, cod: int, linha_kpi: Optional[dict]):
+        if tipo == "motorista":
+            return ajudantes_fixos.get(cod, [])
+        fixo = linha_kpi.get("motorista_fixo") if linha_kpi else None
+        return {"cod": int(fixo), "nome": nomes_motoristas.get(int(fixo), "")} if fixo is not None else None
+
+    indice = {}
+    for tipo, linhas_kpi, linhas_caixas in (
+        ("motorista", motoristas_kpi, motoristas_caixas),
+        ("ajudante", ajudantes_kpi, ajudantes_caixas),
+    ):
+        fichas = {}
+        kpi_por_cod = {int(linha["cod"]): linha for linha in linhas_kpi}
+        caixas_por_cod = {int(linha["cod"]): linha for linha in linhas_caixas}
+        for cod in list(kpi_por_cod) + [c for c in caixas_por_cod if c not in kpi_por_cod]:
+            linha_kpi, linha_caixas = kpi_por_cod.get(cod), caixas_por_cod.get(cod)
+            base = linha_kpi or linha_caixas
+            premio_kpi = float(linha_kpi["total_premio"]) if linha_kpi else 0.0
+            premio_caixas = float(linha_caixas["total_premio"]) if linha_caixas else 0.0
+            fichas[cod] = {
+                "cod": cod,
+                "nome": _texto(base["nome"]),
+                "cpf": _texto(base["cpf"]),
+                "viagens": int(viagens[tipo].get(cod, 0)),
+                "equipa": equipa(tipo, cod, linha_kpi),
+                "kpis": {
+                    kpi: {
+                        "valor": linha_kpi[f"{kpi}_val"],
+                        "passou": bool(linha_kpi[f"{kpi}_passou"]),
+                        "premio": float(linha_kpi[f"{kpi}_premio_val"]),
+                    } for kpi in _KPIS
+                } if linha_kpi else None,
+                "premio_kpi": premio_kpi,
+                "total_caixas": float(linha_caixas["total_caixas"]) if linha_caixas else 0.0,
+                "valor_por_caixa": float(linha_caixas["valor_por_caixa"]) if linha_caixas else None,
+                "premio_caixas": premio_caixas,
+                "total_a_pagar": premio_kpi + premio_caixas,
+            }
+        indice[tipo] = fichas
+    return indice
+
+# --- NOVA FUNÇÃO HELPER: CÁLCULO COMPLETO DO PAGAMENTO ---
+# (Partilhada pela página, pelos fragmentos e pela exportação; a exportação
+# em segundo plano usa a versão síncrona, na thread da tarefa)
+def _pagamento_vazio(dados: Dict[str, Any]) -> Dict[str, Any]:
+    # Sem viagens no período (ou erro ao buscá-las) não há nada a calcular
+    vazio = pd.DataFrame(columns=['cod', 'nome', 'cpf', 'premio_kpi', 'premio_caixas', 'total_a_pagar'])
+    return {
+        "df_motoristas": vazio,
+        "df_ajudantes": vazio.copy(),
+        "pagamento_motoristas": [],
+        "pagamento_ajudantes": [],
+        "por_colaborador": {"motorista": {}, "ajudante": {}},
+        "metas": dados["metas"],
+        "error_message": dados["error_message"],
+    }
+
+def _montar_pagamento(dados: Dict[str, Any], kpi: Tuple[list, list], caixas: Tuple[list, list]) -> Dict[str, Any]:
+    """Funde os KPIs e as caixas e indexa as fichas por colaborador."""
+    (motoristas_kpi, ajudantes_kpi), (motoristas_caixas, ajudantes_caixas) = kpi, caixas
+
+    # 4. Fundir os resultados
+    df_motoristas, df_ajudantes = _merge_resultados(
+        motoristas_kpi, ajudantes_kpi,
+        motoristas_caixas, ajudantes_caixas
+    )
+
+    # 5. Fichas por colaborador (histórico)
+    por_colaborador = _indexar_colaboradores(
+        motoristas_kpi, ajudantes_kpi, motoristas_caixas, ajudantes_caixas,
+        dados["df_viagens_dedup"], dados["df_melted"]
+    )
+
+    return {
+        "df_motoristas": df_motoristas, # Para a exportação Excel
+        "df_ajudantes": df_ajudantes,
+        "pagamento_motoristas": df_motoristas.to_dict('records'),
+        "pagamento_ajudantes": df_ajudantes.to_dict('records'),
+        "por_colaborador": por_colaborador,
+        "metas": dados["metas"],
+        "error_message": dados["error_message"],
+    }
+
+async def _calcular_pagamento(
+    supabase: Client, data_inicio_filtro: str, data_fim_filtro: str, metas: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Busca os dados, processa KPIs e caixas e funde os resultados das duas
+    sub-abas (motoristas e ajudantes).
+    """
+    # 1. Buscar todos os dados
+    dados = await _get_dados_completos(data_inicio_filtro, data_fim_filtro, supabase, metas)
+    if dados["df_viagens_bruto"] is None:
+        return _pagamento_vazio(dados)
+    
+    # 2 e 3. Processar KPIs (Incentivo, com o df_viagens_dedup) e Caixas
+    # (com o df_viagens_bruto). São independentes: com o pool de processos
+    # ativo correm em paralelo.
+    kpi, caixas = await asyncio.gather(
+        executar_calculo(
+            processar_incentivos_sincrono,
+            dados["df_viagens_dedup"], dados["df_cadastro"], 
+            dados["df_indicadores"], dados["metas"], dados["df_melted"]
+        ),
+        executar_calculo(
+            processar_caixas_sincrono,
+            dados["df_viagens_bruto"], dados["df_cadastro"], 
+            dados["df_caixas"], dados["metas"]
+        ),
+    )
+    return await run_in_threadpool(_montar_pagamento, dados, kpi, caixas)
+
+def _calcular_pagamento_sincrono(
+    supabase: Client, data_inicio_filtro: str, data_fim_filtro: str, metas: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Como _calcular_pagamento, todo na thread em curso (KPIs e caixas em série)."""
+    dados = _get_dados_completos_sincrono(data_inicio_filtro, data_fim_filtro, supabase, metas)
+    if dados["df_viagens_bruto"] is None:
+        return _pagamento_vazio(dados)
+    kpi = processar_incentivos_sincrono(
+        dados["df_viagens_dedup"], dados["df_cadastro"],
+        dados["df_indicadores"], dados["metas"], dados["df_melted"]
+    )
+    caixas = processar_caixas_sincrono(
+        dados["df_viagens_bruto"], dados["df_cadastro"],
+        dados["df_caixas"], dados["metas"]
+    )
+    return _montar_pagamento(dados, kpi, caixas)
+
+async def _obter_pagamento(
+    supabase: Client, data_inicio_filtro: str, data_fim_filtro: str, versao: Optional[str] = None
+) -> Dict[str, Any]:
+    # Chave com a versão das metas vigentes no período: um período fechado
+    # não muda e fica em cache sem prazo
+    metas = await run_in_threadpool(_get_metas_sincrono, supabase, data_inicio_filtro)
+    return await cache_pagamento.obter_ou_calcular(
+        (data_inicio_filtro, data_fim_filtro, metas["versao"]),
+        lambda: _calcular_pagamento(supabase, data_inicio_filtro, data_fim_filtro, metas),
+        versao=versao,
+        permanente=periodo_fechado(data_fim_filtro)
+    )
+
+async def _em_cache(chave) -> Optional[Dict[str, Any]]:
+    return cache_pagamento.obter(chave)
+
+def _obter_pagamento_sincrono(
+    supabase: Client, data_inicio_filtro: str, data_fim_filtro: str,
+    versao: Optional[str], loop: asyncio.AbstractEventLoop
+) -> Dict[str, Any]:
+    """
+    Versão de _obter_pagamento para as threads das exportações: usa o
+    resultado em cache se for desta versão dos dados; senão calcula na thread
+    e guarda-o na cache. A cache só é lida e escrita pelo event loop (não é
+    partilhada entre threads).
+    """
+    metas = _get_metas_sincrono(supabase, data_inicio_filtro)
+    chave = (data_inicio_filtro, data_fim_filtro, metas["versao"])
+    guardado = asyncio.run_coroutine_threadsafe(_em_cache(chave), loop).result()
+    if guardado is not None and (versao is None or guardado["versao_dados"] == versao):
+        return guardado
+
+    inicio = time.time()
+    resultado = _calcular_pagamento_sincrono(supabase, data_inicio_filtro, data_fim_filtro, metas)
+    if not resultado.get("error_message"):
+        loop.call_soon_threadsafe(functools.partial(
+            cache_pagamento.guardar, chave, resultado, versao,
+            guardado_em=inicio, permanente=versao is not None and periodo_fechado(data_fim_filtro)
+        ))
+    return resultado
+
+async def _obter_pagamentos(
+    supabase: Client, periodos: List[Tuple[str, str]], versao: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Resultados de vários períodos. Os que não estão em cache (com esta
+    versão dos dados) são calculados a partir de uma só leitura da
+    Distribuição por sequência de períodos seguidos em falta (o armazém de
+    viagens que cobre a sequência serve cada período).
+    """
+    sequencias, anterior = [], None
+    for i, periodo in enumerate(periodos):
+        metas = await run_in_threadpool(_get_metas_sincrono, supabase, periodo[0])
+        guardado = cache_pagamento.obter((*periodo, metas["versao"]))
+        if guardado is not None and (versao is None or guardado["versao_dados"] == versao):
+            continue
+        if anterior == i - 1 and sequencias:
+            sequencias[-1][1] = periodo[1]
+        else:
+            sequencias.append([periodo[0], periodo[1]])
+        anterior = i
+    await asyncio.gather(*(
+        run_in_threadpool(obter_viagens, supabase, inicio, fim) for inicio, fim in sequencias
+    ))
+
+    limite = asyncio.Semaphore(CALCULOS_HISTORICO)
+
+    async def obter(periodo):
+        async with limite:
+            return await _obter_pagamento(supabase, *periodo, versao)
+
+    return await asyncio.gather(*(obter(periodo) for periodo in periodos))
+
+# Tabelas de que o relatório depende (versão para o ETag, ver core/versoes.py);
+# a antiguidade (caixas) é contada até hoje
+FONTES_PAGAMENTO = ["Distribuição", "Cadastro", "Resultados_Indicadores", "Caixas", "Metas", HOJE]
+
 # --- ROTA 1: Exibir Resumo no Ecrã ---
 @router.get("/pagamento")
 async def ler_relatorio_pagamento(
@@ -148,58 +388,57 @@ async def ler_relatorio_pagamento(
     pagamento_tab: str = "motoristas", # Nova aba
     supabase: Client = Depends(get_supabase)
 ):
-    hoje = datetime.date.today()
-    data_inicio_filtro = data_inicio or hoje.replace(day=1).isoformat()
-    data_fim_filtro = data_fim or hoje.isoformat()
+    data_inicio_filtro, data_fim_filtro = resolver_datas_filtro(data_inicio, data_fim)
 
-    # 1. Buscar todos os dados
-    dados = await _get_dados_completos(data_inicio_filtro, data_fim_filtro, supabase)
-    
-    # 2. Processar KPIs (Incentivo)
-    # Usamos o df_viagens_dedup aqui
-    motoristas_kpi, ajudantes_kpi = await run_in_threadpool(
-        processar_incentivos_sincrono,
-        dados["df_viagens_dedup"], dados["df_cadastro"], 
-        dados["df_indicadores"], dados["metas"]
-    )
-    
-    # 3. Processar Caixas
-    # Usamos o df_viagens_bruto aqui
-    motoristas_caixas, ajudantes_caixas = await run_in_threadpool(
-        processar_caixas_sincrono,
-        dados["df_viagens_bruto"], dados["df_cadastro"], 
-        dados["df_caixas"], dados["metas"]
-    )
-    
-    # 4. Fundir os resultados
-    df_motoristas, df_ajudantes = _merge_resultados(
-        motoristas_kpi, ajudantes_kpi,
-        motoristas_caixas, ajudantes_caixas
-    )
+    validacao = await validar_pedido(request, supabase, FONTES_PAGAMENTO)
+    if validacao.resposta_304 is not None:
+        return validacao.resposta_304
 
-    return templates.TemplateResponse("index.html", {
-        "request": request, 
+    resultado = await _obter_pagamento(supabase, data_inicio_filtro, data_fim_filtro, validacao.versao)
+
+    return render_pagina(request, {
         "main_tab": "pagamento", # <-- Define a aba ativa
         "pagamento_tab": pagamento_tab, # <-- Aba de motorista/ajudante
         "data_inicio_selecionada": data_inicio_filtro,
         "data_fim_selecionada": data_fim_filtro,
-        "error_message": dados["error_message"],
-        "pagamento_motoristas": df_motoristas.to_dict('records'),
-        "pagamento_ajudantes": df_ajudantes.to_dict('records'),
-        
-        # --- (Dados para o template não falhar) ---
-        "metas": dados["metas"],
-        "incentivo_tab": "motoristas",
-        "caixas_tab": "motoristas",
-        "view_mode": "equipas_fixas", 
-        "search_query": "",
-        "resumo_viagens": [],
-        "dashboard_equipas": [],
-        "incentivo_motoristas": [],
-        "incentivo_ajudantes": [],
-        "caixas_motoristas": [],
-        "caixas_ajudantes": [],
-    })
+        **resultado,
+    }, headers=validacao.cabecalhos(resultado))
+
+# --- Fragmento: só a tabela da sub-aba (troca motoristas/ajudantes sem recarregar) ---
+@router.get("/pagamento/fragmento")
+async def ler_fragmento_pagamento(
+    request: Request, 
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    pagamento_tab: str = "motoristas",
+    v: Optional[str] = None,
+    supabase: Client = Depends(get_supabase)
+):
+    data_inicio_filtro, data_fim_filtro = resolver_datas_filtro(data_inicio, data_fim)
+
+    # v: versão dos dados da página. Com esse resultado em cache, responde já,
+    # sem ler as versões nem as metas no Supabase
+    resultado = cache_pagamento.obter_da_versao((data_inicio_filtro, data_fim_filtro), v)
+    if resultado is not None:
+        validacao = validar_versao(request, v)
+    else:
+        validacao = await validar_pedido(request, supabase, FONTES_PAGAMENTO)
+    if validacao.resposta_304 is not None:
+        return validacao.resposta_304
+
+    if resultado is None:
+        resultado = await _obter_pagamento(supabase, data_inicio_filtro, data_fim_filtro, validacao.versao)
+
+    sub_aba = 'ajudantes' if pagamento_tab == 'ajudantes' else 'motoristas'
+    return render_pagina(request, {
+        "pagamento_tab": pagamento_tab,
+        "data_inicio_selecionada": data_inicio_filtro,
+        "data_fim_selecionada": data_fim_filtro,
+        **resultado,
+    },
+        nome_template=f"abas/pagamento_{sub_aba}.html",
+        headers=validacao.cabecalhos(resultado)
+    )
 
 # --- ROTA 2: Exportar Resumo para Excel ---
 @router.get("/pagamento/exportar")
@@ -208,38 +447,20 @@ async def exportar_relatorio_pagamento(
     data_fim: Optional[str] = None,
     supabase: Client = Depends(get_supabase)
 ):
-    hoje = datetime.date.today()
-    data_inicio_filtro = data_inicio or hoje.replace(day=1).isoformat()
-    data_fim_filtro = data_fim or hoje.isoformat()
+    data_inicio_filtro, data_fim_filtro = resolver_datas_filtro(data_inicio, data_fim)
 
-    # 1. Buscar todos os dados
-    dados = await _get_dados_completos(data_inicio_filtro, data_fim_filtro, supabase)
-
-    # 2. Processar KPIs (Incentivo)
-    motoristas_kpi, ajudantes_kpi = await run_in_threadpool(
-        processar_incentivos_sincrono,
-        dados["df_viagens_dedup"], dados["df_cadastro"], 
-        dados["df_indicadores"], dados["metas"]
-    )
-    
-    # 3. Processar Caixas
-    motoristas_caixas, ajudantes_caixas = await run_in_threadpool(
-        processar_caixas_sincrono,
-        dados["df_viagens_bruto"], dados["df_cadastro"], 
-        dados["df_caixas"], dados["metas"]
-    )
+    # 1. Buscar e calcular (reaproveita o resultado do ecrã, se for da versão atual)
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, FONTES_PAGAMENTO)
+    resultado = await _obter_pagamento(supabase, data_inicio_filtro, data_fim_filtro, versao)
+    df_motoristas, df_ajudantes = resultado["df_motoristas"], resultado["df_ajudantes"]
     
-    # 4. Fundir os resultados
-    df_motoristas, df_ajudantes = _merge_resultados(
-        motoristas_kpi, ajudantes_kpi,
-        motoristas_caixas, ajudantes_caixas
-    )
-    
-    # 5. Gerar o Ficheiro Excel em memória
+    # 2. Gerar o Ficheiro Excel em memória
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df_motoristas.to_excel(writer, sheet_name='Motoristas', index=False)
-        df_ajudantes.to_excel(writer, sheet_name='Ajudantes', index=False)
+    with span("exportar_excel") as s:
+        s.linhas = len(df_motoristas) + len(df_ajudantes)
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            df_motoristas.to_excel(writer, sheet_name='Motoristas', index=False)
+            df_ajudantes.to_excel(writer, sheet_name='Ajudantes', index=False)
     
     output.seek(0)
     
@@ -250,4 +471,90 @@ async def exportar_relatorio_pagamento(
         output,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
\ No newline at end of file
+    )
+
+# --- ROTA 3: Exportar em segundo plano (progresso em /tarefas/{id}/progresso) ---
+@router.post("/pagamento/exportar/tarefas")
+async def criar_tarefa_exportacao_pagamento(
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    supabase: Client = Depends(get_supabase)
+):
+    data_inicio_filtro, data_fim_filtro = resolver_datas_filtro(data_inicio, data_fim)
+
+    loop = asyncio.get_running_loop()
+
+    # Corre no thread pool das exportações (core/tarefas.py), não no das rotas
+    def executar(tarefa, caminho):
+        tarefa.atualizar(etapa="calcular")
+        versao = versao_fontes_sincrono(supabase, FONTES_PAGAMENTO)
+        resultado = _obter_pagamento_sincrono(supabase, data_inicio_filtro, data_fim_filtro, versao, loop)
+        tarefa.verificar_cancelamento()
+        folhas = [("Motoristas", resultado["df_motoristas"]), ("Ajudantes", resultado["df_ajudantes"])]
+        tarefa.atualizar(etapa="escrever_excel", linhas_total=sum(len(df) for _, df in folhas))
+        escrever_excel(caminho, folhas, tarefa)
+
+    try:
+        tarefa = submeter(
+            "pagamento", f"Resumo_Pagamento_{data_inicio_filtro}_ate_{data_fim_filtro}.xlsx", executar
+        )
+    except FilaCheia as e:
+        return JSONResponse({"erro": str(e)}, status_code=503, headers={"Retry-After": "30"})
+
+    return JSONResponse({
+        **tarefa.resumo(),
+        "progresso": f"/tarefas/{tarefa.id}/progresso",
+        "ficheiro": f"/tarefas/{tarefa.id}/ficheiro",
+    }, status_code=202, headers={"Location": f"/tarefas/{tarefa.id}"})
+
+# --- ROTA 4: Histórico de um colaborador (JSON) ---
+@router.get("/pagamento/historico")
+async def historico_colaborador(
+    cod: int,
+    tipo: str = "motorista",
+    periodos: int = 12,
+    data_fim: Optional[str] = None,
+    supabase: Client = Depends(get_supabase)
+):
+    """
+    Ficha do colaborador em cada um dos últimos 'periodos' períodos de
+    pagamento (26 a 25) até ao que contém data_fim (por defeito, hoje).
+    """
+    if tipo not in ("motorista", "ajudante"):
+        return JSONResponse({"erro": "tipo deve ser 'motorista' ou 'ajudante'."}, status_code=400)
+    try:
+        lista = periodos_pagamento(data_fim or datetime.date.today().isoformat(), max(1, min(periodos, MAX_PERIODOS_HISTORICO)))
+    except ValueError:
+        return JSONResponse({"erro": f"Data inválida: '{data_fim}'."}, status_code=400)
+
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, FONTES_PAGAMENTO)
+    resultados = await _obter_pagamentos(supabase, lista, versao)
+
+    historico, nome = [], None
+    for (data_inicio_periodo, data_fim_periodo), resultado in zip(lista, resultados):
+        ficha = resultado.get("por_colaborador", {}).get(tipo, {}).get(cod)
+        nome = ficha["nome"] if ficha else nome
+        historico.append({
+            "data_inicio": data_inicio_periodo,
+            "data_fim": data_fim_periodo,
+            "dados_de": resultado.get("dados_de"),
+            "erro": resultado.get("error_message"),
+            "ficha": ficha,
+        })
+
+    return JSONResponse({
+        "tipo": tipo,
+        "cod": cod,
+        "nome": nome,
+        "periodos": historico,
+        "total_a_pagar": sum(p["ficha"]["total_a_pagar"] for p in historico if p["ficha"]),
+    }, headers={"Cache-Control": "private, max-age=30"})
+
+# --- Aquecimento (chamado no arranque da app, ver main.py) ---
+async def aquecer(supabase: Client, data_inicio_filtro: str, data_fim_filtro: str):
+    """
+    Calcula e guarda na cache o resultado do período, com a mesma chave e
+    versão que a rota usaria.
+    """
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, FONTES_PAGAMENTO)
+    await _obter_pagamento(supabase, data_inicio_filtro, data_fim_filtro, versao)
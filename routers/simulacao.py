@@ -0,0 +1,279 @@
+import datetime
+import itertools
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, Request, Depends, Body
+from fastapi.responses import JSONResponse
+from typing import Optional, Dict, Any, List, Tuple
+from fastapi.concurrency import run_in_threadpool
+from supabase import Client
+
+from core.cache import CacheResultados
+from core.database import get_cadastro_sincrono, get_caixas_sincrono, get_indicadores_sincrono
+from core.metricas import medir, span
+from core.periodo import calcular_periodo_pagamento, periodo_fechado
+from core.processos import executar_calculo
+from core.versoes import versao_fontes_sincrono, HOJE
+from core.viagens import obter_viagens
+from .metas import _get_metas_sincrono
+from .tendencia import _chave_periodo, _incentivo_motoristas, _incentivo_ajudantes, _caixas_por_periodo
+
+router = APIRouter()
+
+# --- SIMULAÇÃO DE METAS (what-if, sem gravar na tabela Metas) ---
+# Para saber quanto custaria o pagamento com outras metas era preciso
+# gravá-las e recarregar. Aqui, para um período de pagamento, guarda-se uma
+# "base" que não depende das metas: os valores de KPI de cada motorista, o
+# motorista fixo de cada ajudante (de quem herda os KPIs) e as caixas e a
+# antiguidade de cada colaborador. Cada cenário é um conjunto de metas; todos
+# os cenários são avaliados de uma vez com arrays (cenários x colaboradores),
+# seguindo as regras do Incentivo e das Caixas.
+
+MAX_CENARIOS = 5000
+_KPIS = ("dev_pdv", "rating", "refugo")
+_SENTIDOS = {"dev_pdv": "<=", "rating": ">=", "refugo": "<="}
+CHAVES_METAS = (
+    [f"{kpi}_meta_perc" for kpi in _KPIS] + [f"{kpi}_premio" for kpi in _KPIS]
+    + [f"meta_cx_dias_n{n}" for n in (1, 2, 3)] + [f"meta_cx_valor_n{n}" for n in (1, 2, 3, 4)]
+)
+# Valores por defeito de _get_valor_por_caixa
+_PADRAO_CX = {"meta_cx_dias_n1": 365, "meta_cx_dias_n2": 730, "meta_cx_dias_n3": 1825}
+# Fontes da base (as metas ficam de fora: entram em cada cenário). A
+# antiguidade depende de hoje; a base de um período fechado só é reaproveitada
+# enquanto a versão destas fontes não mudar.
+FONTES_SIMULACAO = ["Distribuição", "Cadastro", "Resultados_Indicadores", "Caixas", HOJE]
+
+# Base por período de pagamento (muda com as viagens, não com as metas)
+cache_simulacao = CacheResultados("simulacao")
+
+def get_supabase(request: Request) -> Client:
+    return request.state.supabase
+
+# --- Base do período ---
+@medir("base_simulacao")
+def base_simulacao_sincrono(
+    df_viagens: pd.DataFrame,
+    df_cadastro: Optional[pd.DataFrame],
+    df_caixas: Optional[pd.DataFrame],
+    df_indicadores: Optional[pd.DataFrame],
+    data_inicio_periodo: str
+) -> Dict[str, Any]:
+    """
+    Arrays por colaborador (motoristas e ajudantes com prémio de KPI ou de
+    caixas no período) para avaliar qualquer conjunto de metas.
+    """
+    df = df_viagens.copy()
+    df["periodo"] = _chave_periodo(pd.Series([data_inicio_periodo]))[0]
+    dedup = df[~df.duplicated(subset=["periodo", "MAPA"])]
+
+    motoristas_kpi = _incentivo_motoristas(dedup, df_indicadores, {})
+    ajudantes_kpi = _incentivo_ajudantes(dedup, motoristas_kpi, {})
+    motoristas_caixas, ajudantes_caixas = _caixas_por_periodo(df, df_cadastro, df_caixas, {})
+
+    def colaboradores(kpi: pd.DataFrame, caixas: pd.DataFrame) -> pd.DataFrame:
+        tabela = kpi.assign(tem_kpi=True).merge(
+            caixas[["cod", "total_caixas", "dias"]], on="cod", how="outer"
+        )
+        tabela["tem_kpi"] = tabela["tem_kpi"].fillna(False).astype(bool)
+        tabela["total_caixas"] = tabela["total_caixas"].fillna(0.0)
+        tabela["dias"] = tabela["dias"].fillna(0).astype(np.int64)
+        return tabela
+
+    motoristas = colaboradores(motoristas_kpi, motoristas_caixas)
+    ajudantes = colaboradores(ajudantes_kpi, ajudantes_caixas)
+
+    # Ajudante -> posição do motorista fixo no array dos motoristas (-1 se não herda KPIs)
+    posicao = {cod: i for i, (cod, tem_kpi) in enumerate(zip(motoristas["cod"].tolist(), motoristas["tem_kpi"].tolist())) if tem_kpi and cod != 0}
+    fixos = ajudantes["motorista_fixo"].tolist()
+    fixo = np.array([posicao.get(int(f), -1) if pd.notna(f) and f != 0 else -1 for f in fixos], dtype=np.int64)
+
+    return {
+        "motoristas": {
+            "kpis": np.vstack([motoristas[kpi].to_numpy(dtype=float) * 100 for kpi in _KPIS]),
+            "tem_kpi": motoristas["tem_kpi"].to_numpy(),
+            "caixas": motoristas["total_caixas"].to_numpy(dtype=float),
+            "dias": motoristas["dias"].to_numpy(),
+        },
+        "ajudantes": {
+            "fixo": fixo,
+            "tem_kpi": ajudantes["tem_kpi"].to_numpy(),
+            "caixas": ajudantes["total_caixas"].to_numpy(dtype=float),
+            "dias": ajudantes["dias"].to_numpy(),
+        },
+    }
+
+# --- Avaliação dos cenários ---
+def _parametros(cenarios: List[Dict[str, Dict[str, float]]], tipo: str) -> Dict[str, np.ndarray]:
+    """Uma coluna (S, 1) por chave das metas, pronta para broadcasting com (1, N)."""
+    return {
+        chave: np.array([c[tipo].get(chave, _PADRAO_CX.get(chave, 0.0)) for c in cenarios], dtype=float)[:, None]
+        for chave in CHAVES_METAS
+    }
+
+def _premio_caixas(caixas: np.ndarray, dias: np.ndarray, p: Dict[str, np.ndarray]) -> np.ndarray:
+    """total_caixas x valor do escalão de antiguidade (como _get_valor_por_caixa)."""
+    dias = dias[None, :]
+    valor = np.where(
+        dias > p["meta_cx_dias_n3"], p["meta_cx_valor_n4"],
+        np.where(dias > p["meta_cx_dias_n2"], p["meta_cx_valor_n3"],
+                 np.where(dias > p["meta_cx_dias_n1"], p["meta_cx_valor_n2"], p["meta_cx_valor_n1"]))
+    )
+    return caixas[None, :] * valor
+
+@medir("simular_metas")
+def simular_sincrono(base: Dict[str, Any], cenarios: List[Dict[str, Dict[str, float]]]) -> Dict[str, np.ndarray]:
+    """
+    Custo (KPIs, caixas, total) e vencedores (total a pagar > 0) de cada
+    cenário, por tipo de colaborador. Cada cenário tem as metas completas
+    de 'motorista' e 'ajudante'.
+    """
+    m, a = base["motoristas"], base["ajudantes"]
+    pm, pa = _parametros(cenarios, "motorista"), _parametros(cenarios, "ajudante")
+    s = len(cenarios)
+
+    # Motoristas: cada KPI contra a meta do motorista (NaN nunca passa)
+    passou = {}
+    premio_kpi_m = np.zeros((s, len(m["caixas"])))
+    for i, kpi in enumerate(_KPIS):
+        valores = m["kpis"][i][None, :]
+        meta = pm[f"{kpi}_meta_perc"]
+        passou[kpi] = ((valores <= meta) if _SENTIDOS[kpi] == "<=" else (valores >= meta)) & m["tem_kpi"][None, :]
+        premio_kpi_m += np.where(passou[kpi], pm[f"{kpi}_premio"], 0.0)
+
+    # Ajudantes: herdam o resultado do motorista fixo, com os prémios dos ajudantes
+    premio_kpi_a = np.zeros((s, len(a["caixas"])))
+    herda = (a["fixo"] >= 0) & a["tem_kpi"]
+    fixo = np.where(herda, a["fixo"], 0)
+    for kpi in _KPIS:
+        if len(m["caixas"]) == 0:
+            break
+        premio_kpi_a += np.where(passou[kpi][:, fixo] & herda[None, :], pa[f"{kpi}_premio"], 0.0)
+
+    resultado = {}
+    for tipo, premio_kpi, dados, p in (("motoristas", premio_kpi_m, m, pm), ("ajudantes", premio_kpi_a, a, pa)):
+        premio_caixas = _premio_caixas(dados["caixas"], dados["dias"], p)
+        total = premio_kpi + premio_caixas
+        resultado[tipo] = {
+            "custo_kpi": premio_kpi.sum(axis=1),
+            "custo_caixas": premio_caixas.sum(axis=1),
+            "custo_total": total.sum(axis=1),
+            "vencedores": (total > 0).sum(axis=1),
+        }
+    resultado["motoristas"].update({f"vencedores_{kpi}": passou[kpi].sum(axis=1) for kpi in _KPIS})
+    return resultado
+
+# --- Pedido: cenários explícitos e/ou grelha ---
+def _ler_cenarios(pedido: Dict[str, Any], metas: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Dict[str, float]]]]:
+    """
+    Alterações de cada cenário (como vieram no pedido) e as metas completas
+    (metas atuais + alterações). Lança ValueError se o pedido for inválido.
+      "cenarios": [{"motorista": {"dev_pdv_meta_perc": 4}}, ...]
+      "grade": {"motorista.dev_pdv_meta_perc": [3, 4, 5], "ajudante.meta_cx_valor_n1": [0.1, 0.2]}
+    A grelha gera todas as combinações (produto cartesiano).
+    """
+    alteracoes = list(pedido.get("cenarios") or [])
+    grade = pedido.get("grade") or {}
+    if grade:
+        chaves = list(grade)
+        if any(not isinstance(grade[c], list) or not grade[c] for c in chaves):
+            raise ValueError("Cada chave da grelha precisa de uma lista de valores.")
+        total = int(np.prod([len(grade[c]) for c in chaves]))
+        if len(alteracoes) + total > MAX_CENARIOS:
+            raise ValueError(f"Máximo de {MAX_CENARIOS} cenários por pedido ({len(alteracoes) + total} pedidos).")
+        for valores in itertools.product(*(grade[c] for c in chaves)):
+            cenario: Dict[str, Dict[str, float]] = {}
+            for chave, valor in zip(chaves, valores):
+                tipo, _, nome = chave.partition(".")
+                cenario.setdefault(tipo, {})[nome] = valor
+            alteracoes.append(cenario)
+    if not alteracoes:
+        alteracoes = [{}]  # só as metas atuais
+    if len(alteracoes) > MAX_CENARIOS:
+        raise ValueError(f"Máximo de {MAX_CENARIOS} cenários por pedido ({len(alteracoes)} pedidos).")
+
+    completos = []
+    for alteracao in alteracoes:
+        if not isinstance(alteracao, dict):
+            raise ValueError("Cada cenário tem de ser um objeto com 'motorista' e/ou 'ajudante'.")
+        if set(alteracao) - {"motorista", "ajudante"}:
+            raise ValueError(f"Tipos desconhecidos: {sorted(set(alteracao) - {'motorista', 'ajudante'})}")
+        completo = {}
+        for tipo in ("motorista", "ajudante"):
+            mudancas = alteracao.get(tipo) or {}
+            desconhecidas = set(mudancas) - set(CHAVES_METAS)
+            if desconhecidas:
+                raise ValueError(f"Metas desconhecidas em '{tipo}': {sorted(desconhecidas)}")
+            completo[tipo] = {**metas[tipo], **{k: float(v) for k, v in mudancas.items()}}
+        completos.append(completo)
+    return alteracoes, completos
+
+async def _calcular_base(supabase: Client, data_inicio: str, data_fim: str) -> Dict[str, Any]:
+    armazem, error_viagens = await run_in_threadpool(obter_viagens, supabase, data_inicio, data_fim)
+    df_caixas, error_caixas = await run_in_threadpool(get_caixas_sincrono, supabase, data_inicio, data_fim)
+    df_indicadores, error_kpis = await run_in_threadpool(get_indicadores_sincrono, supabase, data_inicio, data_fim)
+    df_cadastro, error_cadastro = await run_in_threadpool(get_cadastro_sincrono, supabase)
+
+    error_message = error_viagens or error_cadastro or error_kpis or error_caixas
+    if armazem is None:
+        return {"base": None, "error_message": error_message}
+    base = await executar_calculo(
+        base_simulacao_sincrono,
+        armazem.viagens(data_inicio, data_fim), df_cadastro, df_caixas, df_indicadores, data_inicio
+    )
+    return {"base": base, "error_message": error_message}
+
+# --- ROTA: Simular metas (JSON) ---
+@router.post("/metas/simular")
+async def simular_metas(
+    pedido: Dict[str, Any] = Body(...),
+    supabase: Client = Depends(get_supabase)
+):
+    """
+    Custo total e vencedores de cada cenário de metas no período de
+    pagamento (26 a 25) que contém pedido["data"] (por defeito, hoje).
+    """
+    try:
+        data_inicio, data_fim = calcular_periodo_pagamento(pedido.get("data") or datetime.date.today().isoformat())
+        metas = await run_in_threadpool(_get_metas_sincrono, supabase, data_inicio)
+        alteracoes, completos = _ler_cenarios(pedido, metas)
+    except (ValueError, TypeError) as e:
+        return JSONResponse({"erro": str(e)}, status_code=400)
+
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, FONTES_SIMULACAO)
+    resultado_base = await cache_simulacao.obter_ou_calcular(
+        (data_inicio, data_fim), lambda: _calcular_base(supabase, data_inicio, data_fim),
+        versao=versao,
+        permanente=periodo_fechado(data_fim)
+    )
+    base = resultado_base["base"]
+    if base is None:
+        return JSONResponse({"erro": resultado_base["error_message"]}, status_code=404)
+
+    # O primeiro cenário avaliado são as metas atuais (referência para as diferenças)
+    with span("simular_cenarios") as s:
+        s.linhas = len(completos)
+        r = await run_in_threadpool(simular_sincrono, base, [metas] + completos)
+
+    def cenario(i: int) -> Dict[str, Any]:
+        return {
+            tipo: {chave: valores[i].item() for chave, valores in r[tipo].items()}
+            for tipo in ("motoristas", "ajudantes")
+        } | {"custo_total": float(r["motoristas"]["custo_total"][i] + r["ajudantes"]["custo_total"][i])}
+
+    atual = cenario(0)
+    cenarios = []
+    for i, alteracao in enumerate(alteracoes, start=1):
+        resumo = cenario(i)
+        resumo["diferenca"] = resumo["custo_total"] - atual["custo_total"]
+        cenarios.append({"metas": alteracao, **resumo})
+
+    return JSONResponse({
+        "data_inicio": data_inicio,
+        "data_fim": data_fim,
+        "dados_de": resultado_base.get("dados_de"),
+        "versao_metas": metas["versao"],
+        "colaboradores": {"motoristas": len(base["motoristas"]["caixas"]), "ajudantes": len(base["ajudantes"]["caixas"])},
+        "atual": atual,
+        "cenarios": cenarios,
+        "erro": resultado_base["error_message"],
+    }, headers={"Cache-Control": "no-store"})
@@ -0,0 +1,54 @@
+from fastapi import APIRouter
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+
+from core.tarefas import obter_tarefa
+
+router = APIRouter()
+
+# --- TAREFAS EM SEGUNDO PLANO (ver core/tarefas.py) ---
+# As rotas que submetem tarefas (ex: POST /pagamento/exportar/tarefas)
+# devolvem o id; o estado, o progresso e o ficheiro lêem-se aqui.
+
+def _nao_encontrada():
+    return JSONResponse(
+        {"erro": "Tarefa não encontrada ou ficheiro expirado."},
+        status_code=404, headers={"Cache-Control": "no-store"}
+    )
+
+# --- Estado atual (JSON) ---
+@router.get("/tarefas/{id_tarefa}")
+async def estado_tarefa(id_tarefa: str):
+    tarefa = obter_tarefa(id_tarefa)
+    if tarefa is None:
+        return _nao_encontrada()
+    return JSONResponse(tarefa.resumo(), headers={"Cache-Control": "no-store"})
+
+# --- Progresso (Server-Sent Events) ---
+@router.get("/tarefas/{id_tarefa}/progresso")
+async def progresso_tarefa(id_tarefa: str):
+    tarefa = obter_tarefa(id_tarefa)
+    if tarefa is None:
+        return _nao_encontrada()
+    return StreamingResponse(
+        tarefa.eventos(),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: o nginx não pode guardar os eventos em buffer
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    )
+
+# --- Ficheiro terminado ---
+@router.get("/tarefas/{id_tarefa}/ficheiro")
+async def ficheiro_tarefa(id_tarefa: str):
+    tarefa = obter_tarefa(id_tarefa)
+    if tarefa is None:
+        return _nao_encontrada()
+    if tarefa.estado == "erro":
+        return JSONResponse({"erro": tarefa.erro}, status_code=500, headers={"Cache-Control": "no-store"})
+    if tarefa.estado != "concluida":
+        return JSONResponse(tarefa.resumo(), status_code=409, headers={"Cache-Control": "no-store"})
+    return FileResponse(
+        tarefa.caminho,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=tarefa.nome_ficheiro,
+        headers={"Cache-Control": "no-store"}
+    )
@@ -0,0 +1,346 @@
+import datetime
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, Request, Depends
+from fastapi.responses import JSONResponse
+from typing import Optional, Dict, Any, List, Tuple
+from fastapi.concurrency import run_in_threadpool
+from supabase import Client
+
+from core.analysis import _preparar_dataframe_ajudantes
+from core.cache import CacheResultados
+from core.database import get_cadastro_sincrono, get_caixas_sincrono, get_indicadores_periodos_sincrono
+from core.metricas import medir
+from core.periodo import periodos_pagamento, periodo_fechado
+from core.processos import executar_calculo
+from core.viagens import obter_viagens
+from core.versoes import versao_fontes_sincrono, HOJE
+from .caixas import _mapas_cadastro, _get_valor_por_caixa
+from .metas import _get_metas_sincrono
+
+router = APIRouter()
+
+# --- TENDÊNCIA DO PAGAMENTO (vários períodos de uma vez) ---
+# Comparar prémios de KPI e de caixas ao longo de um ano eram 12 cálculos
+# completos do pagamento, cada um com a sua paginação no Supabase. Aqui as
+# viagens, as caixas e os indicadores do intervalo inteiro são lidos uma vez;
+# cada linha recebe a chave do seu período de pagamento (26 a 25), calculada
+# de forma vetorizada a partir da data, e as regras do Incentivo e das Caixas
+# são aplicadas a todos os períodos com operações agrupadas por essa chave.
+# O resultado de cada período é o mesmo do /pagamento para esse período.
+
+MAX_PERIODOS = 24
+_KPIS = (("dev_pdv", "dev_pdv", "<="), ("rating", "Rating_tx", ">="), ("refugo", "refugo", "<="))
+
+cache_tendencia = CacheResultados("tendencia")
+# Tabelas de que o resultado depende (a antiguidade é contada até hoje)
+FONTES_TENDENCIA = ["Distribuição", "Cadastro", "Resultados_Indicadores", "Caixas", "Metas", HOJE]
+
+def get_supabase(request: Request) -> Client:
+    return request.state.supabase
+
+# --- Chave do período ---
+def _chave_periodo(datas: pd.Series) -> np.ndarray:
+    """
+    Período de pagamento de cada data, como o mês do dia 26 em que começa
+    (ano * 12 + mês - 1). Datas inválidas ficam com -1.
+    """
+    datas = pd.to_datetime(datas, errors="coerce")
+    chave = datas.dt.year * 12 + datas.dt.month - 1 - (datas.dt.day < 26)
+    return chave.fillna(-1).astype(np.int64).to_numpy()
+
+def _datas_periodo(chave: int) -> Tuple[str, str]:
+    ano, mes = divmod(int(chave), 12)
+    inicio = datetime.date(ano, mes + 1, 26)
+    fim = (inicio + datetime.timedelta(days=32)).replace(day=25)
+    return inicio.isoformat(), fim.isoformat()
+
+# --- Incentivo (KPIs) por período ---
+def _incentivo_motoristas(dedup: pd.DataFrame, df_indicadores: Optional[pd.DataFrame], metas_motorista: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Uma linha por (periodo, cod) com o resultado de cada KPI e o prémio,
+    como processar_incentivos_sincrono em cada período.
+    """
+    motoristas = dedup[["periodo", "COD", "MOTORISTA"]].drop_duplicates(subset=["periodo", "COD"])
+    motoristas = pd.DataFrame({
+        "periodo": motoristas["periodo"].to_numpy(),
+        "cod": motoristas["COD"].astype(int).to_numpy(),
+        "nome": motoristas["MOTORISTA"].astype(str).str.strip().to_numpy(),
+    })
+
+    if df_indicadores is not None and not df_indicadores.empty:
+        indicadores = pd.DataFrame({
+            "periodo": _chave_periodo(df_indicadores["data_inicio_periodo"]),
+            "cod": pd.to_numeric(df_indicadores["Codigo_M"], errors="coerce"),
+            "fim": df_indicadores["data_fim_periodo"].astype(str),
+            **{kpi: pd.to_numeric(df_indicadores[coluna], errors="coerce") for kpi, coluna, _ in _KPIS},
+        })
+        # Só os indicadores do período exato (início e fim), como a leitura por período;
+        # com códigos repetidos fica o último (como o set_index().to_dict())
+        indicadores = indicadores[
+            (indicadores["periodo"] >= 0)
+            & (indicadores["fim"] == [_datas_periodo(p)[1] if p >= 0 else "" for p in indicadores["periodo"]])
+        ].dropna(subset=["cod"])
+        indicadores = indicadores.drop_duplicates(subset=["periodo", "cod"], keep="last").drop(columns="fim")
+        indicadores["cod"] = indicadores["cod"].astype(np.int64)
+        motoristas = motoristas.merge(indicadores, on=["periodo", "cod"], how="left")
+    else:
+        for kpi, _, _ in _KPIS:
+            motoristas[kpi] = np.nan
+
+    motoristas["premio_kpi"] = 0.0
+    for kpi, _, sentido in _KPIS:
+        atingido = motoristas[kpi] * 100
+        meta = metas_motorista.get(f"{kpi}_meta_perc", 0)
+        motoristas[f"{kpi}_passou"] = (atingido <= meta) if sentido == "<=" else (atingido >= meta)
+        motoristas["premio_kpi"] += np.where(motoristas[f"{kpi}_passou"], metas_motorista.get(f"{kpi}_premio", 0), 0.0)
+    return motoristas
+
+def _incentivo_ajudantes(dedup: pd.DataFrame, motoristas: pd.DataFrame, metas_ajudante: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Uma linha por (periodo, cod) de ajudante: herda o resultado dos KPIs do
+    motorista com quem mais viajou no período (a moda, como no xadrez).
+    """
+    melted = _preparar_dataframe_ajudantes(dedup)
+    melted["periodo"] = dedup["periodo"].loc[melted.index].to_numpy()
+
+    ajudantes = melted.drop_duplicates(subset=["periodo", "AJUDANTE_COD"])
+    ajudantes = pd.DataFrame({
+        "periodo": ajudantes["periodo"].to_numpy(),
+        "cod": ajudantes["AJUDANTE_COD"].astype(int).to_numpy(),
+        "nome": ajudantes["AJUDANTE_NOME"].to_numpy(),
+    })
+
+    # Moda do motorista por (periodo, ajudante); em empate, o código mais baixo (como Series.mode)
+    contagens = melted.groupby(["periodo", "AJUDANTE_COD", "MOTORISTA_COD"]).size().reset_index(name="n")
+    fixos = (
+        contagens.sort_values(["periodo", "AJUDANTE_COD", "n", "MOTORISTA_COD"], ascending=[True, True, False, True])
+        .drop_duplicates(subset=["periodo", "AJUDANTE_COD"])
+        .rename(columns={"AJUDANTE_COD": "cod", "MOTORISTA_COD": "motorista_fixo"})[["periodo", "cod", "motorista_fixo"]]
+    )
+    ajudantes = ajudantes.merge(fixos, on=["periodo", "cod"], how="left")
+
+    resultados = motoristas[motoristas["cod"] != 0][["periodo", "cod"] + [f"{kpi}_passou" for kpi, _, _ in _KPIS]]
+    ajudantes = ajudantes.merge(
+        resultados.rename(columns={"cod": "motorista_fixo"}), on=["periodo", "motorista_fixo"], how="left"
+    )
+    ajudantes["premio_kpi"] = 0.0
+    for kpi, _, _ in _KPIS:
+        passou = ajudantes[f"{kpi}_passou"].fillna(False).astype(bool) & (ajudantes["motorista_fixo"].fillna(0) != 0)
+        ajudantes["premio_kpi"] += np.where(passou, metas_ajudante.get(f"{kpi}_premio", 0), 0.0)
+    return ajudantes
+
+# --- Caixas por período ---
+def _caixas_por_periodo(
+    df: pd.DataFrame,
+    df_cadastro: Optional[pd.DataFrame],
+    df_caixas: Optional[pd.DataFrame],
+    metas: Dict[str, Any]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Caixas e prémio por (periodo, cod) para motoristas e ajudantes, como
+    processar_caixas_sincrono em cada período (todas as linhas das viagens).
+    """
+    (motorista_antiguidade_map, motorista_info_map,
+     ajudante_antiguidade_map, ajudante_info_map) = _mapas_cadastro(df_cadastro, datetime.date.today())
+
+    vazio = pd.DataFrame({
+        "periodo": pd.Series(dtype=np.int64), "cod": pd.Series(dtype=np.int64), "nome": pd.Series(dtype=object),
+        "total_caixas": pd.Series(dtype=float), "dias": pd.Series(dtype=np.int64),
+        "valor_por_caixa": pd.Series(dtype=float), "premio_caixas": pd.Series(dtype=float),
+    })
+    if df_caixas is None or df_caixas.empty:
+        return vazio, vazio.copy()
+
+    caixas = pd.DataFrame({"periodo": _chave_periodo(df_caixas["data"]), "mapa": df_caixas["mapa"].astype(str), "caixas": df_caixas["caixas"].astype(float)})
+    caixas = caixas.drop_duplicates(subset=["periodo", "mapa"])
+    viagens = pd.DataFrame({"periodo": df["periodo"].to_numpy(), "mapa": df["MAPA"].astype(str).to_numpy()}, index=df.index)
+    viagens = viagens.merge(caixas, on=["periodo", "mapa"], how="left").set_index(df.index)
+    com_caixas = viagens["caixas"].fillna(0) != 0
+
+    partes_motoristas = pd.DataFrame({
+        "periodo": viagens["periodo"], "cod": df["COD"].astype(int), "caixas": viagens["caixas"]
+    })[com_caixas]
+    partes_motoristas = partes_motoristas[partes_motoristas["cod"].isin(list(motorista_info_map))]
+
+    partes_ajudantes = []
+    for col in [col for col in df.columns if col.startswith("CODJ_")]:
+        cod = pd.to_numeric(df[col], errors="coerce")
+        validos = com_caixas & cod.notna() & (cod != 0)
+        parte = pd.DataFrame({"periodo": viagens["periodo"], "cod": cod, "caixas": viagens["caixas"]})[validos]
+        parte["cod"] = parte["cod"].astype(int)
+        partes_ajudantes.append(parte[parte["cod"].isin(list(ajudante_info_map))])
+
+    def somar(partes: List[pd.DataFrame], antiguidade_map: Dict[int, int], info_map: Dict[int, Dict[str, str]], metas_colaborador: Dict[str, Any]) -> pd.DataFrame:
+        partes = [parte for parte in partes if not parte.empty]
+        if not partes:
+            return vazio.copy()
+        somas = pd.concat(partes).groupby(["periodo", "cod"], sort=False)["caixas"].sum().reset_index(name="total_caixas")
+        somas = somas[somas["total_caixas"] != 0].copy()
+        somas["nome"] = [info_map.get(c, {}).get("nome", f"COD {c}") for c in somas["cod"]]
+        somas["dias"] = [antiguidade_map.get(c, 0) for c in somas["cod"]]  # antiguidade (escalão R$/caixa)
+        somas["valor_por_caixa"] = [_get_valor_por_caixa(d, metas_colaborador) for d in somas["dias"]]
+        somas["premio_caixas"] = somas["total_caixas"] * somas["valor_por_caixa"]
+        return somas
+
+    return (
+        somar([partes_motoristas], motorista_antiguidade_map, motorista_info_map, metas.get("motorista", {})),
+        somar(partes_ajudantes, ajudante_antiguidade_map, ajudante_info_map, metas.get("ajudante", {})),
+    )
+
+# --- Cálculo completo ---
+def _premios(
+    df: pd.DataFrame,
+    dedup: pd.DataFrame,
+    df_cadastro: Optional[pd.DataFrame],
+    df_caixas: Optional[pd.DataFrame],
+    df_indicadores: Optional[pd.DataFrame],
+    metas: Dict[str, Any]
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    motoristas_kpi = _incentivo_motoristas(dedup, df_indicadores, metas.get("motorista", {}))
+    ajudantes_kpi = _incentivo_ajudantes(dedup, motoristas_kpi, metas.get("ajudante", {}))
+    motoristas_caixas, ajudantes_caixas = _caixas_por_periodo(df, df_cadastro, df_caixas, metas)
+    return motoristas_kpi, ajudantes_kpi, motoristas_caixas, ajudantes_caixas
+
+@medir("calcular_tendencia")
+def calcular_tendencia_sincrono(
+    df_viagens: pd.DataFrame,
+    df_cadastro: Optional[pd.DataFrame],
+    df_caixas: Optional[pd.DataFrame],
+    df_indicadores: Optional[pd.DataFrame],
+    metas_periodos: List[Dict[str, Any]],
+    periodos: List[Tuple[str, str]]
+) -> Dict[str, Any]:
+    """
+    Totais por período e séries por colaborador (prémio de KPIs, de caixas
+    e total a pagar em cada período, pela ordem de 'periodos'). Cada período
+    usa as metas vigentes nele (metas_periodos, pela mesma ordem).
+    """
+    chaves = [int(_chave_periodo(pd.Series([inicio]))[0]) for inicio, _ in periodos]
+    df = df_viagens.copy()
+    df["periodo"] = _chave_periodo(df["DATA"])
+    df = df[df["periodo"].isin(chaves)]
+    # Sem duplicados por MAPA dentro de cada período (como o drop_duplicates de cada período)
+    dedup = df[~df.duplicated(subset=["periodo", "MAPA"])]
+
+    # Um cálculo agrupado por versão das metas (normalmente uma só para o intervalo todo)
+    grupos: Dict[str, Tuple[Dict[str, Any], List[int]]] = {}
+    for chave, metas in zip(chaves, metas_periodos):
+        grupos.setdefault(metas.get("versao"), (metas, []))[1].append(chave)
+    if len(grupos) == 1:
+        partes = [_premios(df, dedup, df_cadastro, df_caixas, df_indicadores, metas_periodos[0])]
+    else:
+        partes = [
+            _premios(df[df["periodo"].isin(chaves_grupo)], dedup[dedup["periodo"].isin(chaves_grupo)],
+                     df_cadastro, df_caixas, df_indicadores, metas)
+            for metas, chaves_grupo in grupos.values() if dedup["periodo"].isin(chaves_grupo).any()
+        ] or [_premios(df, dedup, df_cadastro, df_caixas, df_indicadores, metas_periodos[0])]
+    motoristas_kpi, ajudantes_kpi, motoristas_caixas, ajudantes_caixas = (
+        pd.concat([parte[i] for parte in partes], ignore_index=True) for i in range(4)
+    )
+
+    viagens_por_periodo = dedup.groupby("periodo").size()
+    totais = [{
+        "data_inicio": inicio, "data_fim": fim, "viagens": int(viagens_por_periodo.get(chave, 0)),
+        "versao_metas": metas.get("versao"),
+    } for chave, (inicio, fim), metas in zip(chaves, periodos, metas_periodos)]
+    posicao = {chave: i for i, chave in enumerate(chaves)}
+
+    colaboradores = {}
+    for tipo, kpi, caixas in (("motorista", motoristas_kpi, motoristas_caixas), ("ajudante", ajudantes_kpi, ajudantes_caixas)):
+        # Outer merge por (periodo, cod), como o _merge_resultados do pagamento
+        final = kpi[["periodo", "cod", "nome", "premio_kpi"]].merge(
+            caixas[["periodo", "cod", "nome", "premio_caixas"]], on=["periodo", "cod"], how="outer", suffixes=("", "_caixas")
+        )
+        final["nome"] = final["nome"].fillna(final["nome_caixas"])
+        final["premio_kpi"] = final["premio_kpi"].fillna(0)
+        final["premio_caixas"] = final["premio_caixas"].fillna(0)
+        final["total_a_pagar"] = final["premio_kpi"] + final["premio_caixas"]
+
+        por_periodo = final.groupby("periodo")[["premio_kpi", "premio_caixas", "total_a_pagar"]].sum()
+        contagem = final.groupby("periodo").size()
+        for chave, total in zip(chaves, totais):
+            linha = por_periodo.loc[chave] if chave in por_periodo.index else None
+            total[f"{tipo}s"] = {
+                "colaboradores": int(contagem.get(chave, 0)),
+                "premio_kpi": float(linha["premio_kpi"]) if linha is not None else 0.0,
+                "premio_caixas": float(linha["premio_caixas"]) if linha is not None else 0.0,
+                "total_a_pagar": float(linha["total_a_pagar"]) if linha is not None else 0.0,
+            }
+
+        # Séries por colaborador: uma posição por período (0 onde não aparece),
+        # com o nome do período mais recente
+        nomes = final.sort_values("periodo").drop_duplicates(subset=["cod"], keep="last").set_index("cod")["nome"]
+        series = {}
+        for cod, periodo, premio_kpi, premio_caixas, total_pagar in zip(
+            final["cod"].tolist(), final["periodo"].tolist(),
+            final["premio_kpi"].tolist(), final["premio_caixas"].tolist(), final["total_a_pagar"].tolist()
+        ):
+            serie = series.get(cod)
+            if serie is None:
+                serie = series[cod] = {
+                    "cod": int(cod), "nome": str(nomes[cod]),
+                    "premio_kpi": [0.0] * len(chaves), "premio_caixas": [0.0] * len(chaves), "total_a_pagar": [0.0] * len(chaves),
+                }
+            i = posicao[periodo]
+            serie["premio_kpi"][i], serie["premio_caixas"][i], serie["total_a_pagar"][i] = premio_kpi, premio_caixas, total_pagar
+        for serie in series.values():
+            serie["total"] = sum(serie["total_a_pagar"])
+        colaboradores[tipo] = sorted(series.values(), key=lambda s: (-s["total"], s["nome"]))
+
+    for total in totais:
+        total["total_a_pagar"] = total["motoristas"]["total_a_pagar"] + total["ajudantes"]["total_a_pagar"]
+    return {"periodos": totais, "colaboradores": colaboradores}
+
+async def _calcular_tendencia(
+    supabase: Client, periodos: List[Tuple[str, str]], metas_periodos: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    data_inicio, data_fim = periodos[0][0], periodos[-1][1]
+    # Uma leitura de cada tabela para o intervalo inteiro
+    armazem, error_viagens = await run_in_threadpool(obter_viagens, supabase, data_inicio, data_fim)
+    df_caixas, error_caixas = await run_in_threadpool(get_caixas_sincrono, supabase, data_inicio, data_fim)
+    df_indicadores, error_kpis = await run_in_threadpool(get_indicadores_periodos_sincrono, supabase, periodos[0][0], periodos[-1][0])
+    df_cadastro, error_cadastro = await run_in_threadpool(get_cadastro_sincrono, supabase)
+
+    error_message = error_viagens or error_cadastro or error_kpis or error_caixas
+    if armazem is None:
+        return {"periodos": [], "colaboradores": {"motorista": [], "ajudante": []}, "error_message": error_message}
+
+    resultado = await executar_calculo(
+        calcular_tendencia_sincrono,
+        armazem.viagens(data_inicio, data_fim), df_cadastro, df_caixas, df_indicadores, metas_periodos, periodos
+    )
+    return {**resultado, "error_message": error_message}
+
+# --- ROTA: Tendência (JSON) ---
+@router.get("/pagamento/tendencia")
+async def tendencia_pagamento(
+    periodos: int = 12,
+    data_fim: Optional[str] = None,
+    supabase: Client = Depends(get_supabase)
+):
+    """
+    Totais e séries por colaborador dos últimos 'periodos' períodos de
+    pagamento até ao que contém data_fim (por defeito, hoje).
+    """
+    try:
+        lista = periodos_pagamento(data_fim or datetime.date.today().isoformat(), max(1, min(periodos, MAX_PERIODOS)))
+    except ValueError:
+        return JSONResponse({"erro": f"Data inválida: '{data_fim}'."}, status_code=400)
+
+    # Chave com a versão das metas de cada período; se o último já fechou, o
+    # intervalo inteiro já não muda
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, FONTES_TENDENCIA)
+    metas_periodos = [await run_in_threadpool(_get_metas_sincrono, supabase, inicio) for inicio, _ in lista]
+    resultado = await cache_tendencia.obter_ou_calcular(
+        (tuple(lista), tuple(metas["versao"] for metas in metas_periodos)),
+        lambda: _calcular_tendencia(supabase, lista, metas_periodos),
+        versao=versao,
+        permanente=periodo_fechado(lista[-1][1])
+    )
+    return JSONResponse({
+        "periodos": resultado["periodos"],
+        "colaboradores": resultado["colaboradores"],
+        "erro": resultado.get("error_message"),
+        "dados_de": resultado.get("dados_de"),
+    }, headers={"Cache-Control": "private, max-age=30"})
@@ -1,28 +1,42 @@
-import datetime
 from fastapi import APIRouter, Request, Depends
-from fastapi.templating import Jinja2Templates
-from typing import Optional
+from fastapi.responses import JSONResponse
+from typing import Optional, Dict, Any
 from fastapi.concurrency import run_in_threadpool
 from supabase import Client
 import pandas as pd # Importe o pandas
+import numpy as np
 
 # Importa a nossa lógica partilhada
-from core.database import get_dados_apurados
+from core.database import get_cadastro_sincrono
+from core.viagens import obter_viagens, ArmazemViagens
+from core.nomes import pesquisa_nomes
 from core.analysis import gerar_dashboard_e_mapas
+from core.processos import executar_calculo
+from core.metricas import medir
+from core.render import render_pagina
+from core.periodo import resolver_datas_filtro
+from core.http_cache import validar_pedido
+from core.cache import CacheResultados
+from core.versoes import versao_fontes_sincrono
+from core.motor_sql import duckdb_ativo, equipas_periodo
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+
+# Resultados por (data_inicio, data_fim, pesquisa, vista)
+# (TTLs configuráveis em CACHE_TTL_XADREZ)
+cache_xadrez = CacheResultados("xadrez")
 
 # Função para obter o cliente Supabase do estado da request
 def get_supabase(request: Request) -> Client:
     return request.state.supabase
 
 # Função de processamento síncrono (para o thread pool)
-def processar_xadrez_sincrono(df, view_mode):
+@medir("processar_xadrez")
+def processar_xadrez_sincrono(df, view_mode, df_melted=None):
     resumo_viagens, dashboard_equipas = [], None
     
     if view_mode == 'equipas_fixas':
-        resultado_xadrez = gerar_dashboard_e_mapas(df)
+        resultado_xadrez = gerar_dashboard_e_mapas(df, df_melted)
         dashboard_equipas = resultado_xadrez["dashboard_data"]
     else: 
         # Lógica da vista "Detalhado"
@@ -39,6 +53,85 @@ def processar_xadrez_sincrono(df, view_mode):
         
     return resumo_viagens, dashboard_equipas
 
+def _viagens_xadrez(
+    armazem: ArmazemViagens, data_inicio: str, data_fim: str, search_str: str, view_mode: str,
+    df_cadastro: Optional[pd.DataFrame] = None
+):
+    """
+    Viagens sem duplicados (por MAPA) do período e, nas equipas fixas sem
+    pesquisa, os ajudantes em formato longo, ambos vindos do armazém partilhado.
+    Com pesquisa, as linhas vêm do índice de nomes (core/nomes.py).
+    Retorna (df, df_melted, error_message).
+    """
+    if search_str:
+        linhas = pesquisa_nomes(armazem, df_cadastro).linhas(search_str)
+        linhas = np.intersect1d(linhas, armazem.linhas(data_inicio, data_fim), assume_unique=True)
+        if len(linhas) == 0:
+            return None, None, f"Nenhum dado encontrado para o termo de busca: '{search_str}'"
+        df = armazem.df.iloc[linhas]
+        # Remove duplicatas depois da pesquisa
+        if 'MAPA' in df.columns:
+            df = df.drop_duplicates(subset=['MAPA'])
+        else:
+            # Fallback caso a coluna MAPA não exista (embora deva existir)
+            df = df.drop_duplicates()
+        return df, None, None
+
+    df = armazem.sem_duplicados(data_inicio, data_fim)
+    df_melted = armazem.ajudantes(data_inicio, data_fim) if view_mode == 'equipas_fixas' else None
+    return df, df_melted, None
+
+async def _calcular_xadrez(
+    supabase: Client, data_inicio: str, data_fim: str, search_str: str, view_mode: str
+) -> Dict[str, Any]:
+    """
+    Busca as viagens do período e monta a vista pedida (equipas fixas ou detalhado).
+    """
+    resumo_viagens, dashboard_equipas = [], None
+
+    # Equipas sem pesquisa: com MOTOR_CALCULO=duckdb calcula em SQL sobre as cópias Parquet
+    if view_mode == 'equipas_fixas' and not search_str and duckdb_ativo():
+        dashboard_equipas, error_message = await run_in_threadpool(
+            equipas_periodo, supabase, data_inicio, data_fim
+        )
+        return {
+            "error_message": error_message,
+            "resumo_viagens": resumo_viagens,
+            "dashboard_equipas": dashboard_equipas if error_message is None else None,
+        }
+
+    armazem, error_message = await run_in_threadpool(obter_viagens, supabase, data_inicio, data_fim)
+
+    df, df_melted = None, None
+    if error_message is None:
+        df_cadastro = None
+        if search_str:
+            # O Cadastro liga os nomes pesquisados aos códigos (em cache, ver get_cadastro_sincrono)
+            df_cadastro, _ = await run_in_threadpool(get_cadastro_sincrono, supabase, False)
+        df, df_melted, error_message = await run_in_threadpool(
+            _viagens_xadrez, armazem, data_inicio, data_fim, search_str, view_mode, df_cadastro
+        )
+
+    # 2. Processar dados (em thread pool)
+    if error_message is None and df is not None:
+        resumo_viagens, dashboard_equipas = await executar_calculo(
+            processar_xadrez_sincrono,
+            df,
+            view_mode,
+            df_melted
+        )
+
+    return {
+        "error_message": error_message,
+        "resumo_viagens": resumo_viagens,
+        "dashboard_equipas": dashboard_equipas,
+    }
+
+# Tabelas de que o relatório depende (versão para o ETag, ver core/versoes.py);
+# com pesquisa, o Cadastro liga os nomes aos códigos (core/nomes.py)
+FONTES_XADREZ = ["Distribuição"]
+FONTES_XADREZ_PESQUISA = ["Distribuição", "Cadastro"]
+
 @router.get("/")
 async def ler_relatorio_xadrez(
     request: Request, 
@@ -49,52 +142,59 @@ async def ler_relatorio_xadrez(
     supabase: Client = Depends(get_supabase)
 ):
     
-    hoje = datetime.date.today()
-    data_inicio = data_inicio or hoje.replace(day=1).isoformat()
-    data_fim = data_fim or hoje.isoformat()
+    data_inicio, data_fim = resolver_datas_filtro(data_inicio, data_fim)
     search_str = search_query or ""
-    
-    resumo_viagens, dashboard_equipas = [], None
 
-    df, error_message = await run_in_threadpool(
-        get_dados_apurados, 
-        supabase, 
-        data_inicio, 
-        data_fim, 
-        search_str
-    )
-    
-    # --- ALTERAÇÃO AQUI ---
-    # Remove duplicatas do DataFrame principal
-    if error_message is None and df is not None:
-        if 'MAPA' in df.columns:
-            df = df.drop_duplicates(subset=['MAPA'])
-        else:
-            # Fallback caso a coluna MAPA não exista (embora deva existir)
-            df = df.drop_duplicates() 
-    # --- FIM DA ALTERAÇÃO ---
+    # GET condicional: se o browser já tem esta versão, 304 sem tocar no pandas
+    fontes = FONTES_XADREZ_PESQUISA if search_str else FONTES_XADREZ
+    validacao = await validar_pedido(request, supabase, fontes)
+    if validacao.resposta_304 is not None:
+        return validacao.resposta_304
 
-    # 2. Processar dados (em thread pool)
-    if error_message is None and df is not None:
-        resumo_viagens, dashboard_equipas = await run_in_threadpool(
-            processar_xadrez_sincrono,
-            df,
-            view_mode
-        )
+    resultado = await cache_xadrez.obter_ou_calcular(
+        (data_inicio, data_fim, search_str, view_mode),
+        lambda: _calcular_xadrez(supabase, data_inicio, data_fim, search_str, view_mode),
+        versao=validacao.versao
+    )
 
-    return templates.TemplateResponse("index.html", {
-        "request": request, 
+    return render_pagina(request, {
         "main_tab": "xadrez",
         "view_mode": view_mode,
         "data_inicio_selecionada": data_inicio,
         "data_fim_selecionada": data_fim,
         "search_query": search_str,
-        "error_message": error_message,
-        "resumo_viagens": resumo_viagens,
-        "dashboard_equipas": dashboard_equipas,
-        "incentivo_tab": "motoristas",
-        "incentivo_motoristas": [],
-        "incentivo_ajudantes": [],
-        "metas": {},
-        "caixas_tab": "motoristas",
-    })
\ No newline at end of file
+        **resultado,
+    }, headers=validacao.cabecalhos(resultado))
+
+# --- Sugestões de nomes para a caixa de pesquisa (a cada tecla) ---
+def _sugestoes_sincrono(supabase: Client, data_inicio: str, data_fim: str, termo: str) -> list:
+    armazem, error_message = obter_viagens(supabase, data_inicio, data_fim)
+    if error_message is not None:
+        return []
+    df_cadastro, _ = get_cadastro_sincrono(supabase, copiar=False)
+    return pesquisa_nomes(armazem, df_cadastro).sugestoes(termo)
+
+@router.get("/sugestoes")
+async def sugerir_nomes(
+    q: str = "",
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    supabase: Client = Depends(get_supabase)
+):
+    data_inicio, data_fim = resolver_datas_filtro(data_inicio, data_fim)
+    sugestoes = await run_in_threadpool(_sugestoes_sincrono, supabase, data_inicio, data_fim, q)
+    # Depende só dos dados em memória: o browser pode reaproveitar durante pouco tempo
+    return JSONResponse(sugestoes, headers={"Cache-Control": "private, max-age=30"})
+
+# --- Aquecimento (chamado no arranque da app, ver main.py) ---
+async def aquecer(supabase: Client, data_inicio_filtro: str, data_fim_filtro: str):
+    """
+    Calcula e guarda na cache o resultado do período, com a mesma chave e
+    versão que a rota usaria.
+    """
+    versao = await run_in_threadpool(versao_fontes_sincrono, supabase, FONTES_XADREZ)
+    await cache_xadrez.obter_ou_calcular(
+        (data_inicio_filtro, data_fim_filtro, "", "equipas_fixas"),
+        lambda: _calcular_xadrez(supabase, data_inicio_filtro, data_fim_filtro, "", "equipas_fixas"),
+        versao=versao
+    )